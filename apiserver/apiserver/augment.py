@@ -8,8 +8,9 @@ import prometheus_client
 import shutil
 import zipfile
 
+from datamart_augmentation import join_index_column
 from datamart_augmentation.augmentation import AugmentationError
-from datamart_core.augment import augment
+from datamart_core.augment import augment, get_join_index
 from datamart_core.common import hash_json, contextdecorator
 from datamart_core.materialize import get_dataset, make_zip_recursive
 from datamart_core.prom import PromMeasureRequest
@@ -186,6 +187,26 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                     newdata = stack.enter_context(
                         get_dataset(metadata, task['id'], format='csv'),
                     )
+                    # Get the index of the join column, to only read the
+                    # rows that match
+                    join_index = None
+                    if task['augmentation']['type'] == 'join':
+                        column = join_index_column(
+                            task['augmentation']['right_columns'],
+                            metadata,
+                        )
+                        if column is not None:
+                            try:
+                                join_index = stack.enter_context(
+                                    get_join_index(
+                                        metadata, task['id'], newdata, column,
+                                    ),
+                                )
+                            except Exception:
+                                logger.exception(
+                                    "Error building join index, reading "
+                                    "whole dataset",
+                                )
                     # Get input data if it's a reference to a dataset
                     if data_id:
                         path = stack.enter_context(
@@ -204,6 +225,8 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                         task,
                         writer,
                         columns=columns,
+                        join_index=join_index,
+                        workers=self.application.augment_workers,
                     )
 
                     # ZIP result if it's a directory
@@ -12,6 +12,7 @@ import zipfile
 from datamart_core.common import log_future
 from datamart_geo import GeoData
 from datamart_materialize import get_writer
+from datamart_profiler import open_geocode_cache
 
 from .graceful_shutdown import GracefulApplication
 
@@ -161,7 +162,17 @@ class Application(GracefulApplication):
             logger.warning(
                 "$NOMINATIM_URL is not set, not resolving addresses"
             )
+        if self.nominatim and os.environ.get('NOMINATIM_CACHE'):
+            self.nominatim_cache = open_geocode_cache(
+                os.environ['NOMINATIM_CACHE'],
+            )
+        else:
+            self.nominatim_cache = None
         self.geo_data = GeoData.from_local_cache()
+        if os.environ.get('AUGMENT_WORKERS'):
+            self.augment_workers = int(os.environ['AUGMENT_WORKERS'])
+        else:
+            self.augment_workers = None
         self.channel = None
 
         self.custom_fields = {}
@@ -136,6 +136,7 @@ class ProfilePostedData(tornado.web.RequestHandler):
                             data=data,
                             lazo_client=self.application.lazo_client,
                             nominatim=self.application.nominatim,
+                            nominatim_cache=self.application.nominatim_cache,
                             geo_data=self.application.geo_data,
                             search=True,
                             include_sample=True,
@@ -0,0 +1,96 @@
+"""Benchmarks of joins with a companion dataset.
+"""
+
+import numpy
+import os
+import pandas
+import tempfile
+
+from .datasets import DATA_DIR, SEED, _format_floats
+
+
+ROWS = [100000, 1000000]
+
+
+def load_augmentation():
+    """Import the augmentation library, or skip the benchmark.
+    """
+    try:
+        from datamart_augmentation import join
+        from datamart_materialize import make_writer, types
+    except ImportError:
+        raise NotImplementedError("datamart_augmentation is not available")
+    return join, make_writer, types
+
+
+def make_companion(rows):
+    """Get the path to a companion dataset, with 4 rows per key on average.
+    """
+    path = os.path.join(DATA_DIR, 'companion-%d.csv' % rows)
+    if not os.path.exists(path):
+        rng = numpy.random.default_rng([SEED, rows])
+        os.makedirs(DATA_DIR, exist_ok=True)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        pandas.DataFrame({
+            'key': rng.integers(0, rows // 4, rows),
+            'value': _format_floats(rng.normal(50, 10, rows), 3),
+            'count': rng.integers(0, 1000, rows),
+        }).to_csv(temp, index=False)
+        os.rename(temp, path)
+    return path
+
+
+class Join(object):
+    """Joining a companion dataset, serially or in worker processes.
+    """
+    params = ([1, 2, 4], ROWS)
+    param_names = ['workers', 'rows']
+    timeout = 600
+
+    def setup(self, workers, rows):
+        self.join, self.make_writer, types = load_augmentation()
+        if workers > (os.cpu_count() or 1):
+            raise NotImplementedError("only %d CPUs" % os.cpu_count())
+        self.path = make_companion(rows)
+        self.original = pandas.DataFrame({
+            'key': numpy.arange(rows // 4).astype(str),
+        })
+
+        def column(name, structural_type):
+            return {
+                'name': name,
+                'structural_type': structural_type,
+                'semantic_types': [],
+            }
+
+        self.original_metadata = {
+            'columns': [column('key', types.INTEGER)],
+        }
+        self.augment_metadata = {
+            'columns': [
+                column('key', types.INTEGER),
+                column('value', types.FLOAT),
+                column('count', types.INTEGER),
+            ],
+        }
+        self.tmp = tempfile.mkdtemp(prefix='auctus-bench-')
+        # Load the writers once, outside of the measurements
+        self.make_writer(os.path.join(self.tmp, 'result.csv'))
+
+    def teardown(self, workers, rows):
+        result = os.path.join(self.tmp, 'result.csv')
+        if os.path.exists(result):
+            os.remove(result)
+        os.rmdir(self.tmp)
+
+    def time_join(self, workers, rows):
+        self.join(
+            self.original.copy(),
+            self.path,
+            self.original_metadata,
+            self.augment_metadata,
+            self.make_writer(os.path.join(self.tmp, 'result.csv')),
+            [[0]],
+            [[0]],
+            workers=workers,
+        )
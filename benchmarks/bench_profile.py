@@ -0,0 +1,56 @@
+"""End-to-end benchmarks of `process_dataset()`.
+"""
+
+from datamart_profiler import process_dataset
+
+from .datasets import make_dataset
+from .stubs import NOMINATIM_URL, FakeLazoClient, offline_services
+
+
+ROWS = [1000, 10000, 100000]
+
+
+def load_geo_data():
+    """Load the administrative areas, or skip the benchmark.
+    """
+    import datamart_geo
+
+    try:
+        return datamart_geo.GeoData.from_local_cache()
+    except FileNotFoundError:
+        raise NotImplementedError("datamart_geo data is not available")
+
+
+class ProcessDataset(object):
+    params = (
+        ['numeric', 'dates', 'points', 'latlong', 'admin', 'addresses',
+         'text', 'wide'],
+        ROWS,
+    )
+    param_names = ['kind', 'rows']
+    timeout = 600
+
+    def setup(self, kind, rows):
+        self.path = make_dataset(kind, rows)
+        self.geo_data = load_geo_data() if kind == 'admin' else None
+
+    def _profile(self, search):
+        with offline_services():
+            process_dataset(
+                self.path,
+                lazo_client=FakeLazoClient(),
+                nominatim=NOMINATIM_URL,
+                geo_data=self.geo_data,
+                search=search,
+                coverage=True,
+                plots=True,
+            )
+
+    def time_process_dataset(self, kind, rows):
+        self._profile(search=False)
+
+    def time_process_dataset_search(self, kind, rows):
+        self._profile(search=True)
+
+    def peakmem_process_dataset(self, kind, rows):
+        self._profile(search=False)
@@ -0,0 +1,138 @@
+"""Benchmarks of the individual stages of the profiler.
+
+The stage functions are imported in ``setup()``, so that the benchmarks of
+stages that don't exist in the version of the profiler being measured are
+skipped, instead of failing the import of this module.
+"""
+
+import importlib
+
+from datamart_profiler.core import MAX_GEOHASHES, MAX_SIZE
+
+from .datasets import generate, make_large_dataset
+
+
+ROWS = [1000, 10000, 100000]
+
+COLUMNS = {
+    'integers': ('numeric', 'large_int'),
+    'floats': ('numeric', 'normal'),
+    'dates_iso': ('dates', 'date_iso'),
+    'dates_us': ('dates', 'date_us'),
+    'dates_text': ('dates', 'date_text'),
+    'years': ('dates', 'year'),
+    'latitudes': ('latlong', 'latitude'),
+    'points': ('points', 'location'),
+    'text': ('text', 'description'),
+    'high_cardinality': ('text', 'high_cardinality'),
+    'low_cardinality': ('text', 'low_cardinality'),
+}
+
+
+def get_stage(module, name):
+    """Import a function from the profiler, or skip the benchmark.
+    """
+    try:
+        return getattr(
+            importlib.import_module('datamart_profiler.' + module),
+            name,
+        )
+    except (ImportError, AttributeError):
+        raise NotImplementedError(
+            "datamart_profiler.%s.%s is not available" % (module, name),
+        )
+
+
+def get_column(name, rows):
+    kind, column = COLUMNS[name]
+    return generate(kind, rows)[column]
+
+
+class IdentifyTypes(object):
+    params = (list(COLUMNS), ROWS)
+    param_names = ['column', 'rows']
+
+    def setup(self, column, rows):
+        self.identify_types = get_stage('profile_types', 'identify_types')
+        self.values = get_column(column, rows)
+
+    def time_identify_types(self, column, rows):
+        self.identify_types(self.values, COLUMNS[column][1], None)
+
+    def peakmem_identify_types(self, column, rows):
+        self.identify_types(self.values, COLUMNS[column][1], None)
+
+
+class NumericalRanges(object):
+    params = (['floats', 'integers'], ROWS)
+    param_names = ['column', 'rows']
+
+    def setup(self, column, rows):
+        self.get_numerical_ranges = get_stage(
+            'numerical', 'get_numerical_ranges',
+        )
+        self.values = get_column(column, rows).astype(float).values
+
+    def time_numerical_ranges(self, column, rows):
+        self.get_numerical_ranges(self.values)
+
+
+class Geohashing(object):
+    params = ROWS
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.parse_wkt_column = get_stage('spatial', 'parse_wkt_column')
+        self.Geohasher = get_stage('spatial', 'Geohasher')
+        self.wkt = get_column('points', rows)
+        self.points = self.parse_wkt_column(self.wkt)
+
+    def time_parse_wkt(self, rows):
+        self.parse_wkt_column(self.wkt)
+
+    def time_geohashes(self, rows):
+        builder = self.Geohasher(number=MAX_GEOHASHES)
+        builder.add_points(self.points)
+        builder.get_hashes_json()
+
+
+class TemporalResolution(object):
+    params = (['dates_iso', 'dates_us', 'years'], ROWS)
+    param_names = ['column', 'rows']
+
+    def setup(self, column, rows):
+        self.get_temporal_resolution = get_stage(
+            'temporal', 'get_temporal_resolution',
+        )
+        # Like identify_types(), which only recognizes years if the column
+        # is called "year"
+        if column == 'years':
+            self.parse = get_stage('profile_types', 'parse_years')
+        else:
+            self.parse = get_stage('temporal', 'parse_dates')
+        self.values = get_column(column, rows).values
+        self.dates = [dt for dt in self.parse(self.values) if dt is not None]
+
+    def time_parse_dates(self, column, rows):
+        self.parse(self.values)
+
+    def time_temporal_resolution(self, column, rows):
+        self.get_temporal_resolution(self.dates)
+
+
+class LoadData(object):
+    """Loading, and sampling if it is too big, a CSV file.
+    """
+    params = [2 * MAX_SIZE, 10 * MAX_SIZE]
+    param_names = ['size']
+    timeout = 600
+
+    def setup(self, size):
+        self.load_data = get_stage('core', 'load_data')
+        self.path = make_large_dataset(size)
+
+    def time_load_data(self, size):
+        self.load_data(self.path, load_max_size=MAX_SIZE)
+
+    def peakmem_load_data(self, size):
+        self.load_data(self.path, load_max_size=MAX_SIZE)
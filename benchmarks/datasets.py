@@ -0,0 +1,222 @@
+"""Deterministic synthetic datasets for the benchmarks.
+
+The files are generated on first use and cached, by default in a directory
+under the system's temporary directory (set ``BENCHMARK_DATA_DIR`` to
+change it). The same kind and number of rows always produce the same file.
+"""
+
+import numpy
+import os
+import pandas
+import tempfile
+
+
+SEED = 42
+
+DATA_DIR = os.environ.get(
+    'BENCHMARK_DATA_DIR',
+    os.path.join(tempfile.gettempdir(), 'auctus-benchmarks'),
+)
+
+WORDS = (
+    'the of and to in is was for on are with as by at from that this an be '
+    'city county street avenue school park river station market public '
+    'water health police fire permit license complaint inspection building '
+    'north south east west new old central upper lower main first second '
+    'report record service request open closed pending approved denied '
+    'data value total average number count rate percent year month day'
+).split()
+
+COUNTRIES = [
+    'United States', 'Canada', 'Mexico', 'Brazil', 'Argentina', 'France',
+    'Germany', 'Spain', 'Italy', 'Portugal', 'Netherlands', 'Belgium',
+    'Poland', 'Sweden', 'Norway', 'Finland', 'Japan', 'China', 'India',
+    'Australia', 'Egypt', 'Kenya', 'Nigeria', 'Morocco', 'Chile', 'Peru',
+]
+
+CATEGORIES = ['residential', 'commercial', 'industrial', 'mixed', 'other']
+
+DATE_FORMATS = {
+    'date_iso': '%Y-%m-%dT%H:%M:%S',
+    'date_us': '%m/%d/%Y',
+    'date_text': '%d %b %Y %H:%M',
+    'year': '%Y',
+}
+
+
+def _timestamps(rng, rows):
+    start = pandas.Timestamp('1990-01-01').value // 10 ** 9
+    end = pandas.Timestamp('2021-01-01').value // 10 ** 9
+    seconds = rng.integers(start, end, rows)
+    return pandas.to_datetime(seconds, unit='s')
+
+
+def _sentences(rng, rows):
+    lengths = rng.integers(5, 13, rows)
+    words = numpy.array(WORDS, dtype=object)[
+        rng.integers(0, len(WORDS), int(lengths.sum()))
+    ]
+    ends = numpy.cumsum(lengths)
+    return [
+        ' '.join(words[end - length:end])
+        for end, length in zip(ends, lengths)
+    ]
+
+
+def _hex_ids(rng, rows):
+    return ['%016x' % v for v in rng.integers(0, 2 ** 62, rows)]
+
+
+def _format_floats(values, decimals):
+    return numpy.char.mod('%.{0}f'.format(decimals), values)
+
+
+def numeric(rng, rows):
+    mixture = numpy.concatenate([
+        rng.normal(0, 1, rows // 2),
+        rng.normal(20, 2, rows // 3),
+        rng.normal(100, 5, rows - rows // 2 - rows // 3),
+    ])
+    rng.shuffle(mixture)
+    return pandas.DataFrame({
+        'id': numpy.arange(rows),
+        'normal': _format_floats(rng.normal(50, 10, rows), 3),
+        'mixture': _format_floats(mixture, 4),
+        'small_int': rng.integers(0, 10, rows),
+        'large_int': rng.integers(-10 ** 9, 10 ** 9, rows),
+    })
+
+
+def dates(rng, rows):
+    return pandas.DataFrame({
+        name: _timestamps(rng, rows).strftime(fmt)
+        for name, fmt in DATE_FORMATS.items()
+    })
+
+
+def points(rng, rows):
+    lat = rng.uniform(40.5, 40.9, rows)
+    long = rng.uniform(-74.25, -73.7, rows)
+    return pandas.DataFrame({
+        'id': numpy.arange(rows),
+        'location': numpy.char.add(
+            numpy.char.add('POINT (', _format_floats(long, 6)),
+            numpy.char.add(' ', numpy.char.add(_format_floats(lat, 6), ')')),
+        ),
+        'category': numpy.array(CATEGORIES)[
+            rng.integers(0, len(CATEGORIES), rows)
+        ],
+    })
+
+
+def latlong(rng, rows):
+    return pandas.DataFrame({
+        'id': numpy.arange(rows),
+        'latitude': _format_floats(rng.uniform(-60, 70, rows), 5),
+        'longitude': _format_floats(rng.uniform(-170, 170, rows), 5),
+        'value': _format_floats(rng.exponential(10, rows), 2),
+    })
+
+
+def admin(rng, rows):
+    return pandas.DataFrame({
+        'country': numpy.array(COUNTRIES)[
+            rng.integers(0, len(COUNTRIES), rows)
+        ],
+        'value': rng.integers(0, 1000, rows),
+    })
+
+
+def addresses(rng, rows):
+    # Few distinct addresses, like most real datasets
+    numbers = rng.integers(1, 500, rows // 10 + 1)
+    streets = numpy.array(WORDS)[rng.integers(0, len(WORDS), len(numbers))]
+    distinct = [
+        '%d %s St, New York, NY' % (n, s.title())
+        for n, s in zip(numbers, streets)
+    ]
+    return pandas.DataFrame({
+        'address': numpy.array(distinct)[
+            rng.integers(0, len(distinct), rows)
+        ],
+        'value': rng.integers(0, 1000, rows),
+    })
+
+
+def text(rng, rows):
+    return pandas.DataFrame({
+        'description': _sentences(rng, rows),
+        'high_cardinality': _hex_ids(rng, rows),
+        'low_cardinality': numpy.array(CATEGORIES)[
+            rng.integers(0, len(CATEGORIES), rows)
+        ],
+        'flag': numpy.array(['yes', 'no'])[rng.integers(0, 2, rows)],
+    })
+
+
+def wide(rng, rows):
+    # 100 columns, cycling through the column types of the other datasets
+    narrow = [
+        numeric(rng, rows), dates(rng, rows), points(rng, rows),
+        text(rng, rows),
+    ]
+    columns = {}
+    i = 0
+    while len(columns) < 100:
+        frame = narrow[i % len(narrow)]
+        name = frame.columns[(i // len(narrow)) % frame.shape[1]]
+        columns['%s_%d' % (name, i)] = frame[name]
+        i += 1
+    return pandas.DataFrame(columns)
+
+
+GENERATORS = {
+    'numeric': numeric,
+    'dates': dates,
+    'points': points,
+    'latlong': latlong,
+    'admin': admin,
+    'addresses': addresses,
+    'text': text,
+    'wide': wide,
+}
+
+
+def generate(kind, rows):
+    """Generate a synthetic dataset as a DataFrame of strings.
+    """
+    rng = numpy.random.default_rng([SEED, rows, sorted(GENERATORS).index(kind)])
+    return GENERATORS[kind](rng, rows).astype(str)
+
+
+def make_dataset(kind, rows):
+    """Get the path to a synthetic CSV file, generating it if needed.
+    """
+    path = os.path.join(DATA_DIR, '%s-%d.csv' % (kind, rows))
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        generate(kind, rows).to_csv(temp, index=False)
+        os.rename(temp, path)
+    return path
+
+
+def make_large_dataset(size):
+    """Get the path to a synthetic CSV file of about `size` bytes.
+    """
+    path = os.path.join(DATA_DIR, 'large-%d.csv' % size)
+    if not os.path.exists(path):
+        sample = make_dataset('numeric', 10000)
+        with open(sample, 'rb') as fp:
+            header = fp.readline()
+            body = fp.read()
+        os.makedirs(DATA_DIR, exist_ok=True)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as fp:
+            fp.write(header)
+            written = len(header)
+            while written < size:
+                fp.write(body)
+                written += len(body)
+        os.rename(temp, path)
+    return path
@@ -0,0 +1,95 @@
+"""Compare the clustering engines used to compute numerical ranges.
+
+This runs `get_numerical_ranges()` with `ckmeans_clusters()` and with
+`kmeans_clusters()` on the numerical and temporal columns of the test data,
+plus some larger synthetic columns, and reports the time taken, the
+within-cluster sum of squares, and whether the ranges are the same.
+
+Usage: python benchmarks/ranges.py
+"""
+
+import numpy
+import os
+import pandas
+import time
+
+from datamart_profiler.numerical import N_RANGES, ckmeans_clusters, \
+    get_numerical_ranges, kmeans_clusters
+from datamart_profiler.temporal import parse_dates
+
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+ENGINES = [
+    ('ckmeans', ckmeans_clusters),
+    ('kmeans', kmeans_clusters),
+]
+
+
+def test_data_columns():
+    for filename in sorted(os.listdir(DATA)):
+        if not filename.endswith('.csv'):
+            continue
+        data = pandas.read_csv(
+            os.path.join(DATA, filename),
+            dtype=str, na_filter=False,
+        )
+        for name in data.columns:
+            column = data[name]
+            numbers = pandas.to_numeric(column, errors='coerce')
+            if numbers.notna().mean() > 0.9:
+                yield '%s:%s' % (filename, name), numbers.dropna().values
+                continue
+            dates = [dt for dt in parse_dates(column.values) if dt is not None]
+            if len(dates) > 0.9 * len(column):
+                yield (
+                    '%s:%s' % (filename, name),
+                    numpy.array([dt.timestamp() for dt in dates]),
+                )
+
+
+def synthetic_columns():
+    rand = numpy.random.default_rng(0)
+    for size in (10000, 100000, 500000):
+        yield 'normal-%d' % size, rand.normal(size=size)
+        yield 'integers-%d' % size, rand.integers(0, 1000, size) * 1.0
+        yield 'mixture-%d' % size, numpy.concatenate([
+            rand.normal(0, 1, size // 2),
+            rand.normal(20, 2, size // 3),
+            rand.normal(100, 5, size - size // 2 - size // 3),
+        ])
+
+
+def sum_of_squares(values, breaks):
+    values = numpy.sort(values)
+    return sum(
+        float(((cluster - cluster.mean()) ** 2).sum())
+        for cluster in numpy.split(values, breaks)
+        if len(cluster)
+    )
+
+
+def main():
+    print(
+        '%-40s %8s' % ('column', 'values')
+        + ''.join(' %10s %12s' % (e + ' s', e + ' SS') for e, _ in ENGINES)
+        + ' same'
+    )
+    for name, values in list(test_data_columns()) + list(synthetic_columns()):
+        line = '%-40s %8d' % (name[:40], len(values))
+        results = []
+        for _, engine in ENGINES:
+            start = time.perf_counter()
+            ranges = get_numerical_ranges(values.tolist(), clustering=engine)
+            elapsed = time.perf_counter() - start
+            breaks = engine(numpy.sort(values), N_RANGES)
+            line += ' %10.4f %12.6g' % (
+                elapsed, sum_of_squares(values, breaks),
+            )
+            results.append(ranges)
+        line += ' %s' % ('yes' if results[0] == results[1] else 'no')
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
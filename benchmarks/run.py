@@ -0,0 +1,278 @@
+"""Run the profiler benchmarks, and compare results between commits.
+
+The benchmarks follow the conventions of airspeed velocity (asv): classes in
+the ``bench_*`` modules, with ``params`` and ``param_names`` attributes, a
+``setup()`` method (raising `NotImplementedError` to skip), and methods named
+``time_*`` (measuring run time) or ``peakmem_*`` (measuring peak memory).
+This runner doesn't need asv or network access, Lazo and Nominatim are
+replaced by stubs.
+
+Peak memory is the peak of the memory allocations traced by `tracemalloc`,
+which include the buffers of numpy arrays.
+
+Usage:
+    python -m benchmarks.run run [-b REGEX] [--quick] [-o results.json]
+    python -m benchmarks.run compare before.json after.json
+    python -m benchmarks.run continuous [-b REGEX] [--quick] BASE [HEAD]
+
+The ``continuous`` command checks out both commits in temporary git
+worktrees, runs the benchmarks of the current checkout against the
+``datamart_profiler`` of each, and compares the results.
+"""
+
+import argparse
+import gc
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+
+MIN_REPEAT_TIME = 1.0  # Repeat fast benchmarks for at least this long
+MAX_REPEAT = 10
+
+
+def discover(pattern=None):
+    """Find the benchmarks, as ``(name, class, method name)`` tuples.
+    """
+    package = importlib.import_module('benchmarks')
+    for info in pkgutil.iter_modules(package.__path__):
+        if not info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + info.name)
+        for cls_name, cls in sorted(vars(module).items()):
+            if (
+                not isinstance(cls, type)
+                or cls.__module__ != module.__name__
+            ):
+                continue
+            for method in sorted(dir(cls)):
+                if not method.startswith(('time_', 'peakmem_')):
+                    continue
+                name = '%s.%s.%s' % (info.name, cls_name, method)
+                if pattern is None or re.search(pattern, name):
+                    yield name, cls, method
+
+
+def parameters(cls):
+    """Get the combinations of parameters of a benchmark class.
+    """
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if params and all(isinstance(p, (list, tuple)) for p in params):
+        return list(itertools.product(*params))
+    return [(p,) for p in params]
+
+
+def measure(instance, method, args, quick):
+    func = getattr(instance, method)
+    if method.startswith('peakmem_'):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
+
+    times = []
+    total = 0.0
+    while True:
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+        if quick or total >= MIN_REPEAT_TIME or len(times) >= MAX_REPEAT:
+            break
+    return statistics.median(times)
+
+
+def run(pattern=None, quick=False, output=None):
+    import datamart_profiler
+
+    results = {}
+    for name, cls, method in discover(pattern):
+        for args in parameters(cls):
+            key = '%s(%s)' % (name, ', '.join(repr(a) for a in args))
+            instance = cls()
+            try:
+                if hasattr(instance, 'setup'):
+                    instance.setup(*args)
+            except NotImplementedError as e:
+                print('%-70s skipped: %s' % (key, e), flush=True)
+                continue
+            try:
+                value = measure(instance, method, args, quick)
+            except Exception as e:
+                print('%-70s failed: %r' % (key, e), flush=True)
+                results[key] = None
+                continue
+            finally:
+                if hasattr(instance, 'teardown'):
+                    instance.teardown(*args)
+            results[key] = value
+            print('%-70s %s' % (key, format_value(key, value)), flush=True)
+
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(
+                {
+                    'profiler': os.path.dirname(datamart_profiler.__file__),
+                    'python': sys.version,
+                    'results': results,
+                },
+                fp, indent=2, sort_keys=True,
+            )
+    return results
+
+
+def format_value(key, value):
+    if value is None:
+        return 'failed'
+    elif '.peakmem_' in key:
+        return '%.1fM' % (value / 1e6)
+    else:
+        return '%.4fs' % value
+
+
+def compare(before, after, factor=0.1):
+    """Print the results side by side.
+
+    Lines are marked with ``+`` if the result got worse by more than
+    `factor`, ``-`` if it got better by more than that, or ``x`` if the
+    benchmark fails on one side only.
+    """
+    print('   %-70s %10s %10s %7s' % ('benchmark', 'before', 'after', 'ratio'))
+    for key in sorted(set(before) | set(after)):
+        old, new = before.get(key), after.get(key)
+        if old is None and new is None:
+            continue
+        if old is None or new is None:
+            mark, ratio = 'x', ''
+        else:
+            ratio_value = new / old if old else float('inf')
+            if ratio_value > 1 + factor:
+                mark = '+'
+            elif ratio_value < 1 / (1 + factor):
+                mark = '-'
+            else:
+                mark = ' '
+            ratio = '%.2f' % ratio_value
+        print(
+            '%s  %-70s %10s %10s %7s' % (
+                mark, key,
+                '' if old is None else format_value(key, old),
+                '' if new is None else format_value(key, new),
+                ratio,
+            ),
+            flush=True,
+        )
+
+
+def run_commit(commit, pattern, quick, output):
+    """Run the benchmarks against the profiler from a given commit.
+    """
+    worktree = tempfile.mkdtemp(prefix='auctus-bench-')
+    try:
+        subprocess.check_call(
+            ['git', 'worktree', 'add', '--detach', worktree, commit],
+            cwd=ROOT,
+        )
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.join(worktree, 'lib_profiler'), ROOT]
+            + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+        )
+        cmd = [sys.executable, '-m', 'benchmarks.run', 'run', '-o', output]
+        if pattern is not None:
+            cmd.extend(['-b', pattern])
+        if quick:
+            cmd.append('--quick')
+        print("Running benchmarks on %s" % commit, flush=True)
+        subprocess.check_call(cmd, cwd=ROOT, env=env)
+    finally:
+        subprocess.call(
+            ['git', 'worktree', 'remove', '--force', worktree],
+            cwd=ROOT,
+        )
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def load_results(path):
+    with open(path) as fp:
+        return json.load(fp)['results']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the profiler benchmarks",
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_run = subparsers.add_parser('run', help="Run the benchmarks")
+    parser_compare = subparsers.add_parser(
+        'compare', help="Compare two result files",
+    )
+    parser_continuous = subparsers.add_parser(
+        'continuous', help="Run the benchmarks on two commits and compare",
+    )
+    for p in (parser_run, parser_continuous):
+        p.add_argument(
+            '-b', '--bench', default=None,
+            help="Regular expression selecting the benchmarks to run",
+        )
+        p.add_argument(
+            '--quick', action='store_true', default=False,
+            help="Run each benchmark only once",
+        )
+    parser_run.add_argument(
+        '-o', '--output', default=None, help="Write results to JSON file",
+    )
+    parser_compare.add_argument('before')
+    parser_compare.add_argument('after')
+    parser_continuous.add_argument('base')
+    parser_continuous.add_argument('head', nargs='?', default='HEAD')
+    for p in (parser_compare, parser_continuous):
+        p.add_argument(
+            '-f', '--factor', type=float, default=0.1,
+            help="Changes bigger than this are reported (default: 0.1)",
+        )
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args.bench, args.quick, args.output)
+    elif args.command == 'compare':
+        compare(
+            load_results(args.before), load_results(args.after),
+            args.factor,
+        )
+    elif args.command == 'continuous':
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = []
+            for i, commit in enumerate((args.base, args.head)):
+                output = os.path.join(tmp, '%d.json' % i)
+                run_commit(commit, args.bench, args.quick, output)
+                outputs.append(output)
+            compare(
+                load_results(outputs[0]), load_results(outputs[1]),
+                args.factor,
+            )
+
+
+if __name__ == '__main__':
+    main()
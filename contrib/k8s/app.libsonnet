@@ -506,6 +506,7 @@ function(config) {
                   LAZO_SERVER_HOST: 'lazo',
                   LAZO_SERVER_PORT: '50051',
                   NOMINATIM_URL: config.nominatim_url,
+                  NOMINATIM_CACHE: 'redis://redis:6379/1',
                   FRONTEND_URL: config.frontend_url,
                   API_URL: config.api_url,
                   CUSTOM_FIELDS: std.manifestJsonEx(config.custom_fields, '  '),
@@ -903,6 +904,7 @@ function(config) {
                   LAZO_SERVER_HOST: 'lazo',
                   LAZO_SERVER_PORT: '50051',
                   NOMINATIM_URL: config.nominatim_url,
+                  NOMINATIM_CACHE: 'redis://redis:6379/1',
                 }
                 + utils.object_store_env(config.object_store)
                 + request_whitelist(config)
@@ -12,8 +12,18 @@ import {FunctionBin} from './FunctionBin';
 
 const ItemType = 'badge';
 
-const NUMBER_AGG_FUNCTIONS = ['first', 'mean', 'sum', 'max', 'min', 'count'];
-const STRING_AGG_FUNCTIONS = ['first', 'count'];
+const NUMBER_AGG_FUNCTIONS = [
+  'first',
+  'mean',
+  'sum',
+  'max',
+  'min',
+  'count',
+  'median',
+  'std',
+  'nunique',
+];
+const STRING_AGG_FUNCTIONS = ['first', 'count', 'nunique'];
 const ALL_AGG_FUNCTIONS = '_all';
 
 const badgeBinStyle = (background: string): React.CSSProperties => ({
@@ -1,7 +1,9 @@
-from .augmentation import AugmentationError, join, union
+from .augmentation import AugmentationError, build_join_index, \
+    join_index_column, join, union
 
 
 __version__ = '0.10'
 
 
-__all__ = ['AugmentationError', 'join', 'union']
+__all__ = ['AugmentationError', 'build_join_index', 'join_index_column',
+           'join', 'union']
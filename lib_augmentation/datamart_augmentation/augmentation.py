@@ -1,15 +1,24 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
 import itertools
+import json
 import logging
+import multiprocessing
 import numpy as np
+import os
 import pandas as pd
-from sklearn.neighbors._kd_tree import KDTree
+import threading
 import time
 
 from datamart_materialize import types
-from datamart_profiler.spatial import median_smallest_distance
+from datamart_profiler.core import csv_row_ends
 from datamart_profiler.temporal import get_temporal_resolution, \
     temporal_aggregation_keys
 
+from .spatial import get_spatial_index
+
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +60,10 @@ class _UniqueIndexKey(object):
     def __repr__(self):
         return "UNIQUE_INDEX_KEY"
 
+    def __reduce__(self):
+        # Unpickle as the same object, when sent between processes
+        return 'UNIQUE_INDEX_KEY'
+
 
 UNIQUE_INDEX_KEY = _UniqueIndexKey()
 
@@ -231,143 +244,910 @@ def match_column_temporal_resolutions(index_1, index_2, level,
                 return _transform_index(level, lambda idx: idx.map(key))
 
 
-def _first(series):
-    return series.iloc[0]
-
+AGGREGATION_FUNCTIONS = [
+    'first', 'mean', 'sum', 'max', 'min', 'count',
+    'median', 'std', 'nunique',
+]
 
-def _sum(series):
-    """Variant of numpy.sum() that returns nan for all-nan array.
 
-    That way it works similarly to numpy.mean(), numpy.max(), etc instead of
-    returning 0.
-    """
-    if np.any(~np.isnan(series)):
-        return np.sum(series)
-    else:
-        return np.nan
+# The partial aggregates needed to compute each aggregation function
+_partials_needed = {
+    'first': ['first'],
+    'mean': ['sum', 'count'],
+    'sum': ['sum'],
+    'max': ['max'],
+    'min': ['min'],
+    'count': ['count'],
+    'median': ['values'],
+    'std': ['sum', 'count', 'm2'],
+    'nunique': ['distinct'],
+}
 
+# Partial aggregates that can't be combined per key, and keep rows instead:
+# all the values for 'values', the distinct values for 'distinct'
+_row_partials = {'values', 'distinct'}
 
-AGGREGATION_FUNCTIONS = {
-    'first': pd.NamedAgg('first', _first),
-    'mean': pd.NamedAgg('mean', np.mean),
-    'sum': pd.NamedAgg('sum', _sum),
-    'max': pd.NamedAgg('max', np.max),
-    'min': pd.NamedAgg('min', np.min),
-    'count': pd.NamedAgg('count', lambda s: (~s.isna()).sum()),
-}
+# Functions that need the column to be numerical
+_numerical_functions = {'mean', 'sum', 'median', 'std'}
 
 
-def perform_aggregations(
-    data, original_columns,
-    agg_functions=None, augment_columns_name=None,
-):
-    """Performs group by on dataset after join, to keep the shape of the
-    new, augmented dataset the same as the original, input data.
+def _aggregate_partials(grouped, columns, partial):
+    if partial == 'sum':
+        # Sum of nothing is NaN, like the mean, max, and min
+        return grouped[columns].sum(min_count=1)
+    elif partial == 'm2':
+        # Sum of squared differences from the mean
+        return grouped[columns].var(ddof=0) * grouped[columns].count()
+    else:
+        # count(), max(), min(), and sum of counts
+        return getattr(grouped[columns], partial)()
+
+
+class JoinAggregation(object):
+    """Aggregation of the joined data, one chunk at a time.
+
+    This keeps the shape of the augmented dataset the same as the original,
+    input data, by aggregating all the rows joined to a single row of the
+    original data (identified by its `UNIQUE_INDEX_KEY`).
+
+    Only partial aggregates are kept for each row of the original data (first
+    value, sum, count, maximum, minimum, sum of squared differences from the
+    mean), and they are updated with each new chunk, so the joined data never
+    needs to be in memory all at once. The mean and standard deviation are
+    computed from those at the end. The median and number of distinct values
+    can't be computed that way: the values (or distinct values) of the
+    columns they are requested for are kept until the end.
+
+    The partial aggregates of a chunk are computed with pandas' built-in
+    group reductions. They are kept in arrays indexed by `UNIQUE_INDEX_KEY`,
+    so merging a chunk only updates the rows that it joined to.
+
+    :param columns: The columns of the augmentation data, after the join
+        (with their suffix if they were renamed).
+    :param dtypes: The dtypes of those columns, used to pick the default
+        functions (mean, sum, max, min for numbers, first otherwise). If
+        values that are not numbers show up in a later chunk, the column
+        falls back to first, like if the whole data had been read at once.
+    :param agg_functions: The aggregation functions requested for each column
+        of the augmentation data, by name (before renaming).
+    :param augment_columns_name: Maps the names of the columns of the
+        augmentation data to the name they have after the join.
+    :param size: The number of rows of the original data.
     """
+    def __init__(
+        self, columns, dtypes,
+        agg_functions=None, augment_columns_name=None, size=0,
+    ):
+        self.size = size
+        if agg_functions:
+            agg_functions = {
+                # Columns might have been renamed if conflicting, deal with that
+                augment_columns_name[col]:
+                    # Turn single value into list
+                    [funcs] if isinstance(funcs, str) else funcs
+                for col, funcs in agg_functions.items()
+            }
+
+        self.functions = {}
+        # Columns with default numerical functions, that fall back to 'first'
+        # if they turn out to have values that are not numbers
+        self.fallback_first = set()
+        for column in columns:
+            if agg_functions:
+                try:
+                    self.functions[column] = agg_functions[column]
+                except KeyError:
+                    pass
+            elif (
+                'int' in str(dtypes[column])
+                or 'float' in str(dtypes[column])
+            ):
+                self.functions[column] = ['mean', 'sum', 'max', 'min']
+                self.fallback_first.add(column)
+            else:
+                # Just pick the first value
+                self.functions[column] = ['first']
 
-    col_indices = {
-        col: idx for idx, col in enumerate(data.columns)
-    }
+        for funcs in self.functions.values():
+            for func in funcs:
+                if func not in _partials_needed:
+                    raise AugmentationError(
+                        "Unknown aggregation function %r" % func
+                    )
 
-    start = time.perf_counter()
-    original_columns_set = set(original_columns)
-
-    provided_agg_functions = agg_functions
-    if provided_agg_functions:
-        provided_agg_functions = {
-            # Columns might have been renamed if conflicting, deal with that
-            augment_columns_name[col]:
-                # Turn single value into list
-                [funcs] if isinstance(funcs, str) else funcs
-            for col, funcs in provided_agg_functions.items()
+        # Columns that are aggregated as numbers
+        self.numerical = [
+            column for column, funcs in self.functions.items()
+            if any(func in _numerical_functions for func in funcs)
+        ]
+
+        # Columns needed for each kind of partial aggregate
+        self.partials = {}
+        for column, funcs in self.functions.items():
+            if column in self.fallback_first:
+                funcs = funcs + ['first']
+            for func in funcs:
+                for partial in _partials_needed[func]:
+                    columns_list = self.partials.setdefault(partial, [])
+                    if column not in columns_list:
+                        columns_list.append(column)
+
+        # Partial aggregates by (column, partial), and whether they are set
+        # for each row of the original data ('count' is always set)
+        self.state = {}
+        self.present = {}
+        # Rows of the original data that were joined to something
+        self.seen = np.zeros(size, dtype=bool)
+        # Rows kept for the partials that can't be combined, as lists of
+        # DataFrames with the UNIQUE_INDEX_KEY and value columns
+        self.rows = {
+            (column, partial): []
+            for partial in _row_partials
+            for column in self.partials.get(partial, ())
         }
-
-    agg_functions = dict()
-    for column in data.columns:
-        if column == UNIQUE_INDEX_KEY or column in original_columns_set:
-            # Just pick the first value
-            # (they are all the same, from a single row in the original data)
-            agg_functions[column] = ['first']
-        elif provided_agg_functions:
-            try:
-                funcs = provided_agg_functions[column]
-            except KeyError:
-                pass
+        # Numerical columns where values that are not numbers were found
+        self.non_numeric = set()
+
+    def add(self, chunk):
+        """Add a chunk of joined data.
+
+        :param chunk: A DataFrame with the `UNIQUE_INDEX_KEY` column and the
+            augmentation columns. Only the rows that actually joined should be
+            in there.
+        """
+        self.merge(self.aggregate(chunk))
+
+    def aggregate(self, chunk):
+        """Compute the partial aggregates of a chunk of joined data.
+
+        This doesn't change the state, so it can be done in another process.
+        The result is then passed to `merge()`.
+
+        :param chunk: A DataFrame with the `UNIQUE_INDEX_KEY` column and the
+            augmentation columns, like for `add()`.
+        :return: The partial aggregates, the rows to keep, and the numerical
+            columns that have values that are not numbers, or None if the
+            chunk is empty.
+        """
+        if len(chunk) == 0:
+            return None
+
+        # The dtype of a chunk might differ from the first one, where the
+        # functions were picked. Values that are not numbers are reported,
+        # and ignored by the numerical functions
+        non_numeric = []
+        numbers = {}
+        for column in self.numerical:
+            if chunk[column].dtype == object:
+                values = pd.to_numeric(chunk[column], errors='coerce')
+                if (values.isna() & chunk[column].notna()).any():
+                    non_numeric.append(column)
+                numbers[column] = values
+        values_chunk = chunk.assign(**numbers) if numbers else chunk
+
+        grouped = values_chunk.groupby(UNIQUE_INDEX_KEY, sort=False)
+        parts = [pd.DataFrame(index=pd.Index(
+            pd.unique(chunk[UNIQUE_INDEX_KEY]),
+        ))]
+        rows = {}
+        for partial, columns in self.partials.items():
+            if partial in _row_partials:
+                for column in columns:
+                    if partial == 'distinct':
+                        values = chunk[[UNIQUE_INDEX_KEY, column]].dropna()
+                        values = values.drop_duplicates()
+                    else:
+                        values = values_chunk[[UNIQUE_INDEX_KEY, column]]
+                        values = values.dropna()
+                    rows[(column, partial)] = values
+                continue
+            elif partial == 'first':
+                part = chunk.loc[
+                    ~chunk[UNIQUE_INDEX_KEY].duplicated(),
+                    [UNIQUE_INDEX_KEY] + columns,
+                ].set_index(UNIQUE_INDEX_KEY)
+            else:
+                part = _aggregate_partials(grouped, columns, partial)
+            part.columns = pd.MultiIndex.from_tuples(
+                [(column, partial) for column in columns],
+            )
+            parts.append(part)
+        return pd.concat(parts, axis=1), rows, non_numeric
+
+    def merge(self, partials):
+        """Add the partial aggregates of a chunk, from `aggregate()`.
+
+        Chunks have to be merged in order, for the 'first' function.
+        """
+        if partials is None:
+            return
+        state, rows, non_numeric = partials
+
+        for column in non_numeric:
+            if column in self.non_numeric:
+                continue
+            self.non_numeric.add(column)
+            if column in self.fallback_first:
+                logger.info(
+                    "Column %r has values that are not numbers, using the "
+                    "first value",
+                    column,
+                )
             else:
-                agg_functions[column] = (
-                    [funcs] if isinstance(funcs, str)
-                    else funcs
+                logger.warning(
+                    "Column %r has values that are not numbers, ignoring "
+                    "them for %s",
+                    column,
+                    ', '.join(self.functions[column]),
                 )
+
+        for key, values in rows.items():
+            self._add_rows(key, values)
+
+        positions = state.index.values
+        self.seen[positions] = True
+        # Update the sum of squared differences first, it needs the previous
+        # sums and counts
+        for partial in sorted(self.partials, key=lambda p: p != 'm2'):
+            if partial in _row_partials:
+                continue
+            for column in self.partials[partial]:
+                values = state[(column, partial)].values
+                if partial == 'm2':
+                    self._merge_m2(column, positions, state)
+                elif partial == 'count':
+                    counts = self._array((column, partial), values.dtype)
+                    counts[positions] += values.astype(np.int64)
+                else:
+                    self._merge_values(
+                        (column, partial), positions, values,
+                    )
+
+    def _add_rows(self, key, rows):
+        if key[1] == 'distinct' and self.rows[key]:
+            # Keep a single frame, deduplicated across chunks
+            rows = pd.concat([self.rows[key][0], rows]).drop_duplicates()
+            self.rows[key] = []
+        self.rows[key].append(rows)
+
+    def _array(self, key, dtype):
+        # Get the array for a partial aggregate, creating it or converting it
+        # so it can hold values of that dtype
+        if key[1] == 'count' or dtype.kind in 'iu':
+            dtype = np.dtype(np.int64)
+        elif dtype.kind == 'f':
+            dtype = np.dtype(np.float64)
         else:
-            if ('int' in str(data.dtypes[column]) or
-                    'float' in str(data.dtypes[column])):
-                agg_functions[column] = ['mean', 'sum', 'max', 'min']
+            dtype = np.dtype(object)
+        array = self.state.get(key)
+        if array is None:
+            if dtype.kind == 'i':
+                array = np.zeros(self.size, dtype=dtype)
             else:
-                # Just pick the first value
-                agg_functions[column] = ['first']
+                array = np.full(self.size, np.nan, dtype=dtype)
+            self.state[key] = array
+            self.present[key] = np.zeros(self.size, dtype=bool)
+        elif array.dtype != dtype and (
+            array.dtype.kind == 'i' or dtype.kind == 'O'
+        ):
+            array = self.state[key] = array.astype(dtype)
+        return array
+
+    def _merge_values(self, key, positions, values):
+        if key[1] != 'first':
+            # Groups without a value don't change the aggregate
+            valid = ~pd.isna(values)
+            positions, values = positions[valid], values[valid]
+        array = self._array(key, values.dtype)
+        present = self.present[key]
+        previous = present[positions]
+        array[positions[~previous]] = values[~previous]
+        present[positions] = True
+        if key[1] == 'first':
+            return
+        positions, values = positions[previous], values[previous]
+        if key[1] == 'sum':
+            array[positions] += values
+        elif key[1] == 'max':
+            array[positions] = np.maximum(array[positions], values)
+        elif key[1] == 'min':
+            array[positions] = np.minimum(array[positions], values)
+
+    def _merge_m2(self, column, positions, state):
+        # Combine the sums of squared differences from different sets of
+        # rows, computed around their own means (Chan et al.)
+        key = (column, 'm2')
+        count = state[(column, 'count')].values
+        keep = count > 0
+        positions = positions[keep]
+        count = count[keep].astype(np.float64)
+        mean = state[(column, 'sum')].values[keep] / count
+        m2 = state[key].values[keep].astype(np.float64)
+
+        array = self._array(key, m2.dtype)
+        present = self.present[key]
+        previous_count = self._array(
+            (column, 'count'), count.dtype,
+        )[positions].astype(np.float64)
+        previous = previous_count > 0
+        previous_mean = np.zeros(len(positions))
+        if previous.any():
+            previous_mean[previous] = (
+                self.state[(column, 'sum')][positions[previous]]
+                / previous_count[previous]
+            )
+        delta = mean - previous_mean
+        m2 = m2 + np.where(
+            previous,
+            array[positions] + delta ** 2 * (
+                previous_count * count / (previous_count + count)
+            ),
+            0.0,
+        )
+        array[positions] = m2
+        present[positions] = True
+
+    def _values(self, key, positions):
+        # Values of a partial aggregate for rows of the original data, NaN
+        # where it is not set
+        array = self.state.get(key)
+        if array is None:
+            return np.full(len(positions), np.nan)
+        values = array[positions]
+        present = self.present[key][positions]
+        if not present.all():
+            if values.dtype.kind == 'i':
+                values = values.astype(np.float64)
+            values[~present] = np.nan
+        return values
+
+    def _aggregate_rows(self, column, partial):
+        rows = self.rows[(column, partial)]
+        if rows:
+            rows = pd.concat(rows)
+        else:
+            rows = pd.DataFrame({UNIQUE_INDEX_KEY: [], column: []})
+        grouped = rows.groupby(UNIQUE_INDEX_KEY)[column]
+        if partial == 'values':
+            return grouped.median()
+        else:
+            return grouped.size()
+
+    def result(self, original_data, keep_all):
+        """Compute the final aggregated data.
+
+        :param original_data: The original data, with the `UNIQUE_INDEX_KEY`
+            column.
+        :param keep_all: Whether to keep the rows of the original data that
+            were not joined to anything.
+        """
+        start = time.perf_counter()
+
+        if keep_all:
+            positions = np.arange(self.size)
+        else:
+            positions = np.flatnonzero(self.seen)
+
+        data = {}
+        for column in original_data.columns:
+            if column != UNIQUE_INDEX_KEY:
+                data[column] = original_data[column].values[positions]
+        for column, funcs in self.functions.items():
+            if column in self.fallback_first and column in self.non_numeric:
+                funcs = ['first']
+            if (column, 'count') in self.state:
+                count = self.state[(column, 'count')][positions]
+            else:
+                count = np.zeros(len(positions), dtype=np.int64)
+            for func in funcs:
+                if func == 'mean':
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        values = (
+                            self._values((column, 'sum'), positions) / count
+                        )
+                elif func == 'count':
+                    values = count
+                elif func == 'std':
+                    # Sample standard deviation, like pandas (ddof=1)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        values = np.where(
+                            count > 1,
+                            np.sqrt(
+                                self._values((column, 'm2'), positions)
+                                / (count - 1)
+                            ),
+                            np.nan,
+                        )
+                elif func == 'median':
+                    values = self._aggregate_rows(column, 'values').reindex(
+                        positions,
+                    ).values
+                elif func == 'nunique':
+                    values = self._aggregate_rows(column, 'distinct').reindex(
+                        positions,
+                    ).fillna(0).astype(np.int64).values
+                else:
+                    values = self._values((column, func), positions)
+                if func == 'first' and len(funcs) <= 1:
+                    name = column
+                else:
+                    name = func + ' ' + column
+                data[name] = values
+        data = pd.DataFrame(data)
+
+        logger.info(
+            "Aggregations completed in %.4fs",
+            time.perf_counter() - start,
+        )
+        return data
+
+
+CHUNK_SIZE_ROWS = 10000
+
+JOIN_INDEX_VERSION = 2
+
+# Size of the reads when splitting the augmentation data in blocks
+CSV_BLOCK_READ_SIZE = 4 << 20
+
+# If more rows than this fraction may match, seeking to each of them is not
+# worth it, and the whole companion file is read instead
+JOIN_INDEX_MAX_FRACTION = 0.5
+
+
+def join_index_column(right_columns, augment_metadata):
+    """Get the column of the companion dataset to index for a join.
+
+    Only joins on a single column that is not temporal can use an index,
+    since the keys of temporal columns are changed to match the resolution
+    of the input data. Returns None if the join can't use an index.
+    """
+    if len(right_columns) != 1 or len(right_columns[0]) != 1:
+        return None
+    column = right_columns[0][0]
+    column_meta = augment_metadata['columns'][column]
+    if (
+        types.DATE_TIME in column_meta['semantic_types']
+        or column_meta['structural_type'] not in (
+            types.INTEGER, types.FLOAT, types.TEXT,
+        )
+    ):
+        return None
+    return column
 
-    # Resolve names into functions using AGGREGATION_FUNCTIONS map
-    agg_functions = {
-        col: [AGGREGATION_FUNCTIONS[name] for name in names]
-        for col, names in agg_functions.items()
+
+def _hash_join_keys(index):
+    values = index.values
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        # Numbers of different types compare equal when joining, so hash
+        # them all as floats (this also turns -0.0 into 0.0)
+        values = values.astype(np.float64) + 0.0
+    return pd.util.hash_array(values)
+
+
+def _hash_raw_keys(keys, column, columns_metadata):
+    # Convert the keys the same way as when joining
+    keys = pd.DataFrame(
+        {columns_metadata[column]['name']: pd.Series(keys, dtype=object)},
+    )
+    set_data_index(keys, [column], columns_metadata)
+    return _hash_join_keys(keys.index)
+
+
+def _csv_records(fp):
+    """Read the records of a CSV file, with their position and size in bytes.
+    """
+    position = 0
+
+    def lines():
+        nonlocal position
+        for line in fp:
+            position += len(line)
+            yield line.decode('utf-8', 'replace')
+
+    # The reader doesn't read ahead, so it has consumed exactly the lines of
+    # the records it returned
+    reader = csv.reader(lines())
+    while True:
+        start = position
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        yield start, position - start, record
+
+
+def build_join_index(csv_path, index_path, column, columns_metadata):
+    """Index the rows of a companion dataset by the value of a join column.
+
+    The index maps the hash of each (converted) key to the position of the
+    row in the CSV file, so that a join can read only the rows that match.
+    It also records the types of the columns, as read by pandas from the
+    first chunk of the file, so joins using it have the same output, and the
+    size and modification time of the file, so it is not used with another
+    version of the file.
+    """
+    start = time.perf_counter()
+    stat = os.stat(csv_path)
+    hashes = []
+    offsets = []
+    lengths = []
+    keys = []
+    with open(csv_path, 'rb') as fp:
+        records = _csv_records(fp)
+        try:
+            _, header_length, header = next(records)
+        except StopIteration:
+            raise AugmentationError("Empty augmentation data")
+        for offset, length, record in records:
+            # Like pandas, skip empty lines and lines with too many fields
+            if not record or len(record) > len(header):
+                continue
+            offsets.append(offset)
+            lengths.append(length)
+            key = record[column] if column < len(record) else ''
+            keys.append(key if key else None)
+            if len(keys) >= CHUNK_SIZE_ROWS:
+                hashes.append(_hash_raw_keys(keys, column, columns_metadata))
+                keys = []
+        hashes.append(_hash_raw_keys(keys, column, columns_metadata))
+
+    dtypes = pd.read_csv(
+        csv_path,
+        error_bad_lines=False,
+        nrows=CHUNK_SIZE_ROWS,
+    ).dtypes
+
+    with open(index_path, 'wb') as fp:
+        np.savez(
+            fp,
+            version=np.array(JOIN_INDEX_VERSION),
+            column=np.array(column),
+            csv_size=np.array(stat.st_size, dtype=np.int64),
+            csv_mtime=np.array(stat.st_mtime_ns, dtype=np.int64),
+            header_length=np.array(header_length),
+            dtypes=np.array(json.dumps(
+                {name: str(dtype) for name, dtype in dtypes.items()},
+            )),
+            hashes=np.concatenate(hashes),
+            offsets=np.array(offsets, dtype=np.int64),
+            lengths=np.array(lengths, dtype=np.uint32),
+        )
+    logger.info(
+        "Built join index of %d rows in %.4fs",
+        len(offsets), time.perf_counter() - start,
+    )
+
+
+def _read_join_index(index_path, csv_path, column, keys):
+    """Read the rows of the companion dataset that may match, using an index.
+
+    Returns the dtypes of the columns and an iterator of chunks, or None if
+    the index can't be used.
+    """
+    stat = os.stat(csv_path)
+    with np.load(index_path, allow_pickle=False) as index:
+        if (
+            int(index['version']) != JOIN_INDEX_VERSION
+            or int(index['column']) != column
+            or int(index['csv_size']) != stat.st_size
+            or int(index['csv_mtime']) != stat.st_mtime_ns
+        ):
+            logger.warning("Join index doesn't match, not using it")
+            return None
+        matches = np.isin(index['hashes'], np.unique(_hash_join_keys(keys)))
+        nb_matches = np.count_nonzero(matches)
+        if nb_matches > JOIN_INDEX_MAX_FRACTION * len(matches):
+            logger.info(
+                "%d/%d rows may match, not using join index",
+                nb_matches, len(matches),
+            )
+            return None
+        logger.info(
+            "%d/%d rows may match, using join index",
+            nb_matches, len(matches),
+        )
+        header_length = int(index['header_length'])
+        dtypes = json.loads(str(index['dtypes']))
+        offsets = index['offsets'][matches]
+        lengths = index['lengths'][matches]
+
+    text_dtypes = {
+        name: object for name, dtype in dtypes.items() if dtype == 'object'
     }
+    read_dtypes = dict(text_dtypes)
+    read_dtypes.update(
+        (name, dtype) for name, dtype in dtypes.items()
+        if dtype in ('float64', 'bool')
+    )
 
-    # Perform group-by
-    data = data.groupby(by=[UNIQUE_INDEX_KEY]).agg(agg_functions)
+    def read_chunks():
+        with open(csv_path, 'rb') as fp:
+            header = fp.read(header_length)
+            # Always return a chunk, even if empty, to get the columns
+            for i in range(0, max(nb_matches, 1), CHUNK_SIZE_ROWS):
+                buf = io.BytesIO()
+                buf.write(header)
+                for offset, length in zip(
+                    offsets[i:i + CHUNK_SIZE_ROWS],
+                    lengths[i:i + CHUNK_SIZE_ROWS],
+                ):
+                    fp.seek(offset)
+                    buf.write(fp.read(length))
+                buf.seek(0, 0)
+                # Use the recorded types, which pandas might infer
+                # differently from the rows that match (for example text
+                # that looks like numbers, or integers among floats)
+                try:
+                    chunk = pd.read_csv(
+                        buf,
+                        error_bad_lines=False,
+                        dtype=read_dtypes,
+                    )
+                except (TypeError, ValueError):
+                    # Numbers or booleans that don't parse, infer them like
+                    # when reading the whole file
+                    buf.seek(0, 0)
+                    chunk = pd.read_csv(
+                        buf,
+                        error_bad_lines=False,
+                        dtype=text_dtypes,
+                    )
+                    for name, dtype in chunk.dtypes.items():
+                        if (
+                            dtypes.get(name) == 'float64'
+                            and pd.api.types.is_integer_dtype(dtype)
+                        ):
+                            chunk[name] = chunk[name].astype(np.float64)
+                yield chunk
 
-    # Drop group-by column
-    data.reset_index(drop=True, inplace=True)
+    return dtypes, read_chunks()
 
-    # Reorder columns
-    # sorted() is a stable sort, so we'll keep the order of agg_functions above
-    data = data[sorted(
-        data.columns,
-        key=lambda col: col_indices.get(col[0], 999999999)
-    )]
 
-    # Rename columns
-    data.columns = [
-        col[0] if col[1] == 'first' and len(agg_functions[col[0]]) <= 1
-        else ' '.join(col[::-1]).strip()
-        for col in data.columns
-    ]
+def _csv_blocks(csv_path, rows):
+    """Split a CSV file in blocks of rows, that can be parsed separately.
 
-    logger.info("Aggregations completed in %.4fs", time.perf_counter() - start)
-    return data
+    Each block is a CSV file of its own, starting with the header, with
+    ``rows`` rows that are not empty (like the chunks pandas reads). Rows are
+    found with `csv_row_ends()`, so values with line breaks are kept whole.
 
+    If a row doesn't end within ``rows`` lines, for example because of a
+    quote that is never closed, the rest of the file is read by pandas
+    instead, and DataFrames are yielded instead of blocks.
+    """
+    with open(csv_path, 'rb') as fp:
+        header = None
+        leftover = b''
+        position = 0  # Position of the leftover in the file
+        pending = []
+        pending_rows = 0
+        while True:
+            data = fp.read(CSV_BLOCK_READ_SIZE)
+            buf = leftover + data
+            ends = csv_row_ends(buf)
+            if len(ends) == 0 and buf.count(b'\n') > rows:
+                logger.warning(
+                    "Row doesn't end after %d lines, reading the rest of "
+                    "the file serially",
+                    rows,
+                )
+                if pending_rows:
+                    yield header + b''.join(pending)
+                yield from _read_csv_rest(fp, header, position, rows)
+                return
+            if not data and buf and (len(ends) == 0 or ends[-1] < len(buf)):
+                # Last row, if the file doesn't end with a newline
+                ends = np.append(ends, len(buf))
+            if len(ends) == 0:
+                if not data:
+                    break
+                leftover = buf
+                continue
+
+            start = 0
+            if header is None:
+                header = buf[:ends[0]]
+                start = ends[0]
+                ends = ends[1:]
+            starts = np.concatenate([[start], ends[:-1]])[:len(ends)]
+
+            # Skip the empty lines when counting rows, like pandas
+            array = np.frombuffer(buf, dtype=np.uint8)
+            lengths = ends - starts
+            empty = (
+                (lengths == 1) & (array[starts] == ord('\n'))
+            ) | (
+                (lengths == 2) & (array[starts] == ord('\r'))
+            )
+            counts = pending_rows + np.cumsum(~empty)
+            for cut in np.flatnonzero(~empty & (counts % rows == 0)):
+                pending.append(buf[start:ends[cut]])
+                yield header + b''.join(pending)
+                pending = []
+                start = ends[cut]
+            if len(ends) > 0:
+                pending.append(buf[start:ends[-1]])
+                pending_rows = int(counts[-1]) % rows
+                leftover = buf[ends[-1]:]
+                position += ends[-1]
+            else:
+                leftover = buf[start:]
+                position += start
+            if not data:
+                break
+        if pending_rows:
+            yield header + b''.join(pending)
 
-CHUNK_SIZE_ROWS = 10000
 
+def _read_csv_rest(fp, header, position, rows):
+    """Read the rest of a CSV file with pandas, in chunks.
+    """
+    fp.seek(position)
+    if header is None:
+        yield from pd.read_csv(
+            fp,
+            error_bad_lines=False,
+            chunksize=rows,
+        )
+    else:
+        yield from pd.read_csv(
+            fp,
+            error_bad_lines=False,
+            chunksize=rows,
+            header=None,
+            names=list(_read_csv_block(header).columns),
+        )
+
+
+def _read_csv_block(block):
+    if isinstance(block, pd.DataFrame):
+        # Already read, see _csv_blocks()
+        return block
+    return pd.read_csv(io.BytesIO(block), error_bad_lines=False)
+
+
+class _ChunkJoiner(object):
+    """Converts chunks of the augmentation data and joins them to the input.
+
+    The temporal resolutions are matched using the first chunk.
+    """
+    def __init__(
+        self, original_data, augment_columns_metadata, join_columns_idx,
+        columns_transform, drop_columns, columns_map, temporal_resolution,
+    ):
+        self.original_data = original_data
+        self.augment_columns_metadata = augment_columns_metadata
+        self.join_columns_idx = join_columns_idx
+        self.columns_transform = columns_transform
+        self.drop_columns = drop_columns
+        self.columns_map = columns_map
+        self.temporal_resolution = temporal_resolution
+
+        # Defer temporal alignment until reading the first block from
+        # companion (and converting it to the right data types!)
+        self.update_idx = None
+        self.original_keys = None
+        self.original_rows = None
+        self.original_starts = None
+
+    def convert(self, augment_data):
+        """Convert the data types of a chunk and set its index.
+        """
+        # Run transforms
+        for cols, transform in self.columns_transform:
+            augment_data.iloc[:, cols] = transform(augment_data.iloc[:, cols])
+
+        # Convert data types
+        augment_data = set_data_index(
+            augment_data,
+            self.join_columns_idx,
+            self.augment_columns_metadata,
+            drop=True,  # Drop the join columns on that side (avoid duplicates)
+        )
+
+        if self.update_idx is None:
+            # Guess temporal resolutions (on first chunk)
+            self.update_idx = match_temporal_resolutions(
+                self.original_data,
+                augment_data,
+                self.temporal_resolution,
+            )
+            self._prepare_original(self.update_idx(self.original_data.index))
+
+        # Match temporal resolutions
+        augment_data.index = self.update_idx(augment_data.index)
+
+        # Filter columns
+        if self.drop_columns:
+            augment_data = augment_data.drop(self.drop_columns, axis=1)
+
+        return augment_data
+
+    def _prepare_original(self, index):
+        # Hash the keys of the original data once, instead of for each chunk
+        # like DataFrame.join() would
+        self.original_keys = index.unique()
+        codes = self.original_keys.get_indexer(index)
+        # Rows of the original data grouped by key, and where each key starts
+        self.original_rows = np.argsort(codes, kind='stable')
+        self.original_starts = np.searchsorted(
+            codes[self.original_rows],
+            np.arange(len(self.original_keys) + 1),
+        )
+
+    def join(self, augment_data):
+        """Join a converted chunk, only keeping the rows that match.
+
+        This is an inner join, like `DataFrame.join()`: each row of the chunk
+        is paired with all the rows of the original data that have the same
+        key. Rows of the original data that didn't match anything are added
+        back after aggregation.
+        """
+        codes = self.original_keys.get_indexer(augment_data.index)
+        augment_rows = np.flatnonzero(codes >= 0)
+        codes = codes[augment_rows]
+        starts = self.original_starts[codes]
+        counts = self.original_starts[codes + 1] - starts
+        augment_rows = np.repeat(augment_rows, counts)
+        original_rows = self.original_rows[
+            np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            + np.arange(len(augment_rows))
+        ]
+
+        # Drop the join columns we set as index
+        joined_chunk = augment_data.iloc[augment_rows].rename(
+            columns=self.columns_map,
+        )
+        joined_chunk.reset_index(drop=True, inplace=True)
+        joined_chunk.insert(
+            0, UNIQUE_INDEX_KEY,
+            self.original_data[UNIQUE_INDEX_KEY].values[original_rows],
+        )
+
+        return joined_chunk
 
-def _tree_nearest(tree, max_dist):
-    def transform(df):
-        # Convert to numeric numpy array
-        points = pd.DataFrame({
-            'x': pd.to_numeric(
-                df.iloc[:, 0],
-                errors='coerce',
-                downcast='float',
-            ),
-            'y': pd.to_numeric(
-                df.iloc[:, 1],
-                errors='coerce',
-                downcast='float',
-            ),
-        }).values
-        # Run input through tree
-        dist, indices = tree.query(points, return_distance=True)
-        indices = indices.reshape((-1,))
-        dist = dist.reshape((-1,))
 
-        # Build array of transformed coordinates
-        coords = tree.get_arrays()[0]
-        res = coords[indices]
+# State of the running join() calls, inherited by the worker processes when
+# they are forked
+_workers_state = {}
+_workers_state_lock = threading.Lock()
 
-        # Discard points too far
-        res[dist >= max_dist] = np.nan
-        return res
 
-    return transform
+def _join_block_worker(token, block):
+    joiner, aggregation = _workers_state[token]
+    augment_data = joiner.convert(_read_csv_block(block))
+    return aggregation.aggregate(joiner.join(augment_data))
+
+
+def _join_parallel(joiner, aggregation, blocks, workers):
+    """Join and aggregate blocks of the augmentation data, using workers.
+
+    The workers are forked from the current process, so they have access to
+    the original data without it being copied. They send back the partial
+    aggregates, which are merged in order.
+
+    :param workers: Number of processes to use
+    """
+    with _workers_state_lock:
+        token = max(_workers_state, default=0) + 1
+        _workers_state[token] = joiner, aggregation
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+        ) as executor:
+            # Only read a few blocks ahead of the ones being merged
+            pending = collections.deque()
+            for block in blocks:
+                pending.append(
+                    executor.submit(_join_block_worker, token, block),
+                )
+                if len(pending) >= 2 * workers:
+                    aggregation.merge(pending.popleft().result())
+            while pending:
+                aggregation.merge(pending.popleft().result())
+    finally:
+        with _workers_state_lock:
+            _workers_state.pop(token)
 
 
 KEEP_COLUMN_FIELDS = {'name', 'structural_type', 'semantic_types'}
@@ -379,11 +1159,21 @@ def join(
     left_columns, right_columns,
     how='left', columns=None,
     agg_functions=None, temporal_resolution=None,
+    augment_index=None, workers=None,
 ):
     """
     Performs a join between original_data (pandas.DataFrame or path to CSV)
     and augment_data (pandas.DataFrame) using left_columns and right_columns.
 
+    If augment_index is provided, it is the path to the index of the join
+    column built by `build_join_index()`, used to only read the rows of
+    augment_data that match.
+
+    If workers is more than 1, the chunks of augment_data are parsed and
+    joined in that many worker processes, forked from this one. Since the
+    chunks are parsed separately, the types of the columns might not be
+    inferred in the same way as when reading the file serially.
+
     The result is written to the writer object.
 
     Returns the metadata for the result.
@@ -413,35 +1203,14 @@ def join(
     for left, right in zip(left_columns, right_columns):
         if len(left) == 2 and len(right) == 2:
             # Spatial augmentation
-            # Get those columns
-            points = original_data.iloc[:, left]
-            # De-duplicate
-            points = pd.DataFrame(list(
-                set(tuple(p) for p in points.values)
-            ))
-            # Convert to numeric numpy array
-            points = pd.DataFrame({
-                'x': pd.to_numeric(
-                    points.iloc[:, 0],
-                    errors='coerce',
-                    downcast='float',
-                ),
-                'y': pd.to_numeric(
-                    points.iloc[:, 1],
-                    errors='coerce',
-                    downcast='float',
-                ),
-            }).values
-            # Build KDTree
-            tree = KDTree(points)
-            # Compute max distance for nearest join
-            max_dist = 2 * median_smallest_distance(points, tree)
-            logger.info("Using nearest spatial join, max=%r", max_dist)
+            # Get the index of those points, to find the nearest one
+            spatial_index = get_spatial_index(original_data.iloc[:, left])
+            logger.info(
+                "Using nearest spatial join, max=%r",
+                spatial_index.max_dist,
+            )
             # Store transformation
-            augment_columns_transform.append((
-                right,
-                _tree_nearest(tree, max_dist),
-            ))
+            augment_columns_transform.append((right, spatial_index))
 
             original_join_columns_idx.extend(left)
             augment_join_columns_idx.extend(right)
@@ -465,11 +1234,32 @@ def join(
     logger.info("Performing join...")
 
     # Stream the data in
-    augment_data_chunks = pd.read_csv(
-        augment_data_path,
-        error_bad_lines=False,
-        chunksize=CHUNK_SIZE_ROWS,
-    )
+    augment_data_chunks = None
+    augment_dtypes = None
+    blocks = None
+    if (
+        augment_index is not None
+        and join_index_column(right_columns, augment_metadata) is not None
+    ):
+        indexed = _read_join_index(
+            augment_index,
+            augment_data_path,
+            right_columns[0][0],
+            original_data.index,
+        )
+        if indexed is not None:
+            augment_dtypes, augment_data_chunks = indexed
+    if augment_data_chunks is None:
+        if workers is not None and workers > 1:
+            # Split the file in blocks, that the workers will parse
+            blocks = _csv_blocks(augment_data_path, CHUNK_SIZE_ROWS)
+            augment_data_chunks = map(_read_csv_block, blocks)
+        else:
+            augment_data_chunks = pd.read_csv(
+                augment_data_path,
+                error_bad_lines=False,
+                chunksize=CHUNK_SIZE_ROWS,
+            )
     try:
         first_augment_data = next(augment_data_chunks)
     except StopIteration:
@@ -490,84 +1280,68 @@ def join(
             )
         )
 
-    # Defer temporal alignment until reading the first block from companion
-    # (and converting it to the right data types!)
-    update_idx = None
-    original_data_res = None
-
-    # Streaming join
-    start = time.perf_counter()
-    join_ = []
-    # Iterate over chunks of augment data
-    for augment_data in itertools.chain(
-            [first_augment_data], augment_data_chunks
-    ):
-        # Run transforms
-        for cols, transform in augment_columns_transform:
-            augment_data.iloc[:, cols] = transform(augment_data.iloc[:, cols])
-
-        # Convert data types
-        augment_data = set_data_index(
-            augment_data,
-            augment_join_columns_idx,
-            augment_metadata['columns'],
-            drop=True,  # Drop the join columns on that side (avoid duplicates)
-        )
-
-        if update_idx is None:
-            # Guess temporal resolutions (on first chunk)
-            update_idx = match_temporal_resolutions(
-                original_data,
-                augment_data,
-                temporal_resolution,
-            )
-            original_data_res = original_data.set_index(
-                update_idx(original_data.index)
-            )
-
-        # Match temporal resolutions
-        augment_data.index = update_idx(augment_data.index)
-
-        # Filter columns
-        if drop_columns:
-            augment_data = augment_data.drop(drop_columns, axis=1)
-
-        # Join
-        joined_chunk = original_data_res.join(
-            augment_data,
-            how=how,
-            rsuffix='_r'
-        )
-
-        # Drop the join columns we set as index
-        joined_chunk.reset_index(drop=True, inplace=True)
-
-        join_.append(joined_chunk)
-
-    join_ = pd.concat(join_)
-    logger.info("Join completed in %.4fs", time.perf_counter() - start)
-
     intersection = set(original_data.columns).intersection(set(first_augment_data.columns))
 
-    # qualities
-    qualities_list = []
-
     # map column names for the augmentation data
     augment_columns_map = {
         name: name + '_r' if name in intersection else name
         for name in first_augment_data.columns
     }
 
-    # aggregations
-    join_ = perform_aggregations(
-        join_,
-        list(original_data.columns),
+    joiner = _ChunkJoiner(
+        original_data,
+        augment_metadata['columns'],
+        augment_join_columns_idx,
+        augment_columns_transform,
+        drop_columns,
+        augment_columns_map,
+        temporal_resolution,
+    )
+
+    # Streaming join, aggregating each chunk as we go
+    start = time.perf_counter()
+    first_augment_data = joiner.convert(first_augment_data)
+
+    # Pick aggregation functions (on first chunk, or using the types recorded
+    # in the index, which are from the first chunk too)
+    dtypes = first_augment_data.dtypes
+    if augment_dtypes is not None:
+        dtypes = {
+            name: augment_dtypes.get(name, dtype)
+            for name, dtype in dtypes.items()
+        }
+    aggregation = JoinAggregation(
+        [
+            augment_columns_map[name]
+            for name in first_augment_data.columns
+        ],
+        {
+            augment_columns_map[name]: dtype
+            for name, dtype in dtypes.items()
+        },
         agg_functions,
         augment_columns_map,
+        size=len(original_data),
     )
+    aggregation.add(joiner.join(first_augment_data))
 
-    # drop unique index
-    join_.drop([UNIQUE_INDEX_KEY], axis=1, inplace=True)
+    if blocks is not None:
+        _join_parallel(joiner, aggregation, blocks, workers)
+    else:
+        # Iterate over chunks of augment data
+        for augment_data in augment_data_chunks:
+            aggregation.add(joiner.join(joiner.convert(augment_data)))
+
+    logger.info("Join completed in %.4fs", time.perf_counter() - start)
+
+    # qualities
+    qualities_list = []
+
+    # aggregations
+    join_ = aggregation.result(
+        original_data,
+        keep_all=how in ('left', 'outer'),
+    )
 
     original_columns_set = set(original_data.columns)
     new_columns = [
@@ -604,10 +1378,10 @@ def join(
                 if agg is not None:
                     name = agg + ' ' + name
                 column_metadata['name'] = name
-                if agg in {'sum', 'mean'}:
+                if agg in {'sum', 'mean', 'median', 'std'}:
                     column_metadata['structural_type'] = types.FLOAT
                     column_metadata['semantic_types'] = []
-                elif agg == 'count':
+                elif agg in {'count', 'nunique'}:
                     column_metadata['structural_type'] = types.INTEGER
                     column_metadata['semantic_types'] = []
                 columns_metadata[name] = column_metadata
@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.neighbors._kd_tree import KDTree
+import threading
+import time
+
+from datamart_profiler.spatial import median_smallest_distance
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of spatial indexes kept in memory, for the next joins with the same
+# input points
+SPATIAL_INDEX_CACHE_SIZE = 8
+
+# Above this number of grid cells along an axis, the cell numbers could
+# overflow, and only the tree is used
+MAX_GRID_CELLS = 2 ** 30
+
+
+def _to_points(data):
+    """Convert two columns of coordinates to an array of points.
+    """
+    return pd.DataFrame({
+        'x': pd.to_numeric(
+            data.iloc[:, 0],
+            errors='coerce',
+            downcast='float',
+        ),
+        'y': pd.to_numeric(
+            data.iloc[:, 1],
+            errors='coerce',
+            downcast='float',
+        ),
+    }).values
+
+
+class SpatialIndex(object):
+    """Nearest-neighbor lookup of the points of the input data.
+
+    Points of the augmentation data are moved to the nearest input point, if
+    it is closer than twice the median distance between input points (and
+    dropped otherwise).
+
+    The input points are also put on a grid, with cells of that maximum
+    distance, so that points far from any input point are discarded without
+    querying the tree (a matching input point has to be in the same or a
+    neighboring cell).
+
+    :param points: The unique input points, as a 2D array.
+    """
+    def __init__(self, points):
+        start = time.perf_counter()
+        self.tree = KDTree(points)
+        self.coords = self.tree.get_arrays()[0]
+        self.max_dist = 2 * median_smallest_distance(points, self.tree)
+
+        # Cells are a bit bigger than the maximum distance, so rounding
+        # can't put points that match two cells apart
+        self.cell_size = self.max_dist * (1 + 1e-6)
+        self.origin = None
+        self.cells = None
+        if self.max_dist > 0:
+            origin = points.min(axis=0).astype(np.float64)
+            size = (points.max(axis=0) - origin) / self.cell_size
+            if size.max() < MAX_GRID_CELLS:
+                self.origin = origin
+                cells = self._cells(points)
+                # Also mark the neighbors of each cell
+                self.cells = np.unique(np.concatenate([
+                    cells + dx * (2 * MAX_GRID_CELLS) + dy
+                    for dx in (-1, 0, 1)
+                    for dy in (-1, 0, 1)
+                ]))
+
+        logger.info(
+            "Built spatial index of %d points in %.4fs, max=%r, %s cells",
+            len(points), time.perf_counter() - start, self.max_dist,
+            'no' if self.cells is None else len(self.cells),
+        )
+
+    def _cells(self, points):
+        # Points far away are clipped to the border, where no cell is marked
+        idx = np.floor(
+            (points.astype(np.float64) - self.origin) / self.cell_size
+        )
+        idx = np.clip(idx, -2, MAX_GRID_CELLS + 1).astype(np.int64) + 2
+        return idx[:, 0] * (2 * MAX_GRID_CELLS) + idx[:, 1]
+
+    def __call__(self, data):
+        """Move points to the nearest input point, or NaN if there is none.
+
+        :param data: Two columns of coordinates.
+        :return: An array of points.
+        """
+        points = _to_points(data)
+        res = np.full((len(points), 2), np.nan, dtype=self.coords.dtype)
+
+        if not self.max_dist > 0:
+            return res
+
+        # Only query the points that are close to some input point
+        candidates = np.isfinite(points).all(axis=1)
+        if self.cells is not None:
+            candidates[candidates] = np.isin(
+                self._cells(points[candidates]),
+                self.cells,
+            )
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) == 0:
+            return res
+
+        dist, indices = self.tree.query(
+            points[candidates],
+            return_distance=True,
+        )
+        indices = indices.reshape((-1,))
+        dist = dist.reshape((-1,))
+
+        # Discard points too far
+        close = dist < self.max_dist
+        res[candidates[close]] = self.coords[indices[close]]
+        return res
+
+
+_spatial_index_cache = collections.OrderedDict()
+_spatial_index_cache_lock = threading.Lock()
+
+
+def get_spatial_index(data):
+    """Get the `SpatialIndex` for the points of the input data.
+
+    The index is reused if the same points were used recently.
+
+    :param data: Two columns of coordinates.
+    """
+    # De-duplicate, the order of the unique points doesn't depend on the data
+    points = np.unique(_to_points(data), axis=0)
+
+    h = hashlib.sha256()
+    h.update(str(points.dtype).encode('ascii'))
+    h.update(np.ascontiguousarray(points).tobytes())
+    key = h.hexdigest()
+
+    with _spatial_index_cache_lock:
+        index = _spatial_index_cache.get(key)
+        if index is not None:
+            _spatial_index_cache.move_to_end(key)
+            logger.info("Using cached spatial index, max=%r", index.max_dist)
+            return index
+
+    index = SpatialIndex(points)
+
+    with _spatial_index_cache_lock:
+        _spatial_index_cache[key] = index
+        while len(_spatial_index_cache) > SPATIAL_INDEX_CACHE_SIZE:
+            _spatial_index_cache.popitem(last=False)
+    return index
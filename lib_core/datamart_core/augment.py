@@ -1,14 +1,57 @@
+import contextlib
 import logging
+import opentelemetry.trace
+import os
 import time
 import uuid
 
-from datamart_augmentation import AugmentationError, join, union
+from datamart_augmentation import AugmentationError, build_join_index, \
+    join, union
+from datamart_fslock.cache import cache_get_or_set
+
+from .materialize import dataset_cache_key
 
 
 logger = logging.getLogger(__name__)
+tracer = opentelemetry.trace.get_tracer(__name__)
+
+
+@contextlib.contextmanager
+def get_join_index(metadata, dataset_id, csv_path, column):
+    """Get the index of a join column, next to the cached CSV file.
+
+    `csv_path` is the CSV file from `get_dataset()`, which has to stay locked
+    while this is used. The index is only valid for that version of the file,
+    so its size and modification time are part of the key.
+    """
+    stat = os.stat(csv_path)
+    key = dataset_cache_key(
+        dataset_id, metadata,
+        'join-index',
+        {
+            'column': column,
+            'csv_size': stat.st_size,
+            'csv_mtime': stat.st_mtime_ns,
+        },
+    )
+
+    def create(cache_temp):
+        logger.info("Building join index for column %d", column)
+        with tracer.start_as_current_span(
+            'materialize/join-index',
+            attributes={
+                'dataset_id': dataset_id,
+                'column': column,
+            },
+        ):
+            build_join_index(csv_path, cache_temp, column, metadata['columns'])
+
+    with cache_get_or_set('/cache/datasets', key, create) as cache_path:
+        yield cache_path
 
 
-def augment(data, newdata, metadata, task, writer, columns=None):
+def augment(data, newdata, metadata, task, writer, columns=None,
+            join_index=None, workers=None):
     """
     Augments original data based on the task.
 
@@ -19,6 +62,10 @@ def augment(data, newdata, metadata, task, writer, columns=None):
     :param writer: Writer on which to save the files.
     :param columns: a list of column indices from newdata that will be added to data
       well with data.
+    :param join_index: the path to the index of the join column of newdata,
+      from `get_join_index()`.
+    :param workers: the number of processes to use to join the chunks of
+      newdata.
     """
 
     if 'id' not in task:
@@ -43,6 +90,8 @@ def augment(data, newdata, metadata, task, writer, columns=None):
             columns=columns,
             agg_functions=task['augmentation'].get('agg_functions'),
             temporal_resolution=task['augmentation'].get('temporal_resolution'),
+            augment_index=join_index,
+            workers=workers,
         )
     elif task['augmentation']['type'] == 'union':
         output_metadata = union(
@@ -7,10 +7,9 @@
 import contextlib
 import fcntl
 import logging
-import multiprocessing
 import os
 import prometheus_client
-import signal
+import threading
 import time
 
 
@@ -31,149 +30,207 @@ PROM_LOCKS_HELD = prometheus_client.Gauge(
 )
 
 
-@contextlib.contextmanager
-def timeout_syscall(seconds):
-    """Interrupt a system-call after a time (main thread only).
-
-    Warning: this only works from the main thread! Trying to use this on
-    another thread will cause the call to not timeout, and the main thread will
-    receive an InterruptedError instead!
+# Interval between non-blocking attempts when a timeout is set
+POLL_MIN_INTERVAL = 0.005
+POLL_MAX_INTERVAL = 0.5
 
-    Example::
-
-        with timeout_syscall(5):
-            try:
-                socket.connect(...)
-            except InterruptedError:
-                raise ValueError("This host did not respond in time")
-    """
-    def timeout_handler(signum, frame):
-        raise InterruptedError
 
-    original_handler = signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, original_handler)
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.perf_counter())
 
 
-def _lock_process(pipe, filepath, exclusive, timeout=None):
-    """Locking function, runs in a subprocess.
+def _flock_open(filepath, exclusive, deadline):
+    """Open the file and lock it, giving up at `deadline`.
 
-    We run the locking in a subprocess so that we are the main thread
-    (required to use SIGALRM) and to avoid spurious unlocking on Linux (which
-    can happen if a different file descriptor for the same file gets closed,
-    even by another thread).
+    Timeouts are implemented by polling with ``LOCK_NB`` rather than
+    interrupting the system call with SIGALRM, so this works from any thread.
     """
+    mode = os.O_RDONLY | os.O_CREAT if exclusive else os.O_RDONLY
+    fd = os.open(filepath, mode)  # Might raise FileNotFoundError
     try:
-        # Reset signal handlers
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
-        signal.signal(signal.SIGHUP, signal.SIG_DFL)
-        signal.signal(signal.SIGTERM, signal.SIG_DFL)
-
-        # Open the file
-        mode = os.O_RDONLY | os.O_CREAT if exclusive else os.O_RDONLY
-        try:
-            fd = os.open(filepath, mode)
-        except FileNotFoundError:
-            pipe.send('NOTFOUND')
-            return
-
-        # Lock it
         op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
-        if timeout is None:
+        if deadline is None:
             fcntl.flock(fd, op)
-        elif timeout == 0:
+            return fd
+        interval = POLL_MIN_INTERVAL
+        while True:
             try:
                 fcntl.flock(fd, op | fcntl.LOCK_NB)
+                return fd
             except BlockingIOError:
-                pipe.send('TIMEOUT')
-                return
-        else:
-            with timeout_syscall(timeout):
-                try:
-                    fcntl.flock(fd, op)
-                except InterruptedError:
-                    pipe.send('TIMEOUT')
-                    return
-        pipe.send('LOCKED')
-    except Exception:
-        pipe.send('ERROR')
+                remaining = _remaining(deadline)
+                if remaining <= 0:
+                    raise TimeoutError
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, POLL_MAX_INTERVAL)
+    except BaseException:
+        os.close(fd)
         raise
 
-    # Wait for unlock message then exit
-    assert pipe.recv() == 'UNLOCK'
 
-    # Exiting releases the lock
+class _PathLock(object):
+    """In-process state for one locked path.
+
+    There is at most one file descriptor per path in this process. Shared
+    holders (from any thread) share it, and it is only unlocked and closed when
+    the last one releases it. This means closing a descriptor can never drop a
+    lock that another thread still relies on.
+    """
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.fd = None
+        self.readers = 0
+        self.writer = False
+        self.busy = False  # A thread is currently doing flock() on this path
+        self.users = 0  # Number of threads holding or waiting on this
+
+    def compatible(self, exclusive):
+        if self.busy:
+            return False
+        elif exclusive:
+            return self.fd is None
+        else:
+            return not self.writer
 
 
-# Using the 'fork' method causes deadlocks because other threads acquire locks
-_mp_context = multiprocessing.get_context('spawn')
+class LockManager(object):
+    """Keeps track of the flock(2) locks held by the current process.
 
+    Locks on a path are reference-counted across threads; threads of this
+    process wait on each other using condition variables, and only the first
+    (or exclusive) holder actually takes the lock on the file.
+    """
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._paths = {}
 
-def join_process(proc, timeout):
-    # multiprocessing.Process.join() waits "at most", this waits "at least"
-    start = now = time.perf_counter()
-    while now - start < timeout:
-        proc.join(timeout - now + start)
-        if proc.exitcode is not None:
-            break
-        now = time.perf_counter()
+    def _get(self, filepath):
+        with self._mutex:
+            try:
+                path_lock = self._paths[filepath]
+            except KeyError:
+                path_lock = self._paths[filepath] = _PathLock()
+            path_lock.users += 1
+            return path_lock
+
+    def _put(self, filepath, path_lock):
+        with self._mutex:
+            path_lock.users -= 1
+            if path_lock.users == 0:
+                del self._paths[filepath]
+
+    def acquire(self, filepath, exclusive, timeout=None):
+        """Lock a path, returns an object to pass to `release()`.
+
+        :raises TimeoutError: if the lock couldn't be taken in time.
+        :raises FileNotFoundError: for a shared lock on a missing file.
+        """
+        filepath = os.path.abspath(filepath)
+        deadline = None
+        if timeout is not None:
+            deadline = time.perf_counter() + timeout
+        path_lock = self._get(filepath)
+        try:
+            with path_lock.cond:
+                while not path_lock.compatible(exclusive):
+                    remaining = _remaining(deadline)
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError
+                    path_lock.cond.wait(remaining)
+                if path_lock.fd is not None:
+                    # Another thread has the file locked shared, join it
+                    path_lock.readers += 1
+                    return filepath, path_lock, exclusive
+                path_lock.busy = True
+
+            # Lock the file, without holding the condition
+            try:
+                fd = _flock_open(filepath, exclusive, deadline)
+            except BaseException:
+                with path_lock.cond:
+                    path_lock.busy = False
+                    path_lock.cond.notify_all()
+                raise
+
+            with path_lock.cond:
+                path_lock.busy = False
+                path_lock.fd = fd
+                if exclusive:
+                    path_lock.writer = True
+                else:
+                    path_lock.readers += 1
+                path_lock.cond.notify_all()
+            return filepath, path_lock, exclusive
+        except BaseException:
+            self._put(filepath, path_lock)
+            raise
+
+    def release(self, handle):
+        filepath, path_lock, exclusive = handle
+        with path_lock.cond:
+            if exclusive:
+                path_lock.writer = False
+            else:
+                path_lock.readers -= 1
+            if not path_lock.writer and path_lock.readers == 0:
+                fd = path_lock.fd
+                path_lock.fd = None
+                if fd is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                    finally:
+                        os.close(fd)
+            path_lock.cond.notify_all()
+        self._put(filepath, path_lock)
+
+    def _reset_after_fork(self):
+        # The child shares the open file descriptions with the parent, so
+        # unlocking them here would release the parent's locks. Close them
+        # without unlocking and forget about them
+        self._mutex = threading.Lock()
+        paths, self._paths = self._paths, {}
+        for path_lock in paths.values():
+            path_lock.cond = threading.Condition(threading.Lock())
+            if path_lock.fd is not None:
+                os.close(path_lock.fd)
+                path_lock.fd = None
+
+
+_manager = LockManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_manager._reset_after_fork)
 
 
 @contextlib.contextmanager
 def _lock(filepath, exclusive, timeout=None):
     type_ = "exclusive" if exclusive else "shared"
 
-    started = False
-    locked = False
-    pipe, pipe2 = _mp_context.Pipe()
-    proc = _mp_context.Process(
-        target=_lock_process,
-        args=(pipe2, filepath, exclusive, timeout),
-    )
     try:
         with PROM_LOCK_ACQUIRE.labels(type_).time():
-            proc.start()
-            started = True
-
-            out = pipe.recv()
-            if out == 'LOCKED':
-                logger.info("Acquired %s lock: %r", type_, filepath)
-                locked = True
-                PROM_LOCKS_HELD.labels(type_).inc()
-            elif out == 'TIMEOUT':
-                logger.debug("Timeout getting %s lock: %r", type_, filepath)
-                raise TimeoutError
-            elif out == 'NOTFOUND':
-                raise FileNotFoundError
-            else:
-                logger.error("Error getting %s lock: %r", type_, filepath)
-                raise OSError("Error getting %s lock: %r", type_, filepath)
+            handle = _manager.acquire(filepath, exclusive, timeout=timeout)
+    except TimeoutError:
+        logger.debug("Timeout getting %s lock: %r", type_, filepath)
+        raise
+    except FileNotFoundError:
+        raise
+    except Exception:
+        logger.error("Error getting %s lock: %r", type_, filepath)
+        raise
+    logger.info("Acquired %s lock: %r", type_, filepath)
+    PROM_LOCKS_HELD.labels(type_).inc()
 
+    try:
         yield
     finally:
-        if not started:
-            return
         logger.debug("Releasing %s lock: %r", type_, filepath)
-        start = time.perf_counter()
-        pipe.send('UNLOCK')
-        join_process(proc, 60)
-        if proc.exitcode != 0:
-            logger.critical("Failed (%r) to release %s lock: %r",
-                            proc.exitcode, type_, filepath)
-            raise SystemExit("Failed (%r) to release %s lock: %r" % (
-                proc.exitcode, type_, filepath,
-            ))
-        now = time.perf_counter()
-        if now - start > 10:
-            logger.critical("Releasing %s lock took %.2fs: %r",
-                            type_, now - start, filepath)
-        logger.info("Released %s lock: %r", type_, filepath)
-        if locked:
+        try:
+            _manager.release(handle)
+        finally:
             PROM_LOCKS_HELD.labels(type_).dec()
+        logger.info("Released %s lock: %r", type_, filepath)
 
 
 def FSLockExclusive(filepath, timeout=None):
@@ -6,6 +6,7 @@ import pandas
 import string
 import sys
 import tempfile
+import tracemalloc
 
 from datamart_profiler import process_dataset
 
@@ -57,6 +58,39 @@ def parse_size(number):
     return size
 
 
+def print_timings(stats, file=sys.stderr):
+    """Print the time spent in each stage, and on each column.
+    """
+    memory = 'peak_memory' in stats
+
+    def print_header(title):
+        line = '%-40s %6s %10s %10s' % (title, 'calls', 'wall (s)', 'cpu (s)')
+        if memory:
+            line += ' %10s' % 'peak (MB)'
+        print(line, file=file)
+
+    def print_line(name, entry):
+        line = '%-40s %6d %10.3f %10.3f' % (
+            name[:40], entry['calls'], entry['wall_time'], entry['cpu_time'],
+        )
+        if memory:
+            line += ' %10.1f' % (entry.get('peak_memory', 0) / 1e6)
+        print(line, file=file)
+
+    print_header('stage')
+    for name, entry in sorted(
+        stats['stages'].items(),
+        key=lambda item: -item[1]['wall_time'],
+    ):
+        print_line(name, entry)
+    print(file=file)
+    print_header('column')
+    for column in sorted(stats['columns'], key=lambda c: -c['wall_time']):
+        print_line(column['name'], column)
+    print(file=file)
+    print_line('total', dict(stats, calls=1))
+
+
 def main():
     parser = argparse.ArgumentParser('datamart_profiler')
     parser.add_argument('-v', action='count',
@@ -74,6 +108,26 @@ def main():
     parser.add_argument('--load-max-size', action='store', nargs=1,
                         help="target size of the data to be analyzed. The "
                              "data will be randomly sampled if it is bigger")
+    parser.add_argument('-j', '--workers', action='store', type=int,
+                        default=None,
+                        help="number of processes to use to profile columns "
+                             "in parallel")
+    parser.add_argument('--streaming', action='store_true', default=False,
+                        help="compute column statistics from all the rows, "
+                             "even if the data is sampled")
+    parser.add_argument('--arrow-strings', action='store_true',
+                        default=False,
+                        help="load the data as Arrow strings, using less "
+                             "memory (requires pyarrow)")
+    parser.add_argument('--type-confidence', action='store', type=float,
+                        default=None,
+                        help="detect column types from a growing sample of "
+                             "rows, until they are settled with this "
+                             "confidence (for example 0.999)")
+    parser.add_argument('--timings', action='store_true', default=False,
+                        help="record the time and memory used by each stage "
+                             "of the profiler and each column, print them to "
+                             "stderr and add them to the result")
     parser.add_argument('file', nargs=1, help="file to profile")
     if detect_format_convert_to_csv is None:
         parser.add_argument(
@@ -166,6 +220,8 @@ def main():
             )
 
         # Profile
+        if args.timings:
+            tracemalloc.start()
         try:
             metadata = process_dataset(
                 input_file,
@@ -174,6 +230,11 @@ def main():
                 coverage=args.coverage,
                 plots=args.plots,
                 load_max_size=load_max_size,
+                workers=args.workers,
+                streaming=args.streaming,
+                profiling_stats=args.timings,
+                arrow_strings=args.arrow_strings,
+                type_confidence=args.type_confidence,
             )
         except (pandas.errors.ParserError, UnicodeError):
             if detect_format_convert_to_csv is None:
@@ -190,6 +251,8 @@ def main():
 
     if materialize:
         metadata['materialize'] = materialize
+    if args.timings:
+        print_timings(metadata['profiling_stats'])
     json.dump(metadata, sys.stdout, indent=2, sort_keys=True)
 
 
@@ -1,12 +1,16 @@
 import codecs
 import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import contextlib
 import csv
 from datetime import datetime
+import io
 import itertools
 import logging
 import math
+import multiprocessing
 import numpy
+import opentelemetry.propagate
 import opentelemetry.trace
 import os
 import pandas
@@ -14,20 +18,23 @@ from pandas.errors import EmptyDataError
 import prometheus_client
 import string
 import time
-import random
 import re
+import threading
 import warnings
 
 from .numerical import mean_stddev, get_numerical_ranges
 from .profile_types import identify_types, determine_dataset_type
+from .sketches import TableSummary
 from .spatial import LatLongColumn, Geohasher, nominatim_resolve_all, \
     pair_latlong_columns, get_spatial_ranges, parse_wkt_column
+from .stats import ProfilingStats, collect_stats, get_current_stats, \
+    get_tracer
 from .temporal import get_temporal_resolution
 from . import types
 
 
 logger = logging.getLogger(__name__)
-tracer = opentelemetry.trace.get_tracer(__name__)
+tracer = get_tracer(__name__)
 
 
 RANDOM_SEED = 89
@@ -47,6 +54,10 @@ HEADER_CONSISTENT_ROWS = 4
 
 MAX_GEOHASHES = 100
 
+SAMPLE_BLOCK_SIZE = 16 * 1024 * 1024  # 16 MB
+
+LAZO_CONCURRENCY = 4  # Columns sent to Lazo at the same time
+
 
 BUCKETS = [
     1.0, 2.0, 4.0, 7.0, 12.0, 20.0, 32.0, 52.0, 80.0, 120.0, 190.0,
@@ -173,8 +184,188 @@ def count_rows_to_skip(file):
         file.seek(0, 0)
 
 
-def load_data(data, load_max_size=None, indexes=True):
+def _read_blocks(file):
+    """Read a file in blocks of bytes, even if it was opened in text mode.
+    """
+    while True:
+        block = file.read(SAMPLE_BLOCK_SIZE)
+        if not block:
+            return
+        if isinstance(block, str):
+            block = block.encode('utf-8')
+        yield block
+
+
+_FIELD_BOUNDARIES = numpy.array([ord(','), ord('\n'), ord('\r')], numpy.uint8)
+
+
+def csv_row_ends(buf):
+    """Find where the rows end in a buffer of CSV data.
+
+    Rows end on the newlines that are not inside quoted fields. Like pandas'
+    parser, a quote only starts a quoted field at the beginning of a field,
+    it is a normal character anywhere else (for example ``6'2"``).
+
+    :param buf: Bytes, starting at the beginning of a row
+    :return: The offsets after each newline that ends a row
+    """
+    array = numpy.frombuffer(buf, dtype=numpy.uint8)
+    newlines = numpy.flatnonzero(array == ord('\n'))
+    quotes = numpy.flatnonzero(array == ord('"'))
+    if len(quotes) == 0:
+        return newlines + 1
+
+    # Runs of consecutive quotes: inside a quoted field, each pair is an
+    # escaped quote, and an odd one out ends the field
+    first = numpy.concatenate([[True], quotes[1:] != quotes[:-1] + 1])
+    run_starts = quotes[first]
+    run_lengths = numpy.diff(
+        numpy.append(numpy.flatnonzero(first), len(quotes)),
+    )
+    run_ends = run_starts + run_lengths
+    at_field_start = (run_starts == 0) | numpy.isin(
+        array[numpy.maximum(run_starts - 1, 0)], _FIELD_BOUNDARIES,
+    )
+    at_field_end = (run_ends == len(array)) | numpy.isin(
+        array[numpy.minimum(run_ends, len(array) - 1)], _FIELD_BOUNDARIES,
+    )
+
+    # If quoted fields are only opened at the start of a field and closed at
+    # its end, the number of quotes before a newline says if it's in a field
+    inside = (numpy.cumsum(run_lengths) - run_lengths) % 2 == 1
+    closing = inside == (run_lengths % 2 == 1)
+    if (at_field_start | inside).all() and (at_field_end | ~closing).all():
+        parity = numpy.cumsum(array == ord('"'), dtype=numpy.uint8)
+        return newlines[parity[newlines] % 2 == 0] + 1
+
+    # Otherwise, follow the quoted fields one run of quotes at a time
+    opens = []
+    closes = []
+    in_field = False
+    for start, length, field_start in zip(
+        run_starts.tolist(), run_lengths.tolist(), at_field_start.tolist(),
+    ):
+        if not in_field:
+            if not field_start:
+                continue  # Quote in the middle of an unquoted field
+            in_field = True
+            opens.append(start)
+            length -= 1
+        if length % 2 == 1:
+            in_field = False
+            closes.append(start + length)
+    if in_field:
+        closes.append(len(array))
+    if not opens:
+        return newlines + 1
+    field = numpy.searchsorted(opens, newlines) - 1
+    in_fields = (field >= 0) & (
+        newlines < numpy.array(closes)[numpy.maximum(field, 0)]
+    )
+    return newlines[~in_fields] + 1
+
+
+def sample_rows(file, ratio, size, summary=None):
+    """Randomly sample the rows of a CSV file, reading it only once.
+
+    Each row gets a random priority, and the ``ceil(ratio * nb_rows)`` rows
+    with the lowest priorities are selected, which is a uniform sample. Since
+    the number of rows is only known at the end, rows are kept as candidates
+    if their priority is under a threshold set a few standard deviations over
+    the ratio, estimated from the size of the file.
+
+    Rows are split on the newlines that are not inside quoted fields, see
+    `csv_row_ends()`.
+
+    :param file: File object to read, binary or text
+    :param ratio: Ratio of the rows to select
+    :param size: Size of the file, used to estimate the number of rows
+    :param summary: Optional `TableSummary`, to which all the rows will be
+        added as they are read
+    :return: A tuple ``(header, rows, nb_rows)`` where ``header`` is the
+        first row as bytes, ``rows`` is the list of selected rows as bytes in
+        file order, and ``nb_rows`` is the total number of rows (excluding
+        header)
+    """
+    rand = numpy.random.default_rng(RANDOM_SEED)
+    threshold = None
+    header = None
+    nb_rows = 0
+    priorities = []
+    rows = []
+
+    def add_rows(buf, starts, ends):
+        nonlocal threshold, nb_rows
+        if threshold is None:
+            # Estimate the number of rows from the first block
+            nb_rows_est = max(1.0, size * len(starts) / max(1, ends[-1]))
+            threshold = (
+                ratio
+                + 6.0 * math.sqrt(ratio * (1.0 - ratio) / nb_rows_est)
+                + 10.0 / nb_rows_est
+            )
+        nb_rows += len(starts)
+        if summary is not None:
+            summary.add_csv(header + buf[starts[0]:ends[-1]])
+        block_priorities = rand.random(len(starts))
+        selected = numpy.flatnonzero(block_priorities < threshold)
+        priorities.append(block_priorities[selected])
+        rows.extend(buf[starts[i]:ends[i]] for i in selected)
+
+    leftover = b''
+    for block in _read_blocks(file):
+        buf = leftover + block
+        # The buffer always starts at the beginning of a row
+        ends = csv_row_ends(buf)
+        if len(ends) == 0:
+            leftover = buf
+            continue
+        starts = numpy.concatenate([[0], ends[:-1]])
+        leftover = buf[ends[-1]:]
+
+        if header is None:
+            header = buf[:ends[0]]
+            starts, ends = starts[1:], ends[1:]
+        if len(starts) > 0:
+            add_rows(buf, starts, ends)
+
+    # Last row, if the file doesn't end with a newline
+    if leftover:
+        leftover += b'\n'
+        if header is None:
+            header = leftover
+        else:
+            add_rows(leftover, [0], [len(leftover)])
+
+    if header is None:
+        return b'', [], 0
+
+    # Select the rows with the lowest priorities, in file order
+    priorities = numpy.concatenate(priorities or [[]])
+    selected = numpy.argsort(priorities, kind='stable')
+    selected = numpy.sort(selected[:math.ceil(ratio * nb_rows)])
+    return header, [rows[i] for i in selected], nb_rows
+
+
+def _arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow is not installed, can't use Arrow strings")
+        return False
+    return True
+
+
+def load_data(
+    data, load_max_size=None, indexes=True, summary=None,
+    arrow_strings=False,
+):
     metadata = {}
+    if arrow_strings and not _arrow_available():
+        arrow_strings = False
+    # Arrow strings are stored in contiguous buffers, instead of one Python
+    # object per cell
+    string_dtype = 'string[pyarrow]' if arrow_strings else str
 
     if isinstance(data, pandas.DataFrame):
         if load_max_size is not None:
@@ -197,6 +388,8 @@ def load_data(data, load_max_size=None, indexes=True):
         # Change to object dtype first and do fillna() to work around bug
         # https://github.com/pandas-dev/pandas/issues/25353 (nan as str 'nan')
         data = data.astype(object).fillna('').astype(str)
+        if arrow_strings:
+            data = data.astype(string_dtype)
 
         column_names = data.columns
     else:
@@ -246,32 +439,27 @@ def load_data(data, load_max_size=None, indexes=True):
 
             # Load the data
             if metadata['size'] > load_max_size:
-                logger.info("Counting rows...")
-                metadata['nb_rows'] = sum(1 for _ in data)
+                # Sub-sample
+                ratio = load_max_size / metadata['size']
+                logger.info("Sampling rows, sample ratio=%r...", ratio)
+                header, rows, metadata['nb_rows'] = sample_rows(
+                    data, ratio, metadata['size'],
+                    summary=summary,
+                )
                 if metadata['nb_rows'] > 0:
                     metadata['average_row_size'] = (
                         metadata['size'] / metadata['nb_rows']
                     )
-                data.seek(0, 0)
 
-                # Sub-sample
-                ratio = load_max_size / metadata['size']
-                logger.info("Loading dataframe, sample ratio=%r...", ratio)
-                rand = random.Random(RANDOM_SEED)
-                selected_rows = set(rand.sample(
-                    range(1, metadata['nb_rows']),
-                    math.ceil(ratio * (metadata['nb_rows'] - 1)),
-                ))
-                selected_rows.add(0)  # Always get the header
+                logger.info("Loading dataframe, %d rows...", len(rows))
                 data = pandas.read_csv(
-                    data,
-                    dtype=str, na_filter=False,
-                    skiprows=lambda i: i not in selected_rows,
+                    io.BytesIO(b''.join([header] + rows)),
+                    dtype=string_dtype, na_filter=False,
                 )
             else:
                 logger.info("Loading dataframe...")
                 data = pandas.read_csv(data,
-                                       dtype=str, na_filter=False)
+                                       dtype=string_dtype, na_filter=False)
 
                 metadata['nb_rows'] = data.shape[0]
                 if metadata['nb_rows'] > 0:
@@ -293,11 +481,18 @@ def process_column(
     coverage=True,
     geo_data=None,
     nominatim=None,
+    nominatim_cache=None,
+    type_confidence=None,
 ):
     # Identify types
+    parsed = {}
     with tracer.start_as_current_span('profile/identify_types'):
         structural_type, semantic_types_dict, additional_meta = \
-            identify_types(array, column_meta['name'], geo_data, manual)
+            identify_types(
+                array, column_meta['name'], geo_data, manual,
+                parsed=parsed,
+                confidence=type_confidence,
+            )
     logger.info(
         "Column type %s [%s]",
         structural_type,
@@ -325,15 +520,10 @@ def process_column(
     ):
         # Get numerical values needed for either ranges or plot
         with tracer.start_as_current_span('profile/parse_numerical_values'):
-            numerical_values = []
-            for e in array:
-                try:
-                    e = float(e)
-                except ValueError:
-                    pass
-                else:
-                    if -3.4e38 < e < 3.4e38:  # Overflows in ES
-                        numerical_values.append(e)
+            numbers = parsed['numbers']
+            numerical_values = numbers[
+                (-3.4e38 < numbers) & (numbers < 3.4e38)  # Overflows in ES
+            ]
 
         # Compute ranges from numerical values
         if coverage:
@@ -366,15 +556,17 @@ def process_column(
                     ]
                 }
 
+    if (
+        structural_type in (types.INTEGER, types.FLOAT)
+        and 'numbers' in parsed
+    ):
+        # Used for spatial coverage if this is latitude or longitude
+        resolved['numbers'] = parsed['numbers']
+
     if types.DATE_TIME in semantic_types_dict:
-        datetimes = semantic_types_dict[types.DATE_TIME]
-        resolved['datetimes'] = datetimes
-        timestamps = numpy.empty(
-            len(datetimes),
-            dtype='float32',
-        )
-        for j, dt in enumerate(datetimes):
-            timestamps[j] = dt.timestamp()
+        # Only the distinct dates are needed to get the resolution
+        resolved['distinct_datetimes'] = parsed['dates']
+        timestamps = parsed['timestamps'].astype('float32')
         resolved['timestamps'] = timestamps
 
         # Compute histogram from temporal values
@@ -399,13 +591,14 @@ def process_column(
                 }
 
     # Compute histogram from categorical values
+    values, value_counts, _ = parsed['value_counts']
     if plots and types.CATEGORICAL in semantic_types_dict:
         with tracer.start_as_current_span('profile/categorical_plot'):
             counter = collections.Counter()
-            for value in array:
+            for value, count in zip(values, value_counts):
                 if not value:
                     continue
-                counter[value] += 1
+                counter[value] = int(count)
             counts = counter.most_common(5)
             counts = sorted(counts)
             column_meta['plot'] = {
@@ -426,11 +619,11 @@ def process_column(
     ):
         with tracer.start_as_current_span('profile/textual_plot'):
             counter = collections.Counter()
-            for value in array:
+            for value, count in zip(values, value_counts):
                 for word in _re_word_split.split(value):
                     word = word.lower()
                     if word:
-                        counter[word] += 1
+                        counter[word] += int(count)
             counts = counter.most_common(5)
             column_meta['plot'] = {
                 "type": "histogram_text",
@@ -454,6 +647,7 @@ def process_column(
             locations, non_empty = nominatim_resolve_all(
                 nominatim,
                 array,
+                cache=nominatim_cache,
             )
         if non_empty > 0:
             unclean_ratio = 1.0 - len(locations) / non_empty
@@ -472,6 +666,199 @@ def process_column(
     return resolved
 
 
+def _get_numbers(data, resolved_columns, idx):
+    """Get the numbers parsed from a column, or parse them now.
+    """
+    try:
+        return resolved_columns[idx]['numbers']
+    except KeyError:
+        return pandas.to_numeric(data.iloc[:, idx], errors='coerce').values
+
+
+def apply_table_summary(columns, summary):
+    """Update the columns' metadata with statistics from a `TableSummary`.
+
+    Only the statistics that have already been computed from the sample are
+    replaced.
+    """
+    for column_meta, column_summary in zip(columns, summary.columns):
+        if column_meta['structural_type'] == types.MISSING_DATA:
+            continue
+        if column_summary.empty > 0:
+            column_meta['missing_values_ratio'] = (
+                column_summary.empty / column_summary.rows
+            )
+        else:
+            column_meta.pop('missing_values_ratio', None)
+        if 'num_distinct_values' in column_meta:
+            column_meta['num_distinct_values'] = \
+                column_summary.distinct.count()
+        if (
+            'mean' in column_meta
+            and column_summary.numbers is not None
+            and column_summary.numbers.count
+        ):
+            column_meta['mean'] = column_summary.numbers.mean
+            column_meta['stddev'] = column_summary.numbers.stddev
+
+
+# State of the running process_dataset() calls, inherited by the worker
+# processes when they are forked
+_workers_state = {}
+_workers_state_lock = threading.Lock()
+
+
+def _pack_areas(areas):
+    """Turn admin areas into tuples that can be sent between processes.
+    """
+    return [
+        None if area is None else (
+            area.id, area.name, area.type, area.levels,
+            area.latitude, area.longitude, area.bounds,
+        )
+        for area in areas
+    ]
+
+
+def _unpack_areas(areas, geo_data):
+    """Rebuild admin areas from the tuples made by `_pack_areas()`.
+    """
+    from datamart_geo import Area
+
+    cache = {}
+    result = []
+    for area in areas:
+        if area is not None:
+            area_id = area[0]
+            try:
+                area = cache[area_id]
+            except KeyError:
+                area = cache[area_id] = Area(geo_data, *area)
+        result.append(area)
+    return result
+
+
+def _init_column_worker(token):
+    data, columns, kwargs = _workers_state[token]
+    geo_data = kwargs['geo_data']
+    if geo_data is not None:
+        # SQLite connections can't be used across fork, make sure the
+        # database is opened again in this process
+        geo_data._thread_local = threading.local()
+
+
+def _process_column_worker(
+    token, column_idx, manual, trace_carrier, profiling_stats,
+):
+    data, columns, kwargs = _workers_state[token]
+    column_meta = columns[column_idx]
+    name = column_meta['name']
+    stats = ProfilingStats() if profiling_stats else None
+    with collect_stats(stats), tracer.start_as_current_span(
+        'profile/column',
+        context=opentelemetry.propagate.extract(trace_carrier),
+        attributes={'idx': column_idx, 'name': name},
+    ):
+        logger.info("Processing column %d %r...", column_idx, name)
+        resolved = process_column(
+            data.iloc[:, column_idx], column_meta,
+            manual=manual,
+            **kwargs
+        )
+    if 'admin_areas' in resolved:
+        resolved['admin_areas'] = _pack_areas(resolved['admin_areas'])
+
+    # Spans are only exported in the background, send them before the
+    # process goes away
+    tracer_provider = opentelemetry.trace.get_tracer_provider()
+    if hasattr(tracer_provider, 'force_flush'):
+        tracer_provider.force_flush()
+
+    if stats is not None:
+        stats = stats.columns[column_idx]
+    return column_meta, resolved, stats
+
+
+def process_columns_parallel(
+    data, columns, manual_columns, workers,
+    **kwargs
+):
+    """Run `process_column()` for all the columns, using worker processes.
+
+    The workers are forked from the current process, so they have access to
+    the data without it being copied.
+
+    :param workers: Number of processes to use
+    :return: A dict mapping the column index to the resolved values
+    """
+    stats = get_current_stats()
+    with _workers_state_lock:
+        token = max(_workers_state, default=0) + 1
+        _workers_state[token] = data, columns, kwargs
+    try:
+        trace_carrier = {}
+        opentelemetry.propagate.inject(trace_carrier)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_column_worker,
+            initargs=(token,),
+        ) as executor:
+            results = executor.map(
+                _process_column_worker,
+                itertools.repeat(token),
+                range(len(columns)),
+                [
+                    manual_columns.get(column_meta['name'])
+                    for column_meta in columns
+                ],
+                itertools.repeat(trace_carrier),
+                itertools.repeat(stats is not None),
+            )
+
+            resolved_columns = {}
+            for column_idx, (column_meta, resolved, column_stats) in \
+                    enumerate(results):
+                if column_stats is not None:
+                    stats.add_column(column_idx, column_stats)
+                # Update the column_meta dict in place, like process_column()
+                columns[column_idx].clear()
+                columns[column_idx].update(column_meta)
+                if 'admin_areas' in resolved:
+                    resolved['admin_areas'] = _unpack_areas(
+                        resolved['admin_areas'],
+                        kwargs['geo_data'],
+                    )
+                resolved_columns[column_idx] = resolved
+    finally:
+        with _workers_state_lock:
+            _workers_state.pop(token)
+    return resolved_columns
+
+
+def _lazo_map(func, data, columns_textual, column_textual_names):
+    """Call Lazo for each column, sending multiple columns at the same time.
+
+    `func` is called with the distinct values of the column and its name.
+    Lazo's sketches only depend on the set of values, so sending each value
+    once gives the same result, with a much smaller request.
+
+    :return: The results of the calls, in the order of the columns
+    """
+    def call_lazo(idx, name):
+        values = pandas.unique(data.iloc[:, idx].values).tolist()
+        return _lazo_retry(lambda: func(values, name))
+
+    with ThreadPoolExecutor(
+        max_workers=min(LAZO_CONCURRENCY, len(columns_textual)),
+    ) as executor:
+        futures = [
+            executor.submit(call_lazo, idx, name)
+            for idx, name in zip(columns_textual, column_textual_names)
+        ]
+        return [future.result() for future in futures]
+
+
 @PROM_LAZO.time()
 def lazo_index_data(
     data,
@@ -481,15 +868,15 @@ def lazo_index_data(
 ):
     logger.info("Indexing textual data with Lazo...")
     start = time.perf_counter()
-    for idx, name in zip(columns_textual, column_textual_names):
-        def call_lazo():
-            lazo_client.index_data(
-                data.iloc[:, idx].values.tolist(),
-                dataset_id,
-                name,
-            )
-
-        _lazo_retry(call_lazo)
+    _lazo_map(
+        lambda values, name: lazo_client.index_data(
+            values,
+            dataset_id,
+            name,
+        ),
+        data,
+        columns_textual, column_textual_names,
+    )
     logger.info(
         "Indexing with Lazo took %.2fs seconds",
         time.perf_counter() - start,
@@ -504,16 +891,15 @@ def get_lazo_data_sketch(
 ):
     logger.info("Sketching textual data with Lazo...")
     start = time.perf_counter()
-    lazo_sketches = []
-    for idx, name in zip(columns_textual, column_textual_names):
-        def call_lazo():
-            return lazo_client.get_lazo_sketch_from_data(
-                data.iloc[:, idx].values.tolist(),
-                "",
-                name,
-            )
-
-        lazo_sketches.append(_lazo_retry(call_lazo))
+    lazo_sketches = _lazo_map(
+        lambda values, name: lazo_client.get_lazo_sketch_from_data(
+            values,
+            "",
+            name,
+        ),
+        data,
+        columns_textual, column_textual_names,
+    )
     logger.info(
         "Sketching with Lazo took %.2fs seconds",
         time.perf_counter() - start,
@@ -526,7 +912,9 @@ def process_dataset(data, dataset_id=None, metadata=None,
                     lazo_client=None, nominatim=None, geo_data=None,
                     search=False, include_sample=False,
                     coverage=True, plots=False, indexes=True,
-                    load_max_size=None,
+                    load_max_size=None, workers=None, nominatim_cache=None,
+                    streaming=False, profiling_stats=False,
+                    arrow_strings=False, type_confidence=None,
                     **kwargs):
     """Compute all metafeatures from a dataset.
 
@@ -550,6 +938,29 @@ def process_dataset(data, dataset_id=None, metadata=None,
     :param load_max_size: Target size of the data to be analyzed. The data will
         be randomly sampled if it is bigger. Defaults to `MAX_SIZE`, currently
         5 MB. This is different from the sample data included in the result.
+    :param workers: Number of processes to use to profile the columns in
+        parallel. Defaults to 1, profiling all columns in the current process.
+        Only available on platforms that can fork.
+    :param nominatim_cache: A `GeocodeCache` used to avoid sending the same
+        addresses to Nominatim again, for example from `open_geocode_cache()`
+    :param streaming: If the data is a file bigger than `load_max_size`,
+        compute column statistics from all the rows while sampling, instead
+        of from the sample (number of distinct values, missing values ratio,
+        mean and standard deviation). Types and ranges are still computed
+        from the sample.
+    :param profiling_stats: Whether to record the time spent in each stage
+        of the profiler, overall and for each column, and add it to the
+        result as ``profiling_stats``. The peak memory allocated by each stage
+        is also recorded if `tracemalloc` is tracing.
+    :param arrow_strings: Whether to load the data as Arrow strings
+        (``string[pyarrow]``) instead of Python objects, which uses a lot less
+        memory. Requires pyarrow.
+    :param type_confidence: If set, detect the types of each column from a
+        random sample of its rows, which grows until the result is the same
+        as from all the rows with this probability (for example 0.999). This
+        is much faster on big columns that are clearly of one type. Unclean
+        and missing values ratios are then estimated, and the number of rows
+        used is added to the column as ``type_sample_size``.
     :return: JSON structure (dict)
     """
     if 'sample_size' in kwargs:
@@ -564,6 +975,29 @@ def process_dataset(data, dataset_id=None, metadata=None,
             next(iter(kwargs))
         )
 
+    stats = ProfilingStats() if profiling_stats else None
+    with collect_stats(stats):
+        metadata = _process_dataset(
+            data, dataset_id, metadata,
+            lazo_client, nominatim, geo_data,
+            search, include_sample,
+            coverage, plots, indexes,
+            load_max_size, workers, nominatim_cache,
+            streaming, arrow_strings, type_confidence,
+        )
+    if stats is not None:
+        metadata['profiling_stats'] = stats.to_json()
+    return metadata
+
+
+def _process_dataset(
+    data, dataset_id, metadata,
+    lazo_client, nominatim, geo_data,
+    search, include_sample,
+    coverage, plots, indexes,
+    load_max_size, workers, nominatim_cache,
+    streaming, arrow_strings, type_confidence,
+):
     if geo_data is True:
         from datamart_geo import GeoData
 
@@ -573,12 +1007,16 @@ def process_dataset(data, dataset_id=None, metadata=None,
         metadata = {}
 
     # Load or prepare data for processing
+    summary = TableSummary() if streaming else None
     try:
-        data, file_metadata, column_names = load_data(
-            data,
-            load_max_size=load_max_size,
-            indexes=indexes,
-        )
+        with tracer.start_as_current_span('profile/load_data'):
+            data, file_metadata, column_names = load_data(
+                data,
+                load_max_size=load_max_size,
+                indexes=indexes,
+                summary=summary,
+                arrow_strings=arrow_strings,
+            )
     except EmptyDataError:
         logger.warning("Dataframe is empty!")
         metadata['nb_rows'] = 0
@@ -624,28 +1062,59 @@ def process_dataset(data, dataset_id=None, metadata=None,
     # build coverage information would be too slow
     resolved_columns = {}
 
+    if (
+        workers is not None and workers > 1
+        and 'fork' not in multiprocessing.get_all_start_methods()
+    ):
+        logger.warning("Can't fork, profiling columns sequentially")
+        workers = None
+
     # Identify types
     logger.info("Identifying types, %d columns...", len(columns))
     with PROM_TYPES.time():
         with tracer.start_as_current_span('profile/columns'):
-            for column_idx, column_meta in enumerate(columns):
-                name = column_meta['name']
-                with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
-                    logger.info("Processing column %d %r...", column_idx, name)
-                    array = data.iloc[:, column_idx]
-                    if name in manual_columns:
-                        manual = manual_columns[name]
-                    else:
-                        manual = None
-                    # Process the column, updating the column_meta dict
-                    resolved_columns[column_idx] = process_column(
-                        array, column_meta,
-                        manual=manual,
-                        plots=plots,
-                        coverage=coverage,
-                        geo_data=geo_data,
-                        nominatim=nominatim,
-                    )
+            if workers is not None and workers > 1:
+                logger.info("Using %d worker processes", workers)
+                resolved_columns = process_columns_parallel(
+                    data, columns, manual_columns, workers,
+                    plots=plots,
+                    coverage=coverage,
+                    geo_data=geo_data,
+                    nominatim=nominatim,
+                    nominatim_cache=nominatim_cache,
+                    type_confidence=type_confidence,
+                )
+            else:
+                for column_idx, column_meta in enumerate(columns):
+                    name = column_meta['name']
+                    with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
+                        logger.info("Processing column %d %r...", column_idx, name)
+                        array = data.iloc[:, column_idx]
+                        if name in manual_columns:
+                            manual = manual_columns[name]
+                        else:
+                            manual = None
+                        # Process the column, updating the column_meta dict
+                        resolved_columns[column_idx] = process_column(
+                            array, column_meta,
+                            manual=manual,
+                            plots=plots,
+                            coverage=coverage,
+                            geo_data=geo_data,
+                            nominatim=nominatim,
+                            nominatim_cache=nominatim_cache,
+                            type_confidence=type_confidence,
+                        )
+
+    # Replace statistics computed on the sample
+    if (
+        summary is not None
+        and not summary.failed
+        and summary.columns is not None
+        and len(summary.columns) == len(columns)
+    ):
+        logger.info("Using statistics from all %d rows", summary.rows)
+        apply_table_summary(columns, summary)
 
     # Textual columns
     columns_textual = [
@@ -752,10 +1221,12 @@ def process_dataset(data, dataset_id=None, metadata=None,
             with tracer.start_as_current_span('profile/spatial_coverage'):
                 # Compute sketches from lat/long pairs
                 for col_lat, col_long in latlong_pairs:
-                    lat_values = data.iloc[:, col_lat.index]
-                    lat_values = pandas.to_numeric(lat_values, errors='coerce')
-                    long_values = data.iloc[:, col_long.index]
-                    long_values = pandas.to_numeric(long_values, errors='coerce')
+                    lat_values = _get_numbers(
+                        data, resolved_columns, col_lat.index,
+                    )
+                    long_values = _get_numbers(
+                        data, resolved_columns, col_long.index,
+                    )
                     mask = (
                         ~numpy.isnan(lat_values)
                         & ~numpy.isnan(long_values)
@@ -800,7 +1271,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
                         data.iloc[:, i],
                         latlong=latlong,
                     )
-                    total = numpy.sum(data.iloc[:, i].apply(lambda x: bool(x)))
+                    total = numpy.sum(data.iloc[:, i] != '')
                     if len(values) < 0.5 * total:
                         logger.warning(
                             "Most data points did not parse correctly as "
@@ -808,7 +1279,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
                             'lat,long' if latlong else 'long,lat',
                             i, col,
                         )
-                    if values:
+                    if len(values):
                         logger.info(
                             "Computing spatial sketches point=%r (%d rows)",
                             name, len(values),
@@ -933,11 +1404,10 @@ def process_dataset(data, dataset_id=None, metadata=None,
             for idx, col in enumerate(columns):
                 if types.DATE_TIME not in col['semantic_types']:
                     continue
-                datetimes = resolved_columns[idx]['datetimes']
                 timestamps = resolved_columns[idx]['timestamps']
                 logger.info(
                     "Computing temporal ranges datetime=%r (%d rows)",
-                    col['name'], len(datetimes),
+                    col['name'], len(timestamps),
                 )
 
                 # Get temporal ranges
@@ -946,7 +1416,9 @@ def process_dataset(data, dataset_id=None, metadata=None,
                     continue
 
                 # Get temporal resolution
-                resolution = get_temporal_resolution(datetimes)
+                resolution = get_temporal_resolution(
+                    resolved_columns[idx]['distinct_datetimes'],
+                )
 
                 temporal_coverage.append({
                     'type': 'datetime',
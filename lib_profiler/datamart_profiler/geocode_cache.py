@@ -0,0 +1,236 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger(__name__)
+
+
+GEOCODE_CACHE_SIZE = 1000000  # Addresses kept in a persistent cache
+GEOCODE_CACHE_EVICT = 0.10  # Fraction of the entries evicted when full
+GEOCODE_CACHE_TTL = 90 * 24 * 3600  # 90 days, for Redis
+
+
+def normalize_address(value):
+    """Normalize an address, to be used as the key in a geocode cache.
+    """
+    value = unicodedata.normalize('NFC', value)
+    return ' '.join(value.lower().split())
+
+
+class GeocodeCache(object):
+    """Cache of resolved addresses, shared across calls to the profiler.
+
+    Keys are normalized addresses, see `normalize_address()`. Values are
+    ``(latitude, longitude)`` tuples, or ``None`` for addresses that could
+    not be resolved.
+    """
+    def get_many(self, keys):
+        """Look up addresses in the cache.
+
+        :return: A dict with the entries that were found
+        """
+        raise NotImplementedError
+
+    def set_many(self, entries):
+        """Add entries to the cache, evicting older ones if necessary.
+        """
+        raise NotImplementedError
+
+
+class MemoryGeocodeCache(GeocodeCache):
+    """In-memory geocode cache with LRU eviction.
+    """
+    def __init__(self, max_entries=GEOCODE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        result = {}
+        with self._lock:
+            for key in keys:
+                try:
+                    result[key] = self._entries[key]
+                except KeyError:
+                    pass
+                else:
+                    self._entries.move_to_end(key)
+        return result
+
+    def set_many(self, entries):
+        with self._lock:
+            for key, location in entries.items():
+                self._entries[key] = location
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteGeocodeCache(GeocodeCache):
+    """Geocode cache stored in a local SQLite database, with LRU eviction.
+
+    The file can be shared by multiple processes. When it grows over
+    `max_entries`, the least recently used tenth of the entries are removed.
+    """
+    def __init__(self, path, max_entries=GEOCODE_CACHE_SIZE):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self._thread_local = threading.local()
+        self._count = None  # Approximate number of entries
+
+        database = self._database
+        with database:
+            database.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS addresses(
+                    address TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    used REAL NOT NULL
+                );
+                '''
+            )
+            database.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS addresses_used
+                ON addresses(used);
+                '''
+            )
+
+    @property
+    def _database(self):
+        # SQLite connections can't be shared between threads, or used across
+        # fork, so we open one per thread and per process
+        tl = self._thread_local
+        database = getattr(tl, 'database', None)
+        if database is None or tl.pid != os.getpid():
+            database = sqlite3.connect(self.path, timeout=30)
+            database.execute('PRAGMA journal_mode=WAL;')
+            tl.database = database
+            tl.pid = os.getpid()
+        return database
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        database = self._database
+        placeholders = ', '.join('?' for _ in keys)
+        with database:
+            cur = database.execute(
+                '''
+                SELECT address, latitude, longitude
+                FROM addresses
+                WHERE address IN ({0});
+                '''.format(placeholders),
+                keys,
+            )
+            result = {
+                address: None if lat is None else (lat, long)
+                for address, lat, long in cur
+            }
+            if result:
+                database.execute(
+                    '''
+                    UPDATE addresses SET used = ?
+                    WHERE address IN ({0});
+                    '''.format(', '.join('?' for _ in result)),
+                    [time.time()] + list(result),
+                )
+        return result
+
+    def set_many(self, entries):
+        if not entries:
+            return
+        database = self._database
+        now = time.time()
+        with database:
+            database.executemany(
+                '''
+                INSERT OR REPLACE INTO addresses(
+                    address, latitude, longitude, used
+                )
+                VALUES (?, ?, ?, ?);
+                ''',
+                [
+                    (key, None, None, now) if location is None
+                    else (key, location[0], location[1], now)
+                    for key, location in entries.items()
+                ],
+            )
+
+            # Only count the entries once in a while
+            if self._count is None or self._count >= self.max_entries:
+                self._count, = database.execute(
+                    'SELECT COUNT(*) FROM addresses;'
+                ).fetchone()
+            else:
+                self._count += len(entries)
+            if self._count > self.max_entries:
+                evict = (
+                    self._count - self.max_entries
+                    + int(self.max_entries * GEOCODE_CACHE_EVICT)
+                )
+                logger.info("Evicting %d addresses from cache", evict)
+                database.execute(
+                    '''
+                    DELETE FROM addresses WHERE address IN (
+                        SELECT address FROM addresses
+                        ORDER BY used
+                        LIMIT ?
+                    );
+                    ''',
+                    (evict,),
+                )
+                self._count -= evict
+
+
+class RedisGeocodeCache(GeocodeCache):
+    """Geocode cache stored in Redis.
+
+    Eviction is left to Redis, which should be configured with an LRU
+    ``maxmemory-policy``. Entries also expire after `ttl` seconds.
+    """
+    def __init__(self, client, prefix='geocode:', ttl=GEOCODE_CACHE_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        result = {}
+        for key, value in zip(keys, values):
+            if value is not None:
+                value = json.loads(value)
+                result[key] = None if value is None else tuple(value)
+        return result
+
+    def set_many(self, entries):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, location in entries.items():
+            pipeline.set(
+                self.prefix + key,
+                json.dumps(None if location is None else list(location)),
+                ex=self.ttl,
+            )
+        pipeline.execute()
+
+
+def open_geocode_cache(location, max_entries=GEOCODE_CACHE_SIZE):
+    """Open a geocode cache from a path or a ``redis://`` URL.
+    """
+    if location.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+
+        return RedisGeocodeCache(redis.Redis.from_url(location))
+    else:
+        return SqliteGeocodeCache(location, max_entries)
@@ -1,5 +1,4 @@
 import logging
-import math
 import numpy
 from sklearn.cluster import KMeans
 from sklearn.exceptions import ConvergenceWarning
@@ -17,29 +16,156 @@ MIN_RANGE_SIZE = 0.1  # 10%
 def mean_stddev(array):
     """Compute the mean (average) and standard deviation of a numerical array.
     """
-    total = 0
-    count = 0
-    for elem in array:
-        if elem is not None:
-            total += elem
-            count += 1
-    mean = total / count if count > 0 else 0
-
-    total = 0
-    for elem in array:
-        if elem is not None:
-            elem = elem - mean
-            total += elem * elem
-    stddev = math.sqrt(total / count) if count > 0 else 0
+    if not isinstance(array, numpy.ndarray):
+        array = numpy.array(
+            [elem for elem in array if elem is not None],
+            dtype=numpy.float64,
+        )
+    if not len(array):
+        return 0, 0
+
+    mean = float(numpy.mean(array))
+    stddev = float(numpy.sqrt(numpy.mean(numpy.square(array - mean))))
 
     return mean, stddev
 
 
-def get_numerical_ranges(values):
+def _segment_cost(sum1, sum2, weights, start, end):
+    """Sum of squared deviations of the values in ``[start, end)``.
+
+    The arguments are the cumulative sums of the values, their squares, and
+    their weights.
+    """
+    weight = weights[end] - weights[start]
+    total = sum1[end] - sum1[start]
+    return (sum2[end] - sum2[start]) - total * total / weight
+
+
+def ckmeans_clusters(values, n_clusters):
+    """Optimal clustering of sorted one-dimensional values.
+
+    This computes the exact k-means clustering using dynamic programming (as
+    in Ckmeans.1d.dp). The optimal position of the last cluster is monotonic,
+    so each step uses divide-and-conquer, processing a whole level of the
+    recursion at once with numpy; this is O(k*n*log(n)).
+
+    :param values: Sorted numpy array
+    :param n_clusters: Maximum number of clusters to make
+    :return: The indexes at which each cluster after the first starts
+    """
+    # Cluster distinct values, weighted by their counts
+    distinct, counts = numpy.unique(values, return_counts=True)
+    size = len(distinct)
+    n_clusters = min(n_clusters, size)
+    if n_clusters <= 1:
+        return numpy.array([], dtype=numpy.int64)
+
+    # Center the values for precision
+    centered = distinct - distinct[(size - 1) // 2]
+    sum1 = numpy.concatenate([[0.0], numpy.cumsum(centered * counts)])
+    sum2 = numpy.concatenate(
+        [[0.0], numpy.cumsum(centered * centered * counts)],
+    )
+    weights = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+    # cost[j] is the cost of the best clustering of the first j values into
+    # the current number of clusters
+    cost = numpy.full(size + 1, numpy.inf)
+    ends = numpy.arange(1, size + 1)
+    cost[1:] = _segment_cost(sum1, sum2, weights, 0, ends)
+    # best_starts[k][j] is where the last cluster starts in the best
+    # clustering of the first j values into k + 2 clusters
+    best_starts = []
+    for k in range(1, n_clusters):
+        new_cost = numpy.full(size + 1, numpy.inf)
+        best_start = numpy.zeros(size + 1, dtype=numpy.int64)
+
+        # Each task is: find the best start of the last cluster for
+        # j = (j_lo + j_hi) // 2, knowing it is in [i_lo, i_hi]
+        if k == n_clusters - 1:
+            # Last step, we only need the clustering of all the values
+            j_lo = numpy.array([size])
+        else:
+            j_lo = numpy.array([k + 1])
+        j_hi = numpy.array([size])
+        i_lo = numpy.array([k])
+        i_hi = numpy.array([size - 1])
+        while len(j_lo):
+            j_mid = (j_lo + j_hi) // 2
+            lengths = numpy.minimum(i_hi, j_mid - 1) - i_lo + 1
+            offsets = numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]])
+            task = numpy.repeat(numpy.arange(len(j_lo)), lengths)
+            starts = (
+                numpy.arange(len(task))
+                - numpy.repeat(offsets - i_lo, lengths)
+            )
+            costs = cost[starts] + _segment_cost(
+                sum1, sum2, weights, starts, numpy.repeat(j_mid, lengths),
+            )
+
+            # Find the first minimum for each task
+            minimum = numpy.minimum.reduceat(costs, offsets)
+            is_min = numpy.flatnonzero(
+                costs == numpy.repeat(minimum, lengths),
+            )
+            first = numpy.diff(task[is_min], prepend=-1) != 0
+            best = starts[is_min[first]]
+            new_cost[j_mid] = minimum
+            best_start[j_mid] = best
+
+            # Split the remaining intervals
+            j_lo, j_hi, i_lo, i_hi = (
+                numpy.concatenate([j_lo, j_mid + 1]),
+                numpy.concatenate([j_mid - 1, j_hi]),
+                numpy.concatenate([i_lo, best]),
+                numpy.concatenate([best, i_hi]),
+            )
+            keep = j_lo <= j_hi
+            j_lo, j_hi, i_lo, i_hi = (
+                j_lo[keep], j_hi[keep], i_lo[keep], i_hi[keep],
+            )
+
+        cost = new_cost
+        best_starts.append(best_start)
+
+    # Backtrack from the end to find the clusters
+    breaks = []
+    end = size
+    for best_start in reversed(best_starts):
+        end = best_start[end]
+        breaks.append(end)
+    breaks.reverse()
+    return weights[breaks]
+
+
+def kmeans_clusters(values, n_clusters):
+    """Cluster sorted one-dimensional values using scikit-learn's KMeans.
+
+    :param values: Sorted numpy array
+    :param n_clusters: Maximum number of clusters to make
+    :return: The indexes at which each cluster after the first starts
+    """
+    clustering = KMeans(n_clusters=min(n_clusters, len(values)),
+                        random_state=0)
+    with ignore_warnings(ConvergenceWarning):
+        clustering.fit(values.reshape(-1, 1))
+    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+
+    # In one dimension, clusters are intervals of the sorted values
+    return numpy.flatnonzero(numpy.diff(clustering.labels_) != 0) + 1
+
+
+def get_numerical_ranges(values, clustering=ckmeans_clusters):
     """
     Retrieve the numeral ranges given the input (timestamp, integer, or float).
 
-    This performs K-Means clustering, returning a maximum of 3 ranges.
+    This clusters the values, returning a maximum of 3 ranges.
+
+    :param values: The values to cluster
+    :param clustering: The clustering function to use, called with the sorted
+        array of values and the maximum number of clusters, returning the
+        indexes where each cluster after the first starts. Defaults to
+        `ckmeans_clusters()`, `kmeans_clusters()` is also available.
     """
 
     if not len(values):
@@ -47,38 +173,22 @@ def get_numerical_ranges(values):
 
     logger.info("Computing numerical ranges, %d values", len(values))
 
-    clustering = KMeans(n_clusters=min(N_RANGES, len(values)),
-                        random_state=0)
-    values_array = numpy.array(values).reshape(-1, 1)
-    with ignore_warnings(ConvergenceWarning):
-        clustering.fit(values_array)
-    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+    values = numpy.sort(numpy.asarray(values, dtype=numpy.float64))
+    breaks = clustering(values, N_RANGES)
 
     # Compute confidence intervals for each range
-    ranges = []
-    sizes = []
-    for rg in range(N_RANGES):
-        cluster = [values[i]
-                   for i in range(len(values))
-                   if clustering.labels_[i] == rg]
-        if not cluster:
-            continue
-
-        # Eliminate clusters of outliers
-        if len(cluster) < MIN_RANGE_SIZE * len(values):
-            continue
-
-        cluster.sort()
-        min_idx = int(0.05 * len(cluster))
-        max_idx = int(0.95 * len(cluster))
-        ranges.append([
-            cluster[min_idx],
-            cluster[max_idx],
-        ])
-        sizes.append(len(cluster))
-    ranges.sort()
+    starts = numpy.concatenate([[0], breaks]).astype(numpy.int64)
+    sizes = numpy.diff(numpy.concatenate([starts, [len(values)]]))
+
+    # Eliminate clusters of outliers
+    keep = sizes >= MIN_RANGE_SIZE * len(values)
+    starts, sizes = starts[keep], sizes[keep]
+
+    min_idx = starts + (0.05 * sizes).astype(numpy.int64)
+    max_idx = starts + (0.95 * sizes).astype(numpy.int64)
+    ranges = sorted(zip(values[min_idx].tolist(), values[max_idx].tolist()))
     logger.info("Ranges: %r", ranges)
-    logger.info("Sizes: %r", sizes)
+    logger.info("Sizes: %r", sizes.tolist())
 
     # Convert to Elasticsearch syntax
     ranges = [{'range': {'gte': float(rg[0]), 'lte': float(rg[1])}}
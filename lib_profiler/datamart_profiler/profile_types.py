@@ -1,16 +1,21 @@
 import collections
 from datetime import datetime
 import dateutil.tz
-import opentelemetry.trace
+import math
+import numpy
+import pandas
 import re
 import regex
+import statistics
 
 from . import types
-from .spatial import LATITUDE, LONGITUDE, disambiguate_admin_areas
-from .temporal import parse_date
+from .spatial import LATITUDE, LONGITUDE, disambiguate_admin_areas, \
+    resolve_admin_areas
+from .stats import get_tracer
+from .temporal import parse_dates
 
 
-tracer = opentelemetry.trace.get_tracer(__name__)
+tracer = get_tracer(__name__)
 
 
 _re_int = re.compile(
@@ -75,7 +80,6 @@ _re_latlong_point = re.compile(
     r'-?[0-9]{1,3}\.[0-9]{1,15}'
     r'\)$'
 )
-_re_whitespace = re.compile(r'\s+')
 
 
 # Tolerable ratio of unclean data
@@ -92,38 +96,192 @@ TEXT_WORDS_THRESHOLD = 0.5  # 50%
 MAX_CATEGORICAL_RATIO = 0.10  # 10%
 
 
+# Adaptive type detection looks at blocks of rows of increasing size, the
+# first one being this big, and doubling each time
+ADAPTIVE_FIRST_BLOCK = 1000
+ADAPTIVE_SEED = 89
+
+
+STRUCTURE_PATTERNS = [
+    ('int', _re_int),
+    ('float', _re_float),
+    ('url', _re_url),
+    ('file', _re_file),
+    ('point', _re_wkt_point),
+    ('geo_combined', _re_geo_combined),
+    ('other_point', _re_other_point),
+    ('latlong_point', _re_latlong_point),
+    ('polygon', _re_wkt_polygon),
+]
+"""Structures recognized by `classify_structures()`, in order of precedence"""
+
+# All the patterns as one, so each value is only matched once
+# _re_geo_combined needs the regex module, it is checked separately
+_re_structure = re.compile('|'.join(
+    '(?P<%s>%s)' % (key, pattern.pattern)
+    for key, pattern in STRUCTURE_PATTERNS
+    if key != 'geo_combined'
+))
+# Structures that come after 'geo_combined' in order of precedence
+_after_geo_combined = {
+    None, 'other_point', 'latlong_point', 'polygon',
+}
+
+# Text has at least TEXT_WORDS - 1 runs of whitespace (only starting a match
+# at the beginning of a run, so long runs don't make it backtrack)
+_re_text = re.compile(r'(?<!\s)\s+(?:\S+\s+){%d}' % (TEXT_WORDS - 2))
+
+BOOLEAN_VALUES = {'0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'}
+
+
+def classify_structures(array):
+    """Classify the structure of all the values of an array, column-wise.
+
+    This is equivalent to matching each value against the patterns in
+    `STRUCTURE_PATTERNS` in order, but is done with a single combined regex.
+
+    :return: A tuple ``(classes, is_bool)`` where `classes` is an object array
+        with the structure name of each value (``'empty'``, one of the
+        patterns, ``'text'``, or None), and `is_bool` is a boolean array
+        indicating which values could be booleans.
+    """
+    array = numpy.asarray(array, dtype=object)
+    classes = numpy.array(
+        [
+            m.lastgroup if m is not None else None
+            for m in map(_re_structure.match, array)
+        ],
+        dtype=object,
+    )
+    classes[array == ''] = 'empty'
+
+    # Values that need to be checked against _re_geo_combined, or are text
+    for i in numpy.flatnonzero(
+        [c in _after_geo_combined for c in classes]
+    ):
+        elem = array[i]
+        if elem[-1] == ')' and _re_geo_combined.match(elem):
+            classes[i] = 'geo_combined'
+        elif classes[i] is None and _re_text.search(elem):
+            classes[i] = 'text'
+
+    is_bool = numpy.array(
+        [len(e) <= 5 and e.lower() in BOOLEAN_VALUES for e in array],
+        dtype=bool,
+    )
+
+    return classes, is_bool
+
+
+def count_structures(classes, is_bool, counts=None):
+    """Count the classes returned by `classify_structures()`.
+
+    :param counts: Number of occurrences of each value, if the values have
+        been deduplicated.
+    """
+    if counts is None:
+        counts = numpy.ones(len(classes), dtype=numpy.int64)
+    re_count = collections.Counter()
+    known = classes != None  # noqa: E711
+    keys, inverse = numpy.unique(classes[known], return_inverse=True)
+    totals = numpy.bincount(inverse, weights=counts[known])
+    for key, total in zip(keys, totals):
+        re_count[key] = int(total)
+    num_bool = int(counts[is_bool].sum())
+    if num_bool:
+        re_count['bool'] = num_bool
+    return re_count
+
+
 def regular_exp_count(array):
     """Count instances matching the structure of each data type, using regexes.
     """
-    re_count = collections.Counter()
+    return count_structures(*classify_structures(array))
 
-    for elem in array:
-        if not elem:
-            re_count['empty'] += 1
-        elif _re_int.match(elem):
-            re_count['int'] += 1
-        elif _re_float.match(elem):
-            re_count['float'] += 1
-        elif _re_url.match(elem):
-            re_count['url'] += 1
-        elif _re_file.match(elem):
-            re_count['file'] += 1
-        elif _re_wkt_point.match(elem):
-            re_count['point'] += 1
-        elif _re_geo_combined.match(elem):
-            re_count['geo_combined'] += 1
-        elif _re_other_point.match(elem):
-            re_count['other_point'] += 1
-        elif _re_latlong_point.match(elem):
-            re_count['latlong_point'] += 1
-        elif _re_wkt_polygon.match(elem):
-            re_count['polygon'] += 1
-        elif len(_re_whitespace.findall(elem)) >= TEXT_WORDS - 1:
-            re_count['text'] += 1
-        if elem.lower() in ('0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'):
-            re_count['bool'] += 1
 
-    return re_count
+def parse_numbers(array, classes):
+    """Parse the values of an array as floats, NaN where it doesn't parse.
+
+    Values that were classified as ``'int'`` or ``'float'`` are converted at
+    once, only the other ones go through `float()` individually.
+    """
+    numbers = numpy.full(len(array), numpy.nan, dtype=numpy.float64)
+    array = numpy.asarray(array, dtype=object)
+    numerical = (classes == 'int') | (classes == 'float')
+    numbers[numerical] = array[numerical].astype(numpy.float64)
+    others, = numpy.nonzero(~numerical & (classes != 'empty'))
+    for i in others:
+        try:
+            numbers[i] = float(array[i])
+        except ValueError:
+            pass
+    return numbers
+
+
+def parse_years(array):
+    """Parse the values of an array as years.
+
+    :return: A list of UTC datetimes, with None for invalid values.
+    """
+    dates = []
+    for year in array:
+        try:
+            dates.append(datetime(
+                int(year), 1, 1,
+                tzinfo=dateutil.tz.UTC,
+            ))
+        except ValueError:
+            dates.append(None)
+    return dates
+
+
+def value_counts(array):
+    """Build the table of distinct values of an array.
+
+    :return: A tuple ``(values, counts, codes)`` where `values` are the
+        distinct values in order of first appearance, `counts` the number of
+        occurrences of each, and `codes` the index in `values` of each element
+        of `array`.
+    """
+    if isinstance(getattr(array, 'dtype', None), pandas.StringDtype):
+        # Factorize Arrow strings directly, without creating a Python object
+        # for each element
+        codes, values = pandas.factorize(array)
+    else:
+        codes, values = pandas.factorize(numpy.asarray(array, dtype=object))
+    counts = numpy.bincount(codes, minlength=len(values))
+    return numpy.asarray(values, dtype=object), counts, codes
+
+
+def expand_values(results, codes):
+    """Expand results computed on distinct values back to all the elements.
+
+    :param results: A list with one result per distinct value, None if that
+        value is invalid.
+    :param codes: The index of the distinct value for each element, as
+        returned by `value_counts()`.
+    :return: The list of results for the valid elements, in order.
+    """
+    valid = numpy.array([r is not None for r in results], dtype=bool)
+    results_array = numpy.empty(len(results), dtype=object)
+    results_array[:] = results
+    return results_array[codes[valid[codes]]].tolist()
+
+
+def store_dates(parsed, dates, codes):
+    """Keep dates parsed from the distinct values, for the later stages.
+
+    ``parsed['dates']`` is set to the list of distinct valid dates, and
+    ``parsed['timestamps']`` to the POSIX timestamps of the valid elements,
+    in the same order as ``expand_values(dates, codes)``.
+    """
+    timestamps = numpy.array(
+        [numpy.nan if dt is None else dt.timestamp() for dt in dates],
+        dtype=numpy.float64,
+    )
+    timestamps = timestamps[codes]
+    parsed['dates'] = [dt for dt in dates if dt is not None]
+    parsed['timestamps'] = timestamps[~numpy.isnan(timestamps)]
 
 
 def unclean_values_ratio(c_type, re_count, num_total):
@@ -150,18 +308,191 @@ def unclean_values_ratio(c_type, re_count, num_total):
     return ratio
 
 
-def parse_dates(array):
-    """Parse the valid dates in an array of strings.
+def _sample_blocks(codes):
+    """Split the elements of a column into blocks, in random order.
+
+    The first block has `ADAPTIVE_FIRST_BLOCK` elements, then each block is
+    twice as big as the previous one.
+
+    :return: An iterator over the `codes` of the elements in each block
     """
-    parsed_dates = []
-    for elem in array:
-        elem = parse_date(elem)
-        if elem is not None:
-            parsed_dates.append(elem)
-    return parsed_dates
+    order = numpy.random.RandomState(ADAPTIVE_SEED).permutation(len(codes))
+    start = 0
+    size = ADAPTIVE_FIRST_BLOCK
+    while start < len(codes):
+        yield codes[order[start:start + size]]
+        start += size
+        size *= 2
 
 
-def identify_types(array, name, geo_data, manual=None):
+def _sequential_z(num_total, confidence):
+    """Critical value for each look of a sequential test over `_sample_blocks()`.
+
+    The level of each look is corrected for the number of looks (Bonferroni),
+    so that the probability of any decision being wrong is at most
+    ``1 - confidence``.
+    """
+    looks = max(1, math.ceil(math.log2(num_total / ADAPTIVE_FIRST_BLOCK + 1)))
+    alpha = (1.0 - confidence) / looks
+    return statistics.NormalDist().inv_cdf(1.0 - alpha / 2)
+
+
+def _compare_ratio(matches, total, ratio, z):
+    """Compare the ratio of matches in a population to a threshold.
+
+    This uses the Wilson score interval of the ratio observed on a sample.
+
+    :return: 1 if the ratio is above `ratio` (or equal), -1 if it is below, 0
+        if the sample is not big enough to tell.
+    """
+    if total == 0:
+        return 0
+    p = matches / total
+    z2 = z * z
+    center = p + z2 / (2 * total)
+    margin = z * math.sqrt(p * (1.0 - p) / total + z2 / (4 * total * total))
+    low = (center - margin) / (1 + z2 / total)
+    high = (center + margin) / (1 + z2 / total)
+    if low >= ratio:
+        return 1
+    elif high < ratio:
+        return -1
+    else:
+        return 0
+
+
+# The tests deciding the structural type in identify_types(), in order: the
+# type is the first one for which one of the classes (or sum of classes) is
+# above the threshold
+_structural_checks = [
+    [('int',)],
+    [('int', 'float')],
+    [('point',), ('other_point',)],
+    [('latlong_point',), ('geo_combined',)],
+    [('polygon',)],
+]
+
+
+def _types_settled(re_count, num_sampled, z):
+    """Check whether the threshold tests of `identify_types()` are settled.
+
+    :param re_count: The structures counted on a sample of the column.
+    :param num_sampled: The number of elements in the sample.
+    """
+    num_values = num_sampled - re_count['empty']
+
+    def compare(keys, ratio=1.0 - MAX_UNCLEAN):
+        return _compare_ratio(
+            sum(re_count[key] for key in keys), num_values, ratio, z,
+        )
+
+    is_text = True
+    for checks in _structural_checks:
+        results = [compare(keys) for keys in checks]
+        if 1 in results:
+            is_text = False
+            break
+        elif 0 in results:
+            return False
+
+    semantic_checks = [compare(['bool'])]
+    if is_text:
+        semantic_checks.append(compare(['url']))
+        semantic_checks.append(compare(['file']))
+        semantic_checks.append(
+            compare(['text'], ratio=1.0 - TEXT_WORDS_THRESHOLD),
+        )
+    return 0 not in semantic_checks
+
+
+def classify_adaptive(values, counts, codes, confidence):
+    """Classify the structure of the elements of a column, stopping early.
+
+    The elements are looked at in blocks of increasing size, in random order,
+    until the decisions made from the structures by `identify_types()` are
+    settled with the given confidence.
+
+    :param values: The distinct values, from `value_counts()`.
+    :param counts: The number of occurrences of each value.
+    :param codes: The index of the distinct value for each element.
+    :param confidence: Probability for the decisions to be the same as if
+        all the elements were classified, for example 0.999.
+    :return: A tuple ``(classes, is_bool, re_count, num_sampled)`` like
+        `classify_structures()` and `count_structures()`. Values that were
+        not looked at have a class of None. If the sample is smaller than the
+        column (`num_sampled`), `re_count` is estimated from it, except for
+        ``'empty'`` which is always exact.
+    """
+    num_total = len(codes)
+    classes = numpy.full(len(values), None, dtype=object)
+    is_bool = numpy.zeros(len(values), dtype=bool)
+    classified = numpy.zeros(len(values), dtype=bool)
+    sample_counts = numpy.zeros(len(values), dtype=numpy.int64)
+    z = _sequential_z(num_total, confidence)
+    num_sampled = 0
+    # If the column is empty, there are no blocks
+    re_count = count_structures(classes, is_bool, sample_counts)
+    for block in _sample_blocks(codes):
+        new = numpy.unique(block[~classified[block]])
+        classes[new], is_bool[new] = classify_structures(values[new])
+        classified[new] = True
+        sample_counts += numpy.bincount(block, minlength=len(values))
+        num_sampled += len(block)
+        re_count = count_structures(classes, is_bool, sample_counts)
+        if (
+            num_sampled < num_total
+            and _types_settled(re_count, num_sampled, z)
+        ):
+            break
+    else:
+        return classes, is_bool, re_count, num_total
+
+    # Extrapolate the counts from the sample to the whole column
+    num_empty = int(counts[values == ''].sum())
+    scale = (num_total - num_empty) / (num_sampled - re_count['empty'])
+    estimate = collections.Counter()
+    for key, count in re_count.items():
+        if key != 'empty':
+            estimate[key] = int(round(count * scale))
+    if num_empty:
+        estimate['empty'] = num_empty
+    return classes, is_bool, estimate, num_sampled
+
+
+def parse_dates_adaptive(values, codes, confidence):
+    """Parse the distinct values as dates, unless a sample rules it out.
+
+    Like `classify_adaptive()`, the elements are looked at in blocks of
+    increasing size. If the ratio of dates is below the `MAX_UNCLEAN`
+    threshold with the given confidence, this stops early and returns None.
+    Otherwise all the values are parsed.
+
+    :return: The result of `parse_dates()` on `values`, or None.
+    """
+    dates = numpy.full(len(values), None, dtype=object)
+    done = numpy.zeros(len(values), dtype=bool)
+    empty = values == ''
+    z = _sequential_z(len(codes), confidence)
+    num_values = num_dates = 0
+    for block in _sample_blocks(codes):
+        new = numpy.unique(block[~done[block]])
+        dates[new] = parse_dates(values[new])
+        done[new] = True
+        num_values += int(numpy.count_nonzero(~empty[block]))
+        num_dates += int(numpy.count_nonzero(dates[block] != None))  # noqa: E711
+        decision = _compare_ratio(num_dates, num_values, 1.0 - MAX_UNCLEAN, z)
+        if decision < 0:
+            return None
+        elif decision > 0:
+            break
+    remaining = numpy.flatnonzero(~done)
+    if len(remaining):
+        dates[remaining] = parse_dates(values[remaining])
+    return dates.tolist()
+
+
+def identify_types(array, name, geo_data, manual=None, parsed=None,
+                   confidence=None):
     """Identify the structural type and semantic types of an array.
 
     :param array: The list, series, or array to inspect
@@ -169,18 +500,44 @@ def identify_types(array, name, geo_data, manual=None):
         heuristics like latitude, longitude, year number.
     :param manual: Manual information provided by the user that will be
         reconciled with the observed data.
+    :param parsed: Optional dict, which will be filled with values parsed
+        during type detection, so that later stages don't parse them again.
+        ``'value_counts'`` is set to the table of distinct values (see
+        `value_counts()`), ``'numbers'`` to a float array (NaN for values
+        that are not numbers) if the column is numerical, and ``'dates'`` and
+        ``'timestamps'`` if it contains dates (see `store_dates()`).
+    :param confidence: If set, the types are detected from a random sample
+        of the column, that grows until the decisions are the same as if the
+        whole column was looked at with this probability (for example 0.999).
+        The ratios of unclean and missing values are then estimated from
+        the sample, and its size is recorded as ``type_sample_size``. Ignored
+        if `manual` is provided.
     :return: A tuple ``(structural_type, semantic_types_dict, column_meta)``
         where `structural_type` is the detected structural type (e.g. storage
         format), `semantic_types_dict` is a dict mapping semantic types (e.g.
         meaning) to parsed values for further processing, and `column_meta`
         contains additional information about the column (not related to type).
     """
-    num_total = len(array)
     column_meta = {}
+    if parsed is None:
+        parsed = {}
+
+    # Work on the distinct values, weighted by their number of occurrences
+    with tracer.start_as_current_span('profile/value_counts'):
+        values, counts, codes = parsed['value_counts'] = value_counts(array)
+    num_total = len(codes)
 
     # This function let you check/count how many instances match a structure of particular data type
     with tracer.start_as_current_span('profile/regular_exp_count'):
-        re_count = regular_exp_count(array)
+        if confidence is None or manual:
+            classes, is_bool = classify_structures(values)
+            re_count = count_structures(classes, is_bool, counts)
+        else:
+            classes, is_bool, re_count, num_sampled = classify_adaptive(
+                values, counts, codes, confidence,
+            )
+            if num_sampled < num_total:
+                column_meta['type_sample_size'] = num_sampled
 
     # Identify structural type and compute unclean values ratio
     threshold = max(1, (1.0 - MAX_UNCLEAN) * (num_total - re_count['empty']))
@@ -211,7 +568,7 @@ def identify_types(array, name, geo_data, manual=None):
     if structural_type != types.MISSING_DATA and re_count['empty'] > 0:
         column_meta['missing_values_ratio'] = re_count['empty'] / num_total
 
-    distinct_values = set(e for e in array if e)
+    distinct_values = set(values[values != ''])
 
     semantic_types_dict = {}
     if manual:
@@ -223,12 +580,17 @@ def identify_types(array, name, geo_data, manual=None):
                 column_meta['unclean_values_ratio'] = \
                     unclean_values_ratio(types.BOOLEAN, re_count, num_total)
             if el == types.DATE_TIME:
-                dates = parse_dates(array)
-                semantic_types_dict[types.DATE_TIME] = dates
+                dates = parse_dates(values)
+                semantic_types_dict[types.DATE_TIME] = \
+                    expand_values(dates, codes)
+                store_dates(parsed, dates, codes)
             if el == types.ADMIN:
                 if geo_data is not None and len(distinct_values) >= 3:
-                    admin_areas = geo_data.resolve_names_all(array)
-                    admin_areas = [r for r in admin_areas if r]
+                    admin_areas = resolve_admin_areas(geo_data, values)
+                    admin_areas = expand_values(
+                        [r if r else None for r in admin_areas],
+                        codes,
+                    )
                     if admin_areas:
                         admin_areas = disambiguate_admin_areas(admin_areas)
                         if admin_areas is not None:
@@ -265,10 +627,14 @@ def identify_types(array, name, geo_data, manual=None):
             # Administrative areas
             if geo_data is not None and len(distinct_values) >= 3:
                 with tracer.start_as_current_span('profile/admin_areas'):
-                    admin_areas = geo_data.resolve_names_all(distinct_values)
-                    admin_areas = [r for r in admin_areas if r]
-                    if len(admin_areas) > 0.7 * len(distinct_values):
-
+                    # Need more than 70% of the names to be resolved, stops
+                    # early (returning None) once that becomes impossible
+                    admin_areas = resolve_admin_areas(
+                        geo_data, distinct_values,
+                        min_found=0.7 * len(distinct_values),
+                    )
+                    if admin_areas is not None:
+                        admin_areas = [r for r in admin_areas if r]
                         admin_areas = disambiguate_admin_areas(admin_areas)
                         if admin_areas is not None:
                             semantic_types_dict[types.ADMIN] = admin_areas
@@ -285,7 +651,7 @@ def identify_types(array, name, geo_data, manual=None):
             else:
                 # Count distinct values
                 column_meta['num_distinct_values'] = len(distinct_values)
-                max_categorical = MAX_CATEGORICAL_RATIO * (len(array) - num_empty)
+                max_categorical = MAX_CATEGORICAL_RATIO * (num_total - num_empty)
                 if (
                     categorical or
                     len(distinct_values) <= max_categorical or
@@ -310,33 +676,24 @@ def identify_types(array, name, geo_data, manual=None):
             # Identify years
             if name.strip().lower() == 'year':
                 with tracer.start_as_current_span('profile/parse_years'):
-                    dates = []
-                    for year in array:
-                        try:
-                            dates.append(datetime(
-                                int(year), 1, 1,
-                                tzinfo=dateutil.tz.UTC,
-                            ))
-                        except ValueError:
-                            pass
-                    if len(dates) >= threshold:
+                    dates = parse_years(values)
+                    expanded_dates = expand_values(dates, codes)
+                    if len(expanded_dates) >= threshold:
                         structural_type = types.TEXT
-                        semantic_types_dict[types.DATE_TIME] = dates
+                        semantic_types_dict[types.DATE_TIME] = expanded_dates
+                        store_dates(parsed, dates, codes)
 
         # Identify lat/long
         if structural_type == types.FLOAT:
             with tracer.start_as_current_span('profile/parse_latlong'):
-                num_lat = num_long = 0
-                for elem in array:
-                    try:
-                        elem = float(elem)
-                    except ValueError:
-                        pass
-                    else:
-                        if -180.0 <= float(elem) <= 180.0:
-                            num_long += 1
-                            if -90.0 <= float(elem) <= 90.0:
-                                num_lat += 1
+                numbers = parse_numbers(values, classes)
+                num_long = int(counts[
+                    (-180.0 <= numbers) & (numbers <= 180.0)
+                ].sum())
+                num_lat = int(counts[
+                    (-90.0 <= numbers) & (numbers <= 90.0)
+                ].sum())
+                parsed['numbers'] = numbers[codes]
 
                 if num_lat >= threshold and any(n in name.lower() for n in LATITUDE):
                     semantic_types_dict[types.LATITUDE] = None
@@ -345,15 +702,29 @@ def identify_types(array, name, geo_data, manual=None):
 
         # Identify dates
         with tracer.start_as_current_span('profile/parse_dates'):
-            parsed_dates = parse_dates(array)
+            if confidence is None:
+                dates = parse_dates(values)
+            else:
+                dates = parse_dates_adaptive(values, codes, confidence)
+            if dates is not None:
+                parsed_dates = expand_values(dates, codes)
+            else:
+                parsed_dates = []
 
         if len(parsed_dates) >= threshold:
             semantic_types_dict[types.DATE_TIME] = parsed_dates
+            store_dates(parsed, dates, codes)
             if structural_type == types.INTEGER:
                 # 'YYYYMMDD' format means values can be parsed as integers, but
                 # that's not what they are
                 structural_type = types.TEXT
 
+    if (
+        structural_type in (types.INTEGER, types.FLOAT)
+        and 'numbers' not in parsed
+    ):
+        parsed['numbers'] = parse_numbers(values, classes)[codes]
+
     return structural_type, semantic_types_dict, column_meta
 
 
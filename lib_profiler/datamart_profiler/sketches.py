@@ -0,0 +1,242 @@
+import io
+import logging
+import math
+import numpy
+import pandas
+from pandas.errors import ParserError
+
+
+logger = logging.getLogger(__name__)
+
+
+HLL_PRECISION = 14  # 2**14 registers, about 0.8% standard error
+EXACT_DISTINCT_LIMIT = 10000
+"""Distinct values are counted exactly up to this number, then estimated"""
+
+
+def _bit_length(array):
+    """Number of bits needed to represent each element of a uint64 array.
+    """
+    # Floats represent integers under 2**53 exactly, so split in two halves
+    high = (array >> numpy.uint64(32)).astype(numpy.float64)
+    low = (array & numpy.uint64(0xFFFFFFFF)).astype(numpy.float64)
+    return numpy.where(
+        high > 0,
+        32 + numpy.frexp(high)[1],
+        numpy.frexp(low)[1],
+    )
+
+
+class HyperLogLog(object):
+    """Estimate the number of distinct values, with bounded memory.
+    """
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = numpy.zeros(1 << precision, dtype=numpy.uint8)
+
+    def add(self, values):
+        """Add values (strings) to the set.
+        """
+        self.add_hashes(pandas.util.hash_array(
+            numpy.asarray(values, dtype=object),
+            categorize=False,
+        ))
+
+    def add_hashes(self, hashes):
+        """Add 64-bit hashes to the set.
+        """
+        shift = numpy.uint64(64 - self.precision)
+        indexes = (hashes >> shift).astype(numpy.intp)
+        rest = hashes & numpy.uint64((1 << (64 - self.precision)) - 1)
+        ranks = (64 - self.precision + 1 - _bit_length(rest))
+        numpy.maximum.at(self.registers, indexes, ranks.astype(numpy.uint8))
+
+    def merge(self, other):
+        """Add all the values from another set to this one.
+        """
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLogs of different precision")
+        numpy.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Estimate the number of distinct values that were added.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        estimate = alpha * m * m / numpy.sum(
+            numpy.ldexp(1.0, -self.registers.astype(numpy.int32)),
+        )
+        zeros = int(numpy.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class DistinctCounter(object):
+    """Count distinct values exactly, until there are too many to keep.
+
+    Past `EXACT_DISTINCT_LIMIT` values, switch to a `HyperLogLog`.
+    """
+    def __init__(self):
+        self.values = set()
+        self.hll = None
+
+    def add(self, values):
+        if self.hll is None:
+            self.values.update(values)
+            if len(self.values) > EXACT_DISTINCT_LIMIT:
+                self.hll = HyperLogLog()
+                self.hll.add(list(self.values))
+                self.values = None
+        else:
+            self.hll.add(values)
+
+    def merge(self, other):
+        if other.hll is None:
+            self.add(other.values)
+        else:
+            if self.hll is None:
+                self.hll = HyperLogLog()
+                self.hll.add(list(self.values))
+                self.values = None
+            self.hll.merge(other.hll)
+
+    def count(self):
+        if self.hll is None:
+            return len(self.values)
+        else:
+            return self.hll.count()
+
+
+class Moments(object):
+    """Running count, mean, and sum of squared deviations, mergeable.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values, weights):
+        """Add values, each occurring a number of times given by `weights`.
+        """
+        count = int(numpy.sum(weights))
+        if count == 0:
+            return
+        mean = float(numpy.sum(values * weights)) / count
+        m2 = float(numpy.sum(numpy.square(values - mean) * weights))
+        self._merge(count, mean, m2)
+
+    def merge(self, other):
+        if other.count:
+            self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, count, mean, m2):
+        # Chan et al.'s parallel algorithm
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    @property
+    def stddev(self):
+        if not self.count:
+            return 0.0
+        return math.sqrt(self.m2 / self.count)
+
+
+class ColumnSummary(object):
+    """Statistics about a column, accumulated over chunks of rows.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.empty = 0
+        self.distinct = DistinctCounter()
+        self.numbers = Moments()  # Set to None if the values are not numbers
+
+    def add(self, array):
+        codes, values = pandas.factorize(numpy.asarray(array, dtype=object))
+        counts = numpy.bincount(codes, minlength=len(values))
+        values = numpy.asarray(values, dtype=object)
+        self.rows += len(codes)
+
+        non_empty = values != ''
+        self.empty += int(numpy.sum(counts[~non_empty]))
+        values, counts = values[non_empty], counts[non_empty]
+        self.distinct.add(values)
+
+        # Same numbers as those used to compute ranges, see process_column()
+        if self.numbers is not None:
+            # Stop parsing numbers if this is obviously not a numerical column
+            numbers = pandas.to_numeric(values[:100], errors='coerce')
+            if numpy.count_nonzero(numpy.isnan(numbers)) > 50:
+                self.numbers = None
+                return
+            numbers = pandas.to_numeric(values, errors='coerce')
+            numbers = numpy.asarray(numbers, dtype=numpy.float64)
+            valid = (-3.4e38 < numbers) & (numbers < 3.4e38)
+            self.numbers.add(numbers[valid], counts[valid])
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.empty += other.empty
+        self.distinct.merge(other.distinct)
+        if self.numbers is not None and other.numbers is not None:
+            self.numbers.merge(other.numbers)
+        else:
+            self.numbers = None
+
+
+class TableSummary(object):
+    """Statistics about all the columns of a CSV file, read in chunks.
+
+    Summaries of different chunks can be computed separately (for example in
+    parallel) and merged.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.columns = None
+        self.failed = False
+
+    def add_csv(self, data):
+        """Add rows from CSV data, as bytes starting with the header row.
+        """
+        if self.failed:
+            return
+        try:
+            chunk = pandas.read_csv(
+                io.BytesIO(data),
+                dtype=str, na_filter=False,
+            )
+        except (ParserError, UnicodeDecodeError):
+            logger.warning(
+                "Error reading chunk, statistics will be computed from the "
+                + "sample only",
+                exc_info=True,
+            )
+            self.failed = True
+            return
+        if self.columns is None:
+            self.columns = [ColumnSummary() for _ in range(chunk.shape[1])]
+        elif chunk.shape[1] != len(self.columns):
+            logger.warning("Chunk has a different number of columns")
+            self.failed = True
+            return
+        self.rows += chunk.shape[0]
+        for i, summary in enumerate(self.columns):
+            summary.add(chunk.iloc[:, i])
+
+    def merge(self, other):
+        if other.failed:
+            self.failed = True
+        if self.failed or other.columns is None:
+            return
+        if self.columns is None:
+            self.columns = [ColumnSummary() for _ in other.columns]
+        elif len(other.columns) != len(self.columns):
+            self.failed = True
+            return
+        self.rows += other.rows
+        for summary, other_summary in zip(self.columns, other.columns):
+            summary.merge(other_summary)
@@ -1,5 +1,7 @@
 import collections
+import concurrent.futures
 from dataclasses import dataclass
+import functools
 import json
 import logging
 import math
@@ -8,13 +10,15 @@ import numpy.random
 import prometheus_client
 import re
 import requests
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.exceptions import ConvergenceWarning
 from sklearn.neighbors._kd_tree import KDTree
 import time
 import typing
+import unicodedata
 from urllib.parse import urlencode
 
+from .geocode_cache import normalize_address
 from .warning_tools import ignore_warnings
 
 
@@ -24,12 +28,15 @@ logger = logging.getLogger(__name__)
 N_RANGES = 3
 MIN_RANGE_SIZE = 0.10  # 10%
 
+MINIBATCH_SIZE = 200000  # Use MiniBatchKMeans over this many points
+
 SPATIAL_RANGE_DELTA_LONG = 0.0001
 SPATIAL_RANGE_DELTA_LAT = 0.0001
 
 MAX_ADDRESS_LENGTH = 90  # 90 characters
 MAX_NOMINATIM_REQUESTS = 200
 NOMINATIM_BATCH_SIZE = 20
+NOMINATIM_CONCURRENCY = 4  # Batches sent at the same time
 NOMINATIM_MIN_SPLIT_BATCH_SIZE = 2  # Batches >=this are divided on failure
 
 LATITUDE = ('latitude', 'lat', 'ycoord', 'y_coord')
@@ -37,6 +44,12 @@ LONGITUDE = ('longitude', 'long', 'lon', 'lng', 'xcoord', 'x_coord')
 
 MAX_WRONG_LEVEL_ADMIN = 0.10  # 10%
 
+ADMIN_NAMES_CACHE_SIZE = 200000
+"""Number of names for which the candidate admin areas are remembered"""
+
+ADMIN_PARENTS_CACHE_SIZE = 100000
+"""Number of admin areas for which the parent areas are remembered"""
+
 
 PROM_NOMINATIM_REQS = prometheus_client.Counter(
     'profile_nominatim_reqs', "Queries to Nominatim",
@@ -44,51 +57,54 @@ PROM_NOMINATIM_REQS = prometheus_client.Counter(
 PROM_NOMINATIM_REQ_TIME = prometheus_client.Histogram(
     'profile_nominatim_req_seconds', "Time for Nominatim to answer a query",
 )
+PROM_NOMINATIM_CACHE_HITS = prometheus_client.Counter(
+    'profile_nominatim_cache_hits', "Addresses found in the geocode cache",
+)
 
 
 def get_spatial_ranges(values):
     """Build a small number (3) of bounding boxes from lat/long points.
 
     This performs K-Means clustering, returning a maximum of 3 clusters as
-    bounding boxes.
+    bounding boxes. Over `MINIBATCH_SIZE` points, MiniBatchKMeans is used.
+
+    :param values: Array of ``(lat, long)`` pairs
     """
 
-    clustering = KMeans(n_clusters=min(N_RANGES, len(values)),
-                        random_state=0)
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, 2)
+    n_clusters = min(N_RANGES, len(values))
+    if len(values) > MINIBATCH_SIZE:
+        clustering = MiniBatchKMeans(n_clusters=n_clusters, random_state=0)
+    else:
+        clustering = KMeans(n_clusters=n_clusters, random_state=0)
     with ignore_warnings(ConvergenceWarning):
         clustering.fit(values)
     logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
 
     # Compute confidence intervals for each range
     ranges = []
-    sizes = []
+    sizes = numpy.bincount(clustering.labels_, minlength=N_RANGES)
     for rg in range(N_RANGES):
-        cluster = [values[i]
-                   for i in range(len(values))
-                   if clustering.labels_[i] == rg]
-        if not cluster:
+        size = sizes[rg]
+        if not size:
             continue
 
         # Eliminate clusters of outliers
-        if len(cluster) < MIN_RANGE_SIZE * len(values):
+        if size < MIN_RANGE_SIZE * len(values):
             continue
 
-        cluster.sort(key=lambda p: p[0])
-        min_idx = int(0.05 * len(cluster))
-        max_idx = int(0.95 * len(cluster))
-        min_lat = cluster[min_idx][0]
-        max_lat = cluster[max_idx][0]
-        cluster.sort(key=lambda p: p[1])
-        min_long = cluster[min_idx][1]
-        max_long = cluster[max_idx][1]
+        cluster = values[clustering.labels_ == rg]
+        min_idx = int(0.05 * size)
+        max_idx = int(0.95 * size)
+        lats = numpy.partition(cluster[:, 0], (min_idx, max_idx))
+        longs = numpy.partition(cluster[:, 1], (min_idx, max_idx))
         ranges.append([
-            [min_long, max_lat],
-            [max_long, min_lat],
+            [float(longs[min_idx]), float(lats[max_idx])],
+            [float(longs[max_idx]), float(lats[min_idx])],
         ])
-        sizes.append(len(cluster))
     ranges.sort()
     logger.info("Ranges: %r", ranges)
-    logger.info("Sizes: %r", sizes)
+    logger.info("Sizes: %r", sizes.tolist())
 
     # Lucene needs shapes to have an area for tessellation (no point or line)
     for rg in ranges:
@@ -177,20 +193,7 @@ _re_loc = re.compile(
     r'(-?[0-9]{1,3}\.[0-9]{1,15})'
     r'\)$'
 )
-
-
-def _parse_point(value, latlong):
-    m = _re_loc.search(value)
-    if m is not None:
-        try:
-            x = float(m.group(1))
-            y = float(m.group(2))
-        except ValueError:
-            return None
-        if latlong:
-            x, y = y, x
-        if -180.0 < x < 180.0 and -90.0 < y < 90.0:
-            return y, x
+_re_loc_lines = re.compile(_re_loc.pattern, re.MULTILINE)
 
 
 def parse_wkt_column(values, latlong=False):
@@ -198,14 +201,31 @@ def parse_wkt_column(values, latlong=False):
 
     :param latlong: If False (the default), read ``(long, lat)`` format. If
         True, read ``(lat, long)``.
-    :returns: A list of ``(lat, long)`` pairs
+    :returns: A numpy array of ``(lat, long)`` pairs
     """
-    # Parse points
-    values = values.apply(_parse_point, latlong=latlong)
-    # Drop NaN values
-    values = values.dropna(axis=0)
+    # Parse points, running the regex over all the values at once
+    text = '\n'.join(values)
+    if text.count('\n') == max(0, len(values) - 1):
+        coords = _re_loc_lines.findall(text)
+    else:
+        # Some values contain newlines, go one at a time
+        coords = [
+            m.groups()
+            for m in map(_re_loc.search, values)
+            if m is not None
+        ]
+    coords = numpy.array(coords, dtype=numpy.float64).reshape(-1, 2)
+    if latlong:
+        lats, longs = coords[:, 0], coords[:, 1]
+    else:
+        longs, lats = coords[:, 0], coords[:, 1]
+    # Drop points out of range
+    mask = (
+        (-180.0 < longs) & (longs < 180.0)
+        & (-90.0 < lats) & (lats < 90.0)
+    )
 
-    return list(values)
+    return numpy.stack([lats[mask], longs[mask]], axis=1)
 
 
 _nominatim_session = requests.Session()
@@ -253,83 +273,195 @@ def nominatim_query(url, *, q):
         return res.json()
 
 
-def _nominatim_batch(url, batch, locations, cache):
+def _nominatim_batch(url, batch):
+    """Resolve a batch of addresses, splitting it if the server refuses it.
+
+    :return: A list with the location of each address, or None
+    """
     try:
-        locs = nominatim_query(url, q=list(batch.keys()))
+        locs = nominatim_query(url, q=batch)
     except requests.HTTPError as e:
         if (
             e.response.status_code in (500, 414)
             and len(batch) >= max(2, NOMINATIM_MIN_SPLIT_BATCH_SIZE)
         ):
             # Try smaller batch size
-            batch_list = list(batch.items())
             mid = len(batch) // 2
             return (
-                _nominatim_batch(url, dict(batch_list[:mid]), locations, cache)
+                _nominatim_batch(url, batch[:mid])
                 +
-                _nominatim_batch(url, dict(batch_list[mid:]), locations, cache)
+                _nominatim_batch(url, batch[mid:])
             )
         raise e from None
 
-    not_found = 0
-    for location, (value, count) in zip(locs, batch.items()):
-        if location:
-            loc = (
-                float(location[0]['lat']),
-                float(location[0]['lon']),
-            )
-            cache[value] = loc
-            locations.extend([loc] * count)
-        else:
-            cache[value] = None
-            not_found += count
-    batch.clear()
-    return not_found
+    return [
+        (float(location[0]['lat']), float(location[0]['lon']))
+        if location else None
+        for location in locs
+    ]
 
 
-def nominatim_resolve_all(url, array, max_requests=MAX_NOMINATIM_REQUESTS):
-    cache = {}
-    locations = []
-    not_found = 0  # Unique locations not found
+def nominatim_resolve_all(
+    url, array, max_requests=MAX_NOMINATIM_REQUESTS,
+    *, cache=None, max_concurrent=NOMINATIM_CONCURRENCY,
+):
+    """Resolve addresses into coordinates using Nominatim.
+
+    Batches are sent from a pool of threads, with at most `max_concurrent`
+    of them in flight at a time. Addresses found in `cache` are not sent to
+    the server, and the server's answers are added to it.
+
+    :param max_requests: Number of addresses to send to the server, after
+        which the rest of the column is ignored
+    :param cache: A `GeocodeCache` shared across columns and datasets
+    :return: The list of locations and the number of non-empty values
+    """
+    counts = {}  # Occurrences of each address, in order of appearance
+    resolved = {}
+    pending = []  # Addresses not yet looked up in the cache
+    to_query = []  # Addresses not in the cache
+    in_flight = {}  # Future -> batch
+    queries = 0
+    cache_hits = 0
     non_empty = 0
     start = time.perf_counter()
     processed = 0
-    batch = {}
 
-    for processed, value in enumerate(array):
-        value = value.strip()
-        if not value:
-            continue
-        non_empty += 1
+    def lookup():
+        nonlocal cache_hits
 
-        if len(value) > MAX_ADDRESS_LENGTH:
-            continue
-        elif value in cache:
-            if cache[value] is not None:
-                locations.append(cache[value])
-        elif value in batch:
-            batch[value] += 1
+        if cache is None:
+            to_query.extend(pending)
         else:
-            batch[value] = 1
-            if len(batch) == NOMINATIM_BATCH_SIZE:
-                not_found += _nominatim_batch(url, batch, locations, cache)
-                if len(cache) >= max_requests:
-                    break
+            keys = [normalize_address(value) for value in pending]
+            hits = cache.get_many(keys)
+            for value, key in zip(pending, keys):
+                if key in hits:
+                    resolved[value] = hits[key]
+                else:
+                    to_query.append(value)
+            cache_hits += len(hits)
+            PROM_NOMINATIM_CACHE_HITS.inc(len(hits))
+        pending.clear()
+
+    def collect(return_when):
+        done, _ = concurrent.futures.wait(in_flight, return_when=return_when)
+        for future in done:
+            batch = in_flight.pop(future)
+            locs = future.result()
+            resolved.update(zip(batch, locs))
+            if cache is not None:
+                cache.set_many({
+                    normalize_address(value): loc
+                    for value, loc in zip(batch, locs)
+                })
+
+    def submit(executor):
+        nonlocal queries
+
+        # Wait for a slot
+        if len(in_flight) >= max_concurrent:
+            collect(concurrent.futures.FIRST_COMPLETED)
+        batch = to_query[:NOMINATIM_BATCH_SIZE]
+        del to_query[:NOMINATIM_BATCH_SIZE]
+        in_flight[executor.submit(_nominatim_batch, url, batch)] = batch
+        queries += len(batch)
+
+    with concurrent.futures.ThreadPoolExecutor(max_concurrent) as executor:
+        try:
+            for processed, value in enumerate(array):
+                value = value.strip()
+                if not value:
+                    continue
+                non_empty += 1
+
+                if len(value) > MAX_ADDRESS_LENGTH:
+                    continue
+                elif value in counts:
+                    counts[value] += 1
+                else:
+                    counts[value] = 1
+                    pending.append(value)
+                    if len(pending) == NOMINATIM_BATCH_SIZE:
+                        lookup()
+                        if len(to_query) >= NOMINATIM_BATCH_SIZE:
+                            submit(executor)
+                            if queries >= max_requests:
+                                break
+
+            lookup()
+            while to_query and queries < max_requests:
+                submit(executor)
+            collect(concurrent.futures.ALL_COMPLETED)
+        finally:
+            for future in in_flight:
+                future.cancel()
 
-    if batch and len(cache) < max_requests:
-        not_found += _nominatim_batch(url, batch, locations, cache)
+    locations = []
+    not_found = 0  # Unique locations not found
+    for value, count in counts.items():
+        loc = resolved.get(value)
+        if loc is not None:
+            locations.extend([loc] * count)
+        elif value in resolved:
+            not_found += 1
 
     logger.info(
-        "Performed %d Nominatim queries in %fs (%d hits). Found %d/%d",
-        len(cache),
+        "Performed %d Nominatim queries in %fs (%d hits, %d from cache). "
+        + "Found %d/%d",
+        queries,
         time.perf_counter() - start,
-        len(cache) - not_found,
+        len(resolved) - not_found,
+        cache_hits,
         len(locations),
         processed,
     )
     return locations, non_empty
 
 
+@functools.lru_cache(maxsize=ADMIN_NAMES_CACHE_SIZE)
+def _resolve_admin_name(geo_data, name):
+    return tuple(geo_data.resolve_name_all(name))
+
+
+def resolve_admin_areas(geo_data, names, min_found=None):
+    """Resolve names into the admin areas they could refer to.
+
+    This memoizes the results of ``GeoData.resolve_name_all()``, so names that
+    are common across columns and datasets don't hit the database again.
+
+    :param geo_data: The datamart_geo.GeoData instance
+    :param names: A sized iterable of names
+    :param min_found: If set, give up and return None as soon as it becomes
+        impossible for more than this number of names to be resolved
+    :return: A list with a (possibly empty) tuple of areas for each name
+    """
+    max_missing = None
+    if min_found is not None:
+        max_missing = len(names) - min_found
+    result = []
+    missing = 0
+    for name in names:
+        name = unicodedata.normalize('NFC', name.lower())
+        areas = _resolve_admin_name(geo_data, name)
+        if not areas:
+            missing += 1
+            if max_missing is not None and missing >= max_missing:
+                return None
+        result.append(areas)
+    return result
+
+
+@functools.lru_cache(maxsize=ADMIN_PARENTS_CACHE_SIZE)
+def get_admin_ancestors(area):
+    """Get the chain of parents of an admin area, closest first.
+    """
+    parent = area.get_parent_area()
+    if parent is None:
+        return ()
+    return (parent,) + get_admin_ancestors(parent)
+
+
 def disambiguate_admin_areas(admin_areas):
     """This takes admin areas resolved from names and tries to disambiguate.
 
@@ -349,10 +481,8 @@ def disambiguate_admin_areas(admin_areas):
         options_for_entry = set()
         for area in candidates:
             level = area.type.value
-            area = area.get_parent_area()
-            while area:
-                options_for_entry.add((level, area))
-                area = area.get_parent_area()
+            for parent in get_admin_ancestors(area):
+                options_for_entry.add((level, parent))
             options_for_entry.add((level, None))
         options.update(options_for_entry)
 
@@ -475,6 +605,68 @@ def hash_location(point, base=32, precision=16):
     return bits_to_chars(bits, base_bits)
 
 
+def _quantize(values, low, high, nbits):
+    """Find the cell containing each value, in a grid of ``2 ** nbits``.
+
+    This gives the same result as the bisection in `location_to_bits()`
+    (cells include their upper bound).
+    """
+    size = 1 << nbits
+    width = high - low
+
+    def bound(cell):
+        # Exact, since the cells are a power of 2
+        return low + width * cell / size
+
+    cells = numpy.ceil((values - low) * (size / width)) - 1
+    cells = numpy.clip(numpy.nan_to_num(cells, nan=0.0), 0, size - 1)
+    cells = cells.astype(numpy.uint64)
+    # Fix rounding errors near the cell boundaries
+    lower = (values <= bound(cells.astype(numpy.float64))) & (cells > 0)
+    cells[lower] -= numpy.uint64(1)
+    higher = (
+        (values > bound(cells.astype(numpy.float64) + 1))
+        & (cells < size - 1)
+    )
+    cells[higher] += numpy.uint64(1)
+    return cells
+
+
+def location_codes(points, base=32, precision=16):
+    """Hash an array of coordinates into integers, as Morton codes.
+
+    The bits are the same as the ones given by `location_to_bits()`, the
+    longitude and latitude bits interleaved, so this is a vectorized version
+    of `hash_location()` giving integers instead of strings.
+
+    :param points: Array of ``(latitude, longitude)`` pairs
+    :return: Array of unsigned 64-bit integers
+    """
+    base_bits = base.bit_length() - 1
+    if 2 ** base_bits != base:
+        raise ValueError("Base is not a power of 2")
+    precision_bits = base_bits * precision
+    if precision_bits > 64:
+        raise ValueError("Codes would be over 64 bits")
+    long_bits = (precision_bits + 1) // 2
+    lat_bits = precision_bits // 2
+
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    longitudes = _quantize(points[:, 1], -180.0, 180.0, long_bits)
+    latitudes = _quantize(points[:, 0], -90.0, 90.0, lat_bits)
+
+    # Interleave the bits, starting with longitude
+    codes = numpy.zeros(len(points), dtype=numpy.uint64)
+    one = numpy.uint64(1)
+    for i in range(long_bits):
+        bit = (longitudes >> numpy.uint64(long_bits - 1 - i)) & one
+        codes |= bit << numpy.uint64(precision_bits - 1 - 2 * i)
+    for i in range(lat_bits):
+        bit = (latitudes >> numpy.uint64(lat_bits - 1 - i)) & one
+        codes |= bit << numpy.uint64(precision_bits - 2 - 2 * i)
+    return codes
+
+
 def decode_hash(hash, base=32):
     """Turn a hash back into a rectangle.
 
@@ -531,25 +723,99 @@ class Geohasher(object):
         self.number_at_level = [0] * (precision)
 
     def add_points(self, points):
-        for point in points:
-            geohash = hash_location(point, self.base, self.precision)
-            # Add this hash to the tree
-            node = self.tree_root
-            for level, key in enumerate(geohash):
-                node[0] += 1
+        base_bits = self.base.bit_length() - 1
+        if base_bits * self.precision > 64:
+            for point in points:
+                self._add_point(point)
+            return
+
+        codes = location_codes(points, self.base, self.precision)
+        if not len(codes):
+            return
+
+        # Sort the codes once, the prefixes at each level are then sorted too
+        order = numpy.argsort(codes, kind='stable')
+        codes = codes[order]
+
+        # Get the existing nodes at each level, by code
+        existing = [{0: self.tree_root}]
+
+        def add_existing(code, node, level):
+            if len(existing) <= level:
+                existing.append({})
+            existing[level][code] = node
+            for key, child in node[1].items():
+                add_existing(
+                    (code << base_bits) | GEOHASH_CHAR_VALUES[key],
+                    child,
+                    level + 1,
+                )
+
+        add_existing(0, self.tree_root, 0)
+
+        # Find the prefixes at each level, and stop at the level where there
+        # are too many distinct ones
+        levels = []
+        for level in range(1, self.precision + 1):
+            shift = numpy.uint64(base_bits * (self.precision - level))
+            prefixes = codes >> shift
+            starts = numpy.flatnonzero(
+                numpy.concatenate([[True], prefixes[1:] != prefixes[:-1]])
+            )
+            if level < len(existing):
+                nodes = existing[level]
+                new = sum(
+                    1 for code in prefixes[starts].tolist()
+                    if code not in nodes
+                )
+            else:
+                new = len(starts)
+            total = self.number_at_level[level - 1] + new
+            if total > self.number:
+                self.number_at_level[level - 1] = total
+                self.precision = level - 1
+                break
+            levels.append((prefixes, starts))
+
+        # Add the prefixes to the tree, in the order they first appear
+        self.tree_root[0] += len(codes)
+        for level, (prefixes, starts) in enumerate(levels, 1):
+            if len(existing) <= level:
+                existing.append({})
+            nodes = existing[level]
+            parents = existing[level - 1]
+            first = numpy.minimum.reduceat(order, starts)
+            counts = numpy.diff(numpy.append(starts, len(codes)))
+            for idx in numpy.argsort(first, kind='stable').tolist():
+                code = int(prefixes[starts[idx]])
                 try:
-                    node = node[1][key]
+                    node = nodes[code]
                 except KeyError:
-                    new_node = [0, {}]
-                    node[1][key] = new_node
-                    node = new_node
-                    self.number_at_level[level] += 1
-
-                    # If this level has too many nodes, stop building it
-                    if self.number_at_level[level] > self.number:
-                        self.precision = level
-                        break
+                    node = nodes[code] = [0, {}]
+                    key = GEOHASH_CHARS[code & (self.base - 1)]
+                    parents[code >> base_bits][1][key] = node
+                    self.number_at_level[level - 1] += 1
+                node[0] += int(counts[idx])
+
+    def _add_point(self, point):
+        geohash = hash_location(point, self.base, self.precision)
+        # Add this hash to the tree
+        node = self.tree_root
+        for level, key in enumerate(geohash):
             node[0] += 1
+            try:
+                node = node[1][key]
+            except KeyError:
+                new_node = [0, {}]
+                node[1][key] = new_node
+                node = new_node
+                self.number_at_level[level] += 1
+
+                # If this level has too many nodes, stop building it
+                if self.number_at_level[level] > self.number:
+                    self.precision = level
+                    break
+        node[0] += 1
 
     def add_aab(self, box):
         base_bits = self.base.bit_length() - 1
@@ -0,0 +1,182 @@
+import contextlib
+import contextvars
+import opentelemetry.trace
+import time
+import tracemalloc
+
+
+_current_stats = contextvars.ContextVar('profiling_stats', default=None)
+
+
+def get_current_stats():
+    """Get the `ProfilingStats` collecting in this context, or None.
+    """
+    return _current_stats.get()
+
+
+class ProfilingStats(object):
+    """Time and memory used by each stage of the profiler, and each column.
+
+    The stages are the OpenTelemetry spans opened through an
+    `InstrumentedTracer`, and are recorded while `collect()` is active.
+
+    The wall-clock time and CPU time are always recorded. The peak memory
+    allocated by a stage (over what was allocated when it started) is only
+    recorded if `tracemalloc` is tracing, since that makes everything much
+    slower. Peak memory is not reliable if multiple threads are profiling
+    at the same time.
+    """
+    def __init__(self):
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = None
+        self.stages = {}
+        self.columns = {}
+        self._column = None  # The column being profiled
+        self._memory_stack = []  # [start, children's peak] for each stage
+
+    @contextlib.contextmanager
+    def collect(self):
+        """Record the stages opened in this context, and the total time.
+        """
+        token = _current_stats.set(self)
+        try:
+            with self._measure() as result:
+                yield self
+        finally:
+            _current_stats.reset(token)
+        self.wall_time, self.cpu_time, self.peak_memory = result
+
+    @contextlib.contextmanager
+    def _measure(self):
+        # Yields a list that is filled with wall time, CPU time, peak memory
+        result = []
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # Resetting the peak loses it for the enclosing stage, so keep it
+            if self._memory_stack:
+                outer = self._memory_stack[-1]
+                outer[1] = max(outer[1], peak)
+            tracemalloc.reset_peak()
+            self._memory_stack.append([current, 0])
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield result
+        finally:
+            result.append(time.perf_counter() - start_wall)
+            result.append(time.process_time() - start_cpu)
+            if tracing:
+                start, children_peak = self._memory_stack.pop()
+                peak = children_peak
+                if tracemalloc.is_tracing():
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self._memory_stack:
+                    outer = self._memory_stack[-1]
+                    outer[1] = max(outer[1], peak)
+                result.append(max(0, peak - start))
+            else:
+                result.append(None)
+
+    @contextlib.contextmanager
+    def stage(self, name, attributes=None):
+        """Record a stage.
+
+        The ``'profile/column'`` stage starts a column, identified by the
+        ``idx`` and ``name`` attributes. The stages inside it are recorded
+        for that column as well as globally.
+        """
+        previous_column = self._column
+        if name == 'profile/column' and attributes and 'idx' in attributes:
+            self._column = self._get_column(
+                attributes['idx'], attributes.get('name'),
+            )
+            column = self._column
+        else:
+            column = None
+        try:
+            with self._measure() as result:
+                yield
+        finally:
+            self._column = previous_column
+        times = dict(zip(('wall_time', 'cpu_time', 'peak_memory'), result))
+        times['calls'] = 1
+        _add_times(self.stages.setdefault(name, {}), times)
+        if column is not None:
+            _add_times(column, times)
+        elif self._column is not None:
+            _add_times(self._column['stages'].setdefault(name, {}), times)
+
+    def _get_column(self, idx, name):
+        try:
+            return self.columns[idx]
+        except KeyError:
+            column = self.columns[idx] = {'name': name, 'stages': {}}
+            return column
+
+    def add_column(self, idx, column):
+        """Add the stats of a column collected elsewhere (another process).
+        """
+        self.columns[idx] = column
+        _add_times(self.stages.setdefault('profile/column', {}), column)
+        for name, times in column['stages'].items():
+            _add_times(self.stages.setdefault(name, {}), times)
+
+    def to_json(self):
+        result = {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'stages': self.stages,
+            'columns': [
+                self.columns[idx] for idx in sorted(self.columns)
+            ],
+        }
+        if self.peak_memory is not None:
+            result['peak_memory'] = self.peak_memory
+        return result
+
+
+def _add_times(entry, times):
+    entry['calls'] = entry.get('calls', 0) + times['calls']
+    entry['wall_time'] = entry.get('wall_time', 0.0) + times['wall_time']
+    entry['cpu_time'] = entry.get('cpu_time', 0.0) + times['cpu_time']
+    if times.get('peak_memory') is not None:
+        entry['peak_memory'] = max(
+            entry.get('peak_memory', 0),
+            times['peak_memory'],
+        )
+
+
+@contextlib.contextmanager
+def collect_stats(stats):
+    """Run `stats.collect()`, or nothing if `stats` is None.
+    """
+    if stats is None:
+        yield
+    else:
+        with stats.collect():
+            yield
+
+
+class InstrumentedTracer(object):
+    """Wraps an OpenTelemetry tracer to also record `ProfilingStats`.
+    """
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, **kwargs):
+        with self._tracer.start_as_current_span(name, **kwargs) as span:
+            stats = _current_stats.get()
+            if stats is None:
+                yield span
+            else:
+                with stats.stage(name, kwargs.get('attributes')):
+                    yield span
+
+
+def get_tracer(name):
+    """Get an OpenTelemetry tracer that also records `ProfilingStats`.
+    """
+    return InstrumentedTracer(opentelemetry.trace.get_tracer(name))
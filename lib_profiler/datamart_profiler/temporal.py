@@ -1,9 +1,11 @@
-import collections
 from datetime import datetime
 import dateutil.parser
 import dateutil.tz
+import functools
 import logging
+import numpy
 import pandas
+import re
 
 from .warning_tools import raise_warnings
 
@@ -33,37 +35,92 @@ temporal_aggregation_keys = {
 }
 
 
+_US_SECOND = 1000000
+_US_MINUTE = 60 * _US_SECOND
+_US_HOUR = 60 * _US_MINUTE
+_US_DAY = 24 * _US_HOUR
+
+
+def _wall_clock_times(values):
+    """Get wall-clock times from a pandas datetime index, in microseconds.
+
+    Values are deduplicated by the instant they represent (as a set would),
+    then their local time is used, since that is what the bins in
+    `temporal_aggregation_keys` use.
+    """
+    values = pandas.DatetimeIndex(values)
+    _, distinct = numpy.unique(values.asi8, return_index=True)
+    if values.tz is not None:
+        values = values.tz_localize(None)
+    return values.asi8[distinct] // 1000
+
+
+def _temporal_bins(times, resolution):
+    """Map wall-clock times (in microseconds) to their bin at a resolution.
+    """
+    if resolution in ('year', 'quarter', 'month'):
+        months = times.view('datetime64[us]').astype('datetime64[M]')
+        months = months.view(numpy.int64)
+        if resolution == 'year':
+            return months // 12
+        elif resolution == 'quarter':
+            return months // 3
+        else:
+            return months
+    elif resolution == 'week':
+        days = times // _US_DAY
+        # Map each day to the first day of its week (1970-01-01 is Thursday)
+        return days - (days + 3) % 7
+    elif resolution == 'day':
+        return times // _US_DAY
+    elif resolution == 'hour':
+        return times // _US_HOUR
+    elif resolution == 'minute':
+        return times // _US_MINUTE
+    elif resolution == 'second':
+        return times // _US_SECOND
+    else:
+        raise ValueError("Unknown resolution %r" % resolution)
+
+
 def get_temporal_resolution(values):
     """Returns the resolution of the temporal attribute.
     """
 
-    if not isinstance(values, set):
-        values = set(values)
+    if (
+        isinstance(values, (pandas.Index, pandas.Series))
+        and pandas.api.types.is_datetime64_any_dtype(values.dtype)
+    ):
+        times = _wall_clock_times(values)
+        timezones = 1
+    else:
+        if not isinstance(values, set):
+            values = set(values)
+        times = numpy.array(
+            [value.replace(tzinfo=None) for value in values],
+            dtype='datetime64[us]',
+        ).view(numpy.int64)
+        timezones = len({id(value.tzinfo) for value in values})
 
-    if len(values) == 1:
-        value, = values
-        if value.second:
+    if len(times) == 1:
+        time = int(times[0])
+        if time % _US_MINUTE // _US_SECOND:
             return 'second'
-        elif value.minute:
+        elif time % _US_HOUR // _US_MINUTE:
             return 'minute'
-        elif value.hour:
+        elif time % _US_DAY // _US_HOUR:
             return 'hour'
         else:
             return 'day'
 
     # Python 3.7+ iterates on dict in insertion order
     for resolution, key in temporal_aggregation_keys.items():
-        counts = collections.defaultdict(collections.Counter)
-        if isinstance(key, str):
-            for value in values:
-                bin = value.strftime(key)
-                counts[bin][value] += 1
+        if resolution == 'quarter' and timezones > 1:
+            # Quarters are compared as instants, so they depend on timezones
+            nb_bins = len({key(value) for value in values})
         else:
-            for value in values:
-                bin = key(value)
-                counts[bin][value] += 1
-
-        avg_per_bin = sum(len(v) for v in counts.values()) / len(counts)
+            nb_bins = len(numpy.unique(_temporal_bins(times, resolution)))
+        avg_per_bin = len(times) / nb_bins
         if avg_per_bin < 1.05:
             # 5 % error tolerated
             return resolution
@@ -74,6 +131,11 @@ def get_temporal_resolution(values):
 _defaults = datetime(1985, 1, 1), datetime(2005, 6, 1)
 
 
+PARSE_DATE_CACHE_SIZE = 100000
+"""Number of strings for which the result of `parse_date()` is remembered"""
+
+
+@functools.lru_cache(maxsize=PARSE_DATE_CACHE_SIZE)
 def parse_date(string):
     """Parse a full date from a string.
 
@@ -100,3 +162,133 @@ def parse_date(string):
     if dt1.tzinfo is None:
         dt1 = dt1.replace(tzinfo=dateutil.tz.UTC)
     return dt1
+
+
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%fZ',
+    '%Y-%m',
+    '%Y/%m/%d',
+    '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+]
+"""Formats that `parse_dates()` tries to recognize to parse a whole column"""
+
+FORMAT_SAMPLE_SIZE = 20
+"""Number of values used to infer the format of a column"""
+
+_format_field_patterns = {
+    'Y': '[0-9]{4}',
+    'm': '[0-9]{2}',
+    'd': '[0-9]{2}',
+    'H': '[0-9]{2}',
+    'M': '[0-9]{2}',
+    'S': '[0-9]{2}',
+    'f': '[0-9]{6}',
+}
+
+
+def _format_to_regex(date_format):
+    """Build a regex only matching strings exactly in that format.
+
+    Strings that have fields without zero-padding are not matched; the
+    strptime parser would accept those, but it is not worth risking
+    differences with dateutil.
+    """
+    pattern = []
+    for i, part in enumerate(date_format.split('%')):
+        if i > 0:
+            pattern.append(_format_field_patterns[part[0]])
+            part = part[1:]
+        pattern.append(re.escape(part))
+    return re.compile('^' + ''.join(pattern) + '$')
+
+
+_format_regexes = {fmt: _format_to_regex(fmt) for fmt in DATE_FORMATS}
+
+_re_digit = re.compile(r'[0-9]')
+
+
+def infer_date_format(values):
+    """Find a format in `DATE_FORMATS` that parses a sample of the values.
+
+    The format is only returned if it parses at least half of the sample, to
+    the exact same datetimes as `parse_date()`.
+    """
+    best_format, best_count = None, 0
+    for date_format in DATE_FORMATS:
+        regex = _format_regexes[date_format]
+        count = 0
+        for value in values:
+            if not regex.match(value):
+                continue
+            try:
+                dt = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            if dt.replace(tzinfo=dateutil.tz.UTC) != parse_date(value):
+                # Disagrees with dateutil, don't use this format at all
+                count = 0
+                break
+            count += 1
+        if count > best_count:
+            best_format, best_count = date_format, count
+    if best_count * 2 >= len(values):
+        return best_format
+    return None
+
+
+def parse_dates(array):
+    """Parse an array of strings into dates.
+
+    This infers a format from a sample of the values, to convert most of them
+    at once using pandas. Values that don't match are parsed one at a time
+    using `parse_date()` (whose results are cached).
+
+    :return: A list with a datetime for each value in the array, or None if
+        the value is not a valid date.
+    """
+    array = numpy.asarray(array, dtype=object)
+    results = numpy.full(len(array), None, dtype=object)
+
+    # A date needs a year: values without any digit can't be dates
+    todo = numpy.array(
+        [_re_digit.search(value) is not None for value in array],
+        dtype=bool,
+    )
+
+    if numpy.count_nonzero(todo) >= FORMAT_SAMPLE_SIZE:
+        sample = array[todo][:FORMAT_SAMPLE_SIZE]
+        date_format = infer_date_format(sample)
+        if date_format is not None:
+            logger.info("Parsing dates using format %r", date_format)
+            matches = todo.copy()
+            matches[todo] = pandas.Series(
+                array[todo], dtype=object,
+            ).str.match(_format_regexes[date_format]).values
+            parsed = pandas.to_datetime(
+                array[matches],
+                format=date_format,
+                errors='coerce',
+            )
+            valid = ~parsed.isna()
+            idx = numpy.flatnonzero(matches)[valid]
+            results[idx] = [
+                dt.replace(tzinfo=dateutil.tz.UTC)
+                for dt in parsed[valid].to_pydatetime()
+            ]
+            todo[idx] = False
+
+    for i in numpy.flatnonzero(todo):
+        results[i] = parse_date(array[i])
+
+    return results.tolist()
@@ -4,6 +4,7 @@ import contextlib
 from datetime import datetime
 import defusedxml
 import elasticsearch
+import hashlib
 import io
 import itertools
 import lazo_index_service
@@ -25,7 +26,7 @@ from datamart_fslock.cache import cache_get_or_set
 from datamart_geo import GeoData
 from datamart_materialize import DatasetTooBig
 from datamart_materialize.detect import detect_format_convert_to_csv
-from datamart_profiler import process_dataset
+from datamart_profiler import open_geocode_cache, process_dataset
 
 
 logger = logging.getLogger(__name__)
@@ -35,6 +36,19 @@ tracer = opentelemetry.trace.get_tracer(__name__)
 MAX_CONCURRENT_PROFILE = 1
 MAX_CONCURRENT_DOWNLOAD = 2
 
+HASH_CHUNK_SIZE = 1 << 20
+
+
+# Keys of the metadata computed by process_dataset(), that can be copied from
+# the previous profile if the data hasn't changed
+PROFILE_KEYS = [
+    'size', 'nb_rows', 'nb_profiled_rows', 'nb_columns', 'average_row_size',
+    'columns', 'types',
+    'nb_spatial_columns', 'nb_temporal_columns', 'nb_categorical_columns',
+    'nb_numerical_columns',
+    'spatial_coverage', 'temporal_coverage', 'attribute_keywords', 'sample',
+]
+
 
 PROM_DOWNLOADING = prometheus_client.Gauge(
     'profile_downloading_count', "Number of datasets currently downloading",
@@ -42,6 +56,18 @@ PROM_DOWNLOADING = prometheus_client.Gauge(
 PROM_PROFILING = prometheus_client.Gauge(
     'profile_profiling_count', "Number of datasets currently profiling",
 )
+PROM_REUSED = prometheus_client.Counter(
+    'profile_reused_count',
+    "Number of datasets not profiled again because they didn't change",
+)
+PROM_STAGE = prometheus_client.Histogram(
+    'profile_stage_seconds', "Profile time per stage",
+    ['stage'],
+    buckets=[
+        0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+        600.0, 1800.0, 3600.0, float('inf'),
+    ],
+)
 
 
 # https://xlrd.readthedocs.io/en/latest/vulnerabilities.html
@@ -87,11 +113,59 @@ class LazoDeleteFirst(object):
         return self._lazo.get_lazo_sketch_from_data(*args, **kwargs)
 
 
+def hash_file(path):
+    """Compute the SHA-256 of a file, reading it in chunks.
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        chunk = fp.read(HASH_CHUNK_SIZE)
+        while chunk:
+            hasher.update(chunk)
+            chunk = fp.read(HASH_CHUNK_SIZE)
+    return hasher.hexdigest()
+
+
+def get_previous_profile(es, dataset_id, metadata, content_hash):
+    """Get the profile currently in the index, if it can be reused.
+
+    It can be reused if it was computed by this version of the profiler, from
+    the same data, and with the same manual annotations. Column information
+    provided by the discoverer can change the profile, so it is never reused
+    in that case.
+
+    :return: The metadata from the index, or None.
+    """
+    if 'columns' in metadata:
+        return None
+    try:
+        previous = es.get('datasets', dataset_id)['_source']
+    except elasticsearch.NotFoundError:
+        return None
+    if (
+        previous.get('version') != os.environ['DATAMART_VERSION']
+        or previous.get('content_hash') != content_hash
+        or (
+            previous.get('manual_annotations')
+            != metadata.get('manual_annotations')
+        )
+    ):
+        return None
+    return previous
+
+
 def materialize_and_process_dataset(
     dataset_id, metadata,
     lazo_client, nominatim, geo_data,
-    profile_semaphore,
+    profile_semaphore, profile_workers=None, nominatim_cache=None,
+    es=None, reprofile=False,
 ):
+    """Download and profile a dataset.
+
+    If `es` is provided and the converted data is the same as what is in the
+    index (see `get_previous_profile()`), the previous profile is reused,
+    unless `reprofile` is True. Lazo is then not called, keeping the sketches
+    already there.
+    """
     with contextlib.ExitStack() as stack:
         # Remove converters, we'll discover what's needed
         metadata = dict(metadata)
@@ -130,6 +204,26 @@ def materialize_and_process_dataset(
             materialize,
         )
 
+        with tracer.start_as_current_span('profile/hash'):
+            content_hash = hash_file(dataset_path)
+
+        if es is not None and not reprofile:
+            previous = get_previous_profile(
+                es, dataset_id, metadata, content_hash,
+            )
+            if previous is not None:
+                logger.info(
+                    "Dataset %r hasn't changed, reusing profile",
+                    dataset_id,
+                )
+                PROM_REUSED.inc()
+                for key in PROFILE_KEYS:
+                    if key in previous:
+                        metadata[key] = previous[key]
+                metadata['content_hash'] = content_hash
+                metadata['materialize'] = materialize
+                return metadata
+
         # Profile
         with profile_semaphore:
             with prom_incremented(PROM_PROFILING):
@@ -145,21 +239,50 @@ def materialize_and_process_dataset(
                         metadata=metadata,
                         lazo_client=lazo_client,
                         nominatim=nominatim,
+                        nominatim_cache=nominatim_cache,
                         geo_data=geo_data,
                         include_sample=True,
                         coverage=True,
                         plots=True,
+                        workers=profile_workers,
+                        profiling_stats=True,
                     )
                     logger.info(
                         "Profiling dataset %r took %.2fs",
                         dataset_id,
                         time.perf_counter() - start,
                     )
+                    record_profiling_stats(
+                        dataset_id,
+                        metadata.pop('profiling_stats'),
+                    )
 
+        metadata['content_hash'] = content_hash
         metadata['materialize'] = materialize
         return metadata
 
 
+def record_profiling_stats(dataset_id, stats):
+    """Record the time spent in each stage, and log the slowest column.
+    """
+    for stage, entry in stats['stages'].items():
+        PROM_STAGE.labels(stage).observe(entry['wall_time'])
+    if stats['columns']:
+        column = max(stats['columns'], key=lambda c: c['wall_time'])
+        stage, entry = max(
+            column['stages'].items(),
+            key=lambda item: item[1]['wall_time'],
+            default=(None, None),
+        )
+        logger.info(
+            "Slowest column of %r: %r took %.2fs%s",
+            dataset_id, column['name'], column['wall_time'],
+            '' if stage is None else ' (%s %.2fs)' % (
+                stage, entry['wall_time'],
+            ),
+        )
+
+
 def exception_details(e):
     # Format traceback
     etype = type(e)
@@ -190,7 +313,17 @@ class Profiler(object):
             logger.warning(
                 "$NOMINATIM_URL is not set, not resolving addresses"
             )
+        if self.nominatim and os.environ.get('NOMINATIM_CACHE'):
+            self.nominatim_cache = open_geocode_cache(
+                os.environ['NOMINATIM_CACHE'],
+            )
+        else:
+            self.nominatim_cache = None
         self.geo_data = GeoData.from_local_cache()
+        if os.environ.get('PROFILE_WORKERS'):
+            self.profile_workers = int(os.environ['PROFILE_WORKERS'])
+        else:
+            self.profile_workers = None
         self.channel = None
 
         assert(os.path.isdir('/cache/datasets'))
@@ -252,6 +385,7 @@ class Profiler(object):
             obj = msg2json(message)
             dataset_id = obj['id']
             metadata = obj['metadata']
+            reprofile = obj.get('reprofile', False)
             materialize = metadata.get('materialize', {})
 
             logger.info("Processing dataset %r from %r",
@@ -266,6 +400,10 @@ class Profiler(object):
                 self.nominatim,
                 self.geo_data,
                 self.profile_semaphore,
+                self.profile_workers,
+                self.nominatim_cache,
+                self.es,
+                reprofile,
             )
 
             future.add_done_callback(
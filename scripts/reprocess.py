@@ -4,6 +4,8 @@
 
 This is generally not necessary. You can use freshen_old_index.py to reprocess
 datasets that were profiled by old versions of the profiler.
+
+The datasets are profiled again even if their data hasn't changed.
 """
 
 import aio_pika
@@ -56,7 +58,7 @@ async def freshen(datasets, priority):
             metadata['manual_annotations'] = obj['manual_annotations']
         await amqp_profile_exchange.publish(
             json2msg(
-                dict(id=dataset_id, metadata=metadata),
+                dict(id=dataset_id, metadata=metadata, reprofile=True),
                 priority=priority,
             ),
             '',
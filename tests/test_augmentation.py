@@ -1,9 +1,15 @@
+import collections
 import contextlib
 import os
 import tempfile
+from unittest import mock
 
-from datamart_augmentation import join, union
-from datamart_materialize import make_writer
+import numpy as np
+import pandas as pd
+
+from datamart_augmentation import build_join_index, join, union
+from datamart_augmentation import augmentation, spatial
+from datamart_materialize import make_writer, types
 from datamart_profiler import process_dataset
 
 from .test_profile import check_ranges
@@ -301,6 +307,321 @@ class TestJoin(DataTestCase):
             },
         )
 
+    def test_agg_join_chunks(self):
+        """Join with aggregation, reading the companion in small chunks"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            with mock.patch.object(augmentation, 'CHUNK_SIZE_ROWS', 2):
+                join(
+                    orig_data,
+                    aug_data,
+                    orig_meta,
+                    aug_meta,
+                    writer,
+                    [[0]],
+                    [[0]],
+                    agg_functions={
+                        'work': ['first', 'count'],
+                        'salary': ['first', 'mean', 'sum', 'max', 'min'],
+                    },
+                )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,first work,count work,first salary,'
+                    + 'mean salary,sum salary,max salary,min salary',
+                    [
+                        '30,south korea,True,2,200.0,150.0,300.0,200.0,100.0',
+                        '40,brazil,False,1,,,,,',
+                        '70,usa,True,2,,600.0,600.0,600.0,600.0',
+                        '80,canada,True,1,200.0,200.0,200.0,200.0,200.0',
+                        '100,france,False,2,300.0,250.0,500.0,300.0,200.0',
+                    ],
+                )
+
+    def test_agg_join_index(self):
+        """Join reading only the matching rows, using an index"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            index = os.path.join(os.path.dirname(result), 'index')
+            build_join_index(aug_data.name, index, 0, aug_meta['columns'])
+
+            # Only the rows that match are read
+            orig_data = pd.read_csv(orig_data, dtype=str, na_filter=False)
+            orig_data = orig_data[orig_data['id'].isin(['30', '80'])]
+            dtypes, chunks = augmentation._read_join_index(
+                index, aug_data.name, 0, pd.Index([30, 80]),
+            )
+            self.assertEqual(
+                dtypes,
+                {'id': 'int64', 'work': 'bool', 'salary': 'float64'},
+            )
+            self.assertEqual(
+                pd.concat(list(chunks)).values.tolist(),
+                [[30, True, 200.0], [80, True, 200.0], [30, False, 100.0]],
+            )
+
+            with mock.patch.object(augmentation, 'CHUNK_SIZE_ROWS', 2):
+                join(
+                    orig_data,
+                    aug_data.name,
+                    orig_meta,
+                    aug_meta,
+                    writer,
+                    [[0]],
+                    [[0]],
+                    agg_functions={
+                        'work': ['first', 'count'],
+                        'salary': ['mean', 'sum'],
+                    },
+                    augment_index=index,
+                )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,first work,count work,'
+                    + 'mean salary,sum salary',
+                    [
+                        '30,south korea,True,2,150.0,300.0',
+                        '80,canada,True,1,200.0,200.0',
+                    ],
+                )
+
+    def test_join_index_changed(self):
+        """Don't use an index built for another version of the file"""
+        columns = [
+            {
+                'name': 'id',
+                'structural_type': types.INTEGER,
+                'semantic_types': [],
+            },
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            index = os.path.join(tmp, 'index')
+            with open(path, 'w') as fp:
+                fp.write('id\n' + ''.join('%d\n' % i for i in range(10)))
+            build_join_index(path, index, 0, columns)
+            self.assertIsNotNone(augmentation._read_join_index(
+                index, path, 0, pd.Index([3]),
+            ))
+
+            # Different modification time
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNone(augmentation._read_join_index(
+                index, path, 0, pd.Index([3]),
+            ))
+
+            # Different size
+            build_join_index(path, index, 0, columns)
+            with open(path, 'w') as fp:
+                fp.write('id\n' + ''.join('%d\n' % i for i in range(20)))
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNone(augmentation._read_join_index(
+                index, path, 0, pd.Index([3]),
+            ))
+
+    def test_join_index_text(self):
+        """Read matching rows with an index, keeping the types of columns"""
+        columns = [
+            {
+                'name': 'id',
+                'structural_type': types.INTEGER,
+                'semantic_types': [],
+            },
+            {
+                'name': 'code',
+                'structural_type': types.TEXT,
+                'semantic_types': [],
+            },
+            {
+                'name': 'price',
+                'structural_type': types.FLOAT,
+                'semantic_types': [],
+            },
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            index = os.path.join(tmp, 'index')
+            with open(path, 'w') as fp:
+                fp.write('id,code,price\n')
+                for i in range(1, 11):
+                    fp.write('%d,A%d,%d.5\n' % (i, i, i))
+                fp.write('11,007,3\n12,1.50,4\n')
+            build_join_index(path, index, 0, columns)
+
+            dtypes, chunks = augmentation._read_join_index(
+                index, path, 0, pd.Index([11, 12]),
+            )
+            self.assertEqual(
+                dtypes,
+                {'id': 'int64', 'code': 'object', 'price': 'float64'},
+            )
+            chunk, = chunks
+            self.assertEqual(
+                chunk.values.tolist(),
+                [[11, '007', 3.0], [12, '1.50', 4.0]],
+            )
+            self.assertEqual(
+                [str(dtype) for dtype in chunk.dtypes],
+                ['int64', 'object', 'float64'],
+            )
+
+    def test_agg_join_parallel(self):
+        """Join with aggregation, in worker processes"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            with mock.patch.object(augmentation, 'CHUNK_SIZE_ROWS', 2):
+                join(
+                    orig_data,
+                    aug_data.name,
+                    orig_meta,
+                    aug_meta,
+                    writer,
+                    [[0]],
+                    [[0]],
+                    agg_functions={
+                        'work': ['first', 'nunique'],
+                        'salary': ['first', 'median', 'sum'],
+                    },
+                    workers=2,
+                )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,first work,nunique work,first salary,'
+                    + 'median salary,sum salary',
+                    [
+                        '30,south korea,True,2,200.0,150.0,300.0',
+                        '40,brazil,False,1,,,',
+                        '70,usa,True,2,,600.0,600.0',
+                        '80,canada,True,1,200.0,200.0,200.0',
+                        '100,france,False,2,300.0,250.0,500.0',
+                    ],
+                )
+
+    def test_csv_blocks(self):
+        """Split a CSV file in blocks, keeping quoted line breaks"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            with open(path, 'wb') as fp:
+                fp.write(
+                    b'id,"multi\nline"\n'
+                    + b'1,one\n'
+                    + b'2,"two\nlines"\n'
+                    + b'3,"a ""quote"""\n'
+                    + b'4,four\n'
+                )
+            self.assertEqual(
+                list(augmentation._csv_blocks(path, 2)),
+                [
+                    b'id,"multi\nline"\n1,one\n2,"two\nlines"\n',
+                    b'id,"multi\nline"\n3,"a ""quote"""\n4,four\n',
+                ],
+            )
+
+    def test_csv_blocks_stray_quote(self):
+        """Split a CSV file in blocks, with quotes in unquoted values"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            with open(path, 'wb') as fp:
+                fp.write(
+                    b'id,h\n1,6\'2"\n2,x\n\n3,x\n4,x\n5,x\n6,x\n7,x\n'
+                    + b'8,"a\nb"\n9,y'
+                )
+            blocks = list(augmentation._csv_blocks(path, 2))
+            self.assertEqual(
+                blocks,
+                [
+                    b'id,h\n1,6\'2"\n2,x\n',
+                    b'id,h\n\n3,x\n4,x\n',
+                    b'id,h\n5,x\n6,x\n',
+                    b'id,h\n7,x\n8,"a\nb"\n',
+                    b'id,h\n9,y',
+                ],
+            )
+            self.assertEqual(
+                list(pd.concat(
+                    augmentation._read_csv_block(block) for block in blocks
+                )['h']),
+                ['6\'2"', 'x', 'x', 'x', 'x', 'x', 'x', 'a\nb', 'y'],
+            )
+
+    def test_csv_blocks_long_row(self):
+        """Read the rest of a CSV file serially if a row doesn't end"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            with open(path, 'wb') as fp:
+                fp.write(
+                    b'id,h\n1,a\n2,b\n3,c\n4,"d\ne\nf\ng"\n5,h\n6,i\n'
+                )
+            with mock.patch.object(augmentation, 'CSV_BLOCK_READ_SIZE', 4):
+                blocks = list(augmentation._csv_blocks(path, 2))
+            self.assertEqual(len(blocks), 4)
+            self.assertEqual(blocks[:2], [
+                b'id,h\n1,a\n2,b\n',
+                b'id,h\n3,c\n',
+            ])
+            for block in blocks[2:]:
+                self.assertIsInstance(block, pd.DataFrame)
+                self.assertEqual(list(block.columns), ['id', 'h'])
+            self.assertEqual(
+                list(pd.concat(blocks[2:])['h']),
+                ['d\ne\nf\ng', 'h', 'i'],
+            )
+
+    def test_agg_join_statistics(self):
+        """Join with median, standard deviation, and distinct values"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            with mock.patch.object(augmentation, 'CHUNK_SIZE_ROWS', 3):
+                output_metadata = join(
+                    orig_data,
+                    aug_data,
+                    orig_meta,
+                    aug_meta,
+                    writer,
+                    [[0]],
+                    [[0]],
+                    agg_functions={
+                        'work': 'nunique',
+                        'salary': ['median', 'std'],
+                    },
+                )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,nunique work,median salary,std salary',
+                    [
+                        '30,south korea,2,150.0,70.71067811865476',
+                        '40,brazil,1,,',
+                        '70,usa,2,600.0,',
+                        '80,canada,1,200.0,',
+                        '100,france,2,250.0,70.71067811865476',
+                    ],
+                )
+
+        self.assertEqual(
+            [
+                (col['name'], col['structural_type'])
+                for col in output_metadata['columns'][2:]
+            ],
+            [
+                ('nunique work', 'http://schema.org/Integer'),
+                ('median salary', 'http://schema.org/Float'),
+                ('std salary', 'http://schema.org/Float'),
+            ],
+        )
+
     def test_geo_join(self):
         """Join with lat,long keys"""
         with setup_augmentation('geo_aug.csv', 'geo.csv') as (
@@ -813,6 +1134,105 @@ class TestJoin(DataTestCase):
         )
 
 
+class TestJoinAggregation(DataTestCase):
+    def setUp(self):
+        self.original = pd.DataFrame({
+            'id': ['a', 'b', 'c'],
+            augmentation.UNIQUE_INDEX_KEY: pd.RangeIndex(3),
+        })
+        self.chunks = [
+            pd.DataFrame({
+                augmentation.UNIQUE_INDEX_KEY: [0, 0, 1],
+                'height': [1.0, 2.0, 3.0],
+            }),
+            pd.DataFrame({
+                augmentation.UNIQUE_INDEX_KEY: [1, 2, 2],
+                'height': ['tall', '4', '6'],
+            }),
+        ]
+
+    def test_text_default(self):
+        """Numbers turning into text fall back to the first value"""
+        aggregation = augmentation.JoinAggregation(
+            ['height'], {'height': np.dtype(np.float64)}, size=3,
+        )
+        for chunk in self.chunks:
+            aggregation.add(chunk)
+        result = aggregation.result(self.original, keep_all=True)
+        self.assertEqual(list(result.columns), ['id', 'height'])
+        self.assertEqual(list(result['height']), [1.0, 3.0, '4'])
+
+    def test_text_requested(self):
+        """Requested numerical functions ignore the text values"""
+        aggregation = augmentation.JoinAggregation(
+            ['height'], {'height': np.dtype(np.float64)},
+            {'height': ['mean', 'first']}, {'height': 'height'}, size=3,
+        )
+        with self.assertLogs(augmentation.logger, 'WARNING'):
+            for chunk in self.chunks:
+                aggregation.add(chunk)
+        result = aggregation.result(self.original, keep_all=True)
+        self.assertEqual(
+            list(result.columns),
+            ['id', 'mean height', 'first height'],
+        )
+        self.assertEqual(list(result['mean height']), [1.5, 3.0, 5.0])
+        self.assertEqual(list(result['first height']), [1.0, 3.0, '4'])
+
+
+class TestSpatialIndex(DataTestCase):
+    def test_nearest(self):
+        """Move points to the nearest input point, skipping far away ones"""
+        rng = np.random.RandomState(1)
+        points = pd.DataFrame({
+            'lat': rng.uniform(40.5, 40.9, 500).astype(str),
+            'long': rng.uniform(-74.25, -73.7, 500).astype(str),
+        })
+        index = spatial.SpatialIndex(np.unique(
+            spatial._to_points(points),
+            axis=0,
+        ))
+        self.assertIsNotNone(index.cells)
+
+        others = pd.DataFrame({
+            'lat': np.concatenate([
+                rng.uniform(40.4, 41.0, 2000), [np.nan, 40.7],
+            ]),
+            'long': np.concatenate([
+                rng.uniform(-74.3, -73.6, 2000), [-74.0, np.nan],
+            ]),
+        })
+        result = index(others)
+
+        # Compare with querying all the points
+        expected = np.full((len(others), 2), np.nan)
+        dist, idx = index.tree.query(spatial._to_points(others)[:2000])
+        close = dist[:, 0] < index.max_dist
+        expected[:2000][close] = index.coords[idx[:, 0][close]]
+        np.testing.assert_array_equal(result, expected)
+        self.assertTrue(200 < np.count_nonzero(close) < 1800)
+
+    def test_cache(self):
+        """Reuse the index for the same input points"""
+        points = pd.DataFrame({
+            'lat': ['40.1', '40.2', '40.3', '40.1', '40.5'],
+            'long': ['-74.1', '-74.2', '-74.3', '-74.1', '-74.5'],
+        })
+        with mock.patch.object(
+            spatial, '_spatial_index_cache', collections.OrderedDict(),
+        ):
+            index = spatial.get_spatial_index(points)
+            self.assertEqual(len(index.coords), 4)
+            self.assertIs(
+                spatial.get_spatial_index(points.iloc[::-1]),
+                index,
+            )
+            self.assertIsNot(
+                spatial.get_spatial_index(points.iloc[:3]),
+                index,
+            )
+
+
 class TestUnion(DataTestCase):
     def test_geo_union(self):
         """Test union on geo.csv"""
@@ -0,0 +1,113 @@
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from datamart_fslock import FSLockExclusive, FSLockShared
+
+
+class TestLocks(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='datamart_fslock_')
+        self.path = os.path.join(self.tmp, 'entry.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def flock_nb(self, op):
+        """Try locking from a separate open file description"""
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, op | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        else:
+            return True
+        finally:
+            os.close(fd)
+
+    def test_missing(self):
+        """Shared lock on a missing file raises"""
+        with self.assertRaises(FileNotFoundError):
+            with FSLockShared(self.path):
+                pass
+
+    def test_exclusive(self):
+        """Exclusive lock excludes everyone, and is released"""
+        with FSLockExclusive(self.path):
+            self.assertTrue(os.path.exists(self.path))
+            self.assertFalse(self.flock_nb(fcntl.LOCK_SH))
+            with self.assertRaises(TimeoutError):
+                with FSLockShared(self.path, timeout=0):
+                    pass
+            with self.assertRaises(TimeoutError):
+                with FSLockExclusive(self.path, timeout=0.1):
+                    pass
+        self.assertTrue(self.flock_nb(fcntl.LOCK_EX))
+
+    def test_shared_threads(self):
+        """Shared locks from multiple threads share one file lock"""
+        with FSLockExclusive(self.path):
+            pass
+
+        first_locked = threading.Event()
+        second_done = threading.Event()
+
+        def second():
+            with FSLockShared(self.path, timeout=1):
+                first_locked.wait()
+            second_done.set()
+
+        with FSLockShared(self.path):
+            thread = threading.Thread(target=second)
+            thread.start()
+            first_locked.set()
+            self.assertTrue(second_done.wait(5))
+            # Our lock wasn't dropped by the other thread releasing its own
+            self.assertTrue(self.flock_nb(fcntl.LOCK_SH))
+            self.assertFalse(self.flock_nb(fcntl.LOCK_EX))
+            with self.assertRaises(TimeoutError):
+                with FSLockExclusive(self.path, timeout=0):
+                    pass
+        thread.join()
+        self.assertTrue(self.flock_nb(fcntl.LOCK_EX))
+
+    def test_timeout_thread(self):
+        """Timeouts work from threads other than the main thread"""
+        result = []
+
+        def other():
+            start = time.perf_counter()
+            try:
+                with FSLockExclusive(self.path, timeout=0.2):
+                    pass
+            except TimeoutError:
+                result.append(time.perf_counter() - start)
+
+        with FSLockExclusive(self.path):
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join(5)
+        self.assertEqual(len(result), 1)
+        self.assertGreaterEqual(result[0], 0.2)
+
+    def test_wait(self):
+        """Exclusive lock waits for the other thread to release"""
+        locked = threading.Event()
+        release = threading.Event()
+
+        def holder():
+            with FSLockExclusive(self.path):
+                locked.set()
+                release.wait()
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        locked.wait()
+        threading.Timer(0.1, release.set).start()
+        with FSLockExclusive(self.path, timeout=5):
+            self.assertTrue(release.is_set())
+        thread.join()
@@ -349,7 +349,8 @@ class TestProfileQuery(DatamartTest):
         # Some fields like 'name', 'description' won't be there
         metadata = {k: v for k, v in metadata.items()
                     if k not in {'id', 'name', 'description',
-                                 'source', 'source_url', 'date'}}
+                                 'source', 'source_url', 'date',
+                                 'content_hash'}}
         metadata['materialize'] = {k: v
                                    for k, v in metadata['materialize'].items()
                                    if k == 'convert'}
@@ -3087,6 +3088,7 @@ basic_metadata = {
               ",blue,6,false\r\nandrew,green,6,false\r\nkenneth,green,7,true" +
               "\r\n",
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3243,6 +3245,7 @@ agg_metadata = {
               "true,200\r\n100,false,300\r\n100,true,200\r\n30,false,100\r\n" +
               "70,false,600\r\n",
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3428,6 +3431,7 @@ annotated_metadata = {
         "date": lambda d: isinstance(d, str)
     },
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3537,6 +3541,7 @@ geo_metadata = {
               "26,-73.984213,32.226852\r\nplace97,40.692794,-73.986984,32.89" +
               "1257\r\n",
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3687,6 +3692,7 @@ geo_wkt_metadata = {
               "\r\nplace87,POINT (-73.984213 40.693326),32.226852\r\nplace97" +
               ",POINT (-73.986984 40.692794),32.891257\r\n",
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3754,6 +3760,7 @@ lazo_metadata = {
               "ingerbread,1990\r\neclair,1990\r\nprofiterole,1990\r\ncaramel" +
               ",1991\r\nmilkshake,1991\r\n",
     "date": lambda d: isinstance(d, str),
+    "content_hash": lambda h: isinstance(h, str),
     "version": version
 }
 
@@ -3826,6 +3833,7 @@ daily_metadata = {
               "s\r\n20190518,no\r\n20190519,yes\r\n20190520,no\r\n20190521,n" +
               "o\r\n20190522,yes\r\n",
     'date': lambda d: isinstance(d, str),
+    'content_hash': lambda h: isinstance(h, str),
     'version': version,
 }
 
@@ -3901,6 +3909,7 @@ hourly_metadata = {
               "0:00:00,yes\r\n2019-06-13T14:00:00,yes\r\n2019-06-13T17:00:00" +
               ",yes\r\n2019-06-14T00:00:00,yes\r\n2019-06-14T01:00:00,yes\r\n",
     'date': lambda d: isinstance(d, str),
+    'content_hash': lambda h: isinstance(h, str),
     'version': version,
 }
 
@@ -3981,6 +3990,7 @@ dates_pivoted_metadata = {
               "d,2012-07-01,no\r\nred,2012-09-01,no\r\nred,2012-10-01,yes\r" +
               "\nred,2012-11-01,yes\r\nred,2012-12-01,no\r\n",
     'date': lambda d: isinstance(d, str),
+    'content_hash': lambda h: isinstance(h, str),
     'version': version
 }
 
@@ -4060,6 +4070,7 @@ years_pivoted_metadata = {
               "ed,2010,no\r\nred,2011,no\r\nred,2012,no\r\nred,2014,no\r\nre" +
               "d,2015,yes\r\nred,2016,yes\r\nred,2017,no\r\n",
     'date': lambda d: isinstance(d, str),
+    'content_hash': lambda h: isinstance(h, str),
     'version': version
 }
 
@@ -4150,5 +4161,6 @@ other_formats_metadata = lambda fmt: {
               '-01-01T00:00:00\r\nRust,9,2010-07-07T00:00:00\r\nLua,27,1993-' +
               '01-01T00:00:00\r\n',
     'date': lambda d: isinstance(d, str),
+    'content_hash': lambda h: isinstance(h, str),
     'version': version
 }
@@ -3,22 +3,32 @@ import csv
 from datetime import datetime
 from dateutil.tz import UTC
 import io
+import numpy
 import os
 import pandas
 import random
 import requests
+import shutil
 import tempfile
 import textwrap
+import threading
+import tracemalloc
 import unittest
 
 import datamart_geo
 from datamart_profiler import process_dataset
-from datamart_profiler.core import expand_attribute_name, load_data
+from datamart_profiler.core import expand_attribute_name, load_data, \
+    sample_rows
+from datamart_profiler.geocode_cache import MemoryGeocodeCache, \
+    SqliteGeocodeCache
+from datamart_profiler.sketches import DistinctCounter, HyperLogLog
+from datamart_profiler import numerical
 from datamart_profiler import profile_types
 from datamart_profiler import spatial
 from datamart_profiler.spatial import LATITUDE, LONGITUDE, LatLongColumn, \
     disambiguate_admin_areas
-from datamart_profiler.temporal import get_temporal_resolution, parse_date
+from datamart_profiler.temporal import get_temporal_resolution, \
+    infer_date_format, parse_date, parse_dates
 
 from .utils import DataTestCase, data
 
@@ -123,6 +133,123 @@ class TestSample(unittest.TestCase):
             data, metadata, column_names = load_data(tmp.name, 6000)
             self.assertEqual(data.shape, (425, 2))
 
+    def test_sample_quoted(self):
+        """Test sampling rows with newlines in quoted fields"""
+        rows = [b'id,text\n']
+        for i in range(1000):
+            rows.append(b'%d,"line ""%d""\nsecond line"\n' % (i, i))
+        contents = b''.join(rows).rstrip(b'\n')
+        header, sample, nb_rows = sample_rows(
+            io.BytesIO(contents), 0.3, len(contents),
+        )
+        self.assertEqual(header, b'id,text\n')
+        self.assertEqual(nb_rows, 1000)
+        self.assertEqual(len(sample), 300)
+        self.assertTrue(set(sample) <= set(rows[1:]))
+        self.assertEqual(sample, sorted(sample, key=rows.index))
+
+        # Same result in text mode
+        self.assertEqual(
+            sample_rows(
+                io.StringIO(contents.decode('utf-8')), 0.3, len(contents),
+            ),
+            (header, sample, nb_rows),
+        )
+
+    def test_sample_stray_quote(self):
+        """Test sampling rows with quotes in unquoted fields"""
+        rows = [b'id,height,text\n']
+        for i in range(1000):
+            if i % 2 == 0:
+                rows.append(b'%d,6\'2",x"y\n' % i)
+            else:
+                rows.append(b'%d,5\'11","two\nlines"\n' % i)
+        contents = b''.join(rows)
+        header, sample, nb_rows = sample_rows(
+            io.BytesIO(contents), 0.3, len(contents),
+        )
+        self.assertEqual(header, b'id,height,text\n')
+        self.assertEqual(nb_rows, 1000)
+        self.assertEqual(len(sample), 300)
+        self.assertTrue(set(sample) <= set(rows[1:]))
+
+
+class TestStreaming(unittest.TestCase):
+    def test_hyperloglog(self):
+        """Test estimating and merging distinct counts"""
+        first = HyperLogLog()
+        first.add(['value %d' % i for i in range(60000)])
+        second = HyperLogLog()
+        second.add(['value %d' % i for i in range(40000, 100000)])
+        self.assertAlmostEqual(first.count(), 60000, delta=1500)
+        first.merge(second)
+        self.assertAlmostEqual(first.count(), 100000, delta=2500)
+
+        counter = DistinctCounter()
+        counter.add(['a', 'b', 'a'])
+        self.assertEqual(counter.count(), 2)
+
+    def test_profile(self):
+        """Test computing statistics from all the rows of a sampled file"""
+        rand = random.Random(3)
+        numbers = [rand.randint(0, 1000) for _ in range(2000)]
+        categories = [rand.choice('abcdefg') for _ in range(2000)]
+        categories[:20] = [''] * 20
+        with tempfile.NamedTemporaryFile('w+', newline='') as tmp:
+            writer = csv.writer(tmp)
+            writer.writerow(['number', 'category'])
+            writer.writerows(zip(numbers, categories))
+            tmp.flush()
+
+            metadata = process_dataset(
+                tmp.name,
+                load_max_size=2000,
+                streaming=True,
+            )
+
+        self.assertEqual(metadata['nb_rows'], 2000)
+        self.assertLess(metadata['nb_profiled_rows'], 500)
+        number, category = metadata['columns']
+        self.assertEqual(
+            number['num_distinct_values'],
+            len(set(numbers)),
+        )
+        self.assertAlmostEqual(
+            number['mean'],
+            float(numpy.mean(numbers)),
+        )
+        self.assertAlmostEqual(
+            number['stddev'],
+            float(numpy.std(numbers)),
+        )
+        self.assertEqual(category['num_distinct_values'], 7)
+        self.assertEqual(category['missing_values_ratio'], 0.01)
+
+
+class TestArrowStrings(unittest.TestCase):
+    def test_profile(self):
+        """Test profiling with data loaded as Arrow strings"""
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+
+        for filename in ('spatiotemporal.csv', 'geo_wkt.csv', 'dates_pivoted.csv'):
+            with data(filename, 'r') as data_fp:
+                expected = process_dataset(
+                    data_fp, plots=True, include_sample=True,
+                )
+            with data(filename, 'r') as data_fp:
+                metadata = process_dataset(
+                    data_fp, plots=True, include_sample=True,
+                    arrow_strings=True,
+                )
+            self.assertEqual(metadata, expected)
+
+        with data('spatiotemporal.csv', 'r') as data_fp:
+            df, _, _ = load_data(data_fp, arrow_strings=True)
+        self.assertEqual(str(df.dtypes.iloc[0]), 'string')
+
 
 class TestNames(unittest.TestCase):
     def test_names(self):
@@ -204,6 +331,106 @@ class TestIndex(unittest.TestCase):
         )
 
 
+class TestParallel(unittest.TestCase):
+    def test_workers(self):
+        """Test profiling columns in worker processes"""
+        for filename in ('spatiotemporal.csv', 'geo_wkt.csv', 'daily.csv'):
+            with data(filename, 'r') as data_fp:
+                expected = process_dataset(data_fp, plots=True)
+            with data(filename, 'r') as data_fp:
+                metadata = process_dataset(data_fp, plots=True, workers=3)
+            self.assertEqual(metadata, expected)
+
+
+class TestProfilingStats(unittest.TestCase):
+    def check_stats(self, stats, memory):
+        self.assertEqual(
+            [col['name'] for col in stats['columns']],
+            ['date', 'latitude', 'longitude', 'color'],
+        )
+        self.assertEqual(stats['stages']['profile/column']['calls'], 4)
+        self.assertEqual(stats['stages']['profile/identify_types']['calls'], 4)
+        self.assertEqual(stats['stages']['profile/load_data']['calls'], 1)
+        self.assertIn('profile/spatial_coverage', stats['stages'])
+        for col in stats['columns']:
+            self.assertIn('profile/identify_types', col['stages'])
+            self.assertNotIn('profile/load_data', col['stages'])
+            self.assertGreaterEqual(
+                col['wall_time'],
+                col['stages']['profile/identify_types']['wall_time'],
+            )
+            self.assertEqual('peak_memory' in col, memory)
+        self.assertEqual('peak_memory' in stats, memory)
+
+    def test_stats(self):
+        """Test recording the time spent in each stage"""
+        with data('spatiotemporal.csv', 'r') as data_fp:
+            expected = process_dataset(data_fp)
+        with data('spatiotemporal.csv', 'r') as data_fp:
+            metadata = process_dataset(data_fp, profiling_stats=True)
+        self.check_stats(metadata.pop('profiling_stats'), False)
+        self.assertEqual(metadata, expected)
+
+        # Stats from worker processes, with memory
+        tracemalloc.start()
+        try:
+            with data('spatiotemporal.csv', 'r') as data_fp:
+                metadata = process_dataset(
+                    data_fp,
+                    profiling_stats=True,
+                    workers=2,
+                )
+        finally:
+            tracemalloc.stop()
+        self.check_stats(metadata.pop('profiling_stats'), True)
+        self.assertEqual(metadata, expected)
+
+
+class TestLazo(unittest.TestCase):
+    class FakeLazoClient(object):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.calls = {}
+
+        def index_data(self, values, dataset_id, column_name):
+            with self.lock:
+                self.calls[column_name] = (dataset_id, values)
+
+        def get_lazo_sketch_from_data(self, values, dataset_id, column_name):
+            with self.lock:
+                self.calls[column_name] = (dataset_id, values)
+            return 128, [len(column_name)], len(values)
+
+    def test_lazo(self):
+        """Test sending the distinct values of textual columns to Lazo"""
+        df = pandas.DataFrame({
+            'animal': ['cat', 'dog', 'cat', 'bird', 'dog'],
+            'number': ['1', '2', '3', '4', '5'],
+            'color': ['red', 'red', 'red', '', 'blue'],
+        })
+
+        lazo_client = self.FakeLazoClient()
+        process_dataset(df, dataset_id='test', lazo_client=lazo_client)
+        self.assertEqual(
+            {k: (d, sorted(v)) for k, (d, v) in lazo_client.calls.items()},
+            {
+                'animal': ('test', ['bird', 'cat', 'dog']),
+                'color': ('test', ['', 'blue', 'red']),
+            },
+        )
+
+        lazo_client = self.FakeLazoClient()
+        metadata = process_dataset(df, lazo_client=lazo_client, search=True)
+        self.assertEqual(
+            [col.get('lazo') for col in metadata['columns']],
+            [
+                {'n_permutations': 128, 'hash_values': [6], 'cardinality': 3},
+                None,
+                {'n_permutations': 128, 'hash_values': [5], 'cardinality': 3},
+            ],
+        )
+
+
 class TestLatlongSelection(DataTestCase):
     def test_normalize_name(self):
         """Test normalizing column names"""
@@ -321,6 +548,40 @@ class TestLatlongSelection(DataTestCase):
         )
 
 
+class TestPoints(unittest.TestCase):
+    def test_parse_wkt(self):
+        """Test parsing points from a column"""
+        values = pandas.Series([
+            'POINT (-73.9849621 40.6962574)', '', 'junk',
+            'POINT (200.0 1.0)', '(1.5, 2.5)', '(1.5 2.5) trailing',
+        ])
+        self.assertEqual(
+            spatial.parse_wkt_column(values).tolist(),
+            [[40.6962574, -73.9849621], [2.5, 1.5]],
+        )
+        self.assertEqual(
+            spatial.parse_wkt_column(values, latlong=True).tolist(),
+            [[-73.9849621, 40.6962574], [1.5, 2.5]],
+        )
+
+    def test_ranges(self):
+        """Test building bounding boxes from points"""
+        rand = numpy.random.RandomState(2)
+        points = numpy.concatenate([
+            rand.normal((40.7, -74.0), 0.01, (200, 2)),
+            rand.normal((48.8, 2.3), 0.01, (100, 2)),
+            [(-33.9, 151.2)],
+        ])
+        ranges = spatial.get_spatial_ranges(points)
+        self.assertEqual(len(ranges), 2)
+        for rg, (lat, long) in zip(ranges, [(40.7, -74.0), (48.8, 2.3)]):
+            [min_long, max_lat], [max_long, min_lat] = \
+                rg['range']['coordinates']
+            self.assertTrue(min_lat < lat < max_lat)
+            self.assertTrue(min_long < long < max_long)
+            self.assertTrue(max_lat - min_lat < 0.05)
+
+
 class TestDates(DataTestCase):
     def test_parse(self):
         """Test parsing dates"""
@@ -352,6 +613,27 @@ class TestDates(DataTestCase):
             None,
         )
 
+    def test_parse_format(self):
+        """Test parsing dates with an inferred format"""
+        values = ['2019-07-%02d 18:%02d' % (d, d) for d in range(1, 29)]
+        values += ['2019-07-29T18:29:00-04:00', 'July 30, 2019', 'nope', '']
+        self.assertEqual(infer_date_format(values), '%Y-%m-%d %H:%M')
+        self.assertEqual(
+            parse_dates(values),
+            [parse_date(v) for v in values],
+        )
+        self.assertEqual(
+            parse_dates(values)[0],
+            datetime(2019, 7, 1, 18, 1, tzinfo=UTC),
+        )
+
+        # Day-first and month-first can't be told apart, defer to dateutil
+        self.assertEqual(
+            infer_date_format(['01/02/2019', '03/04/2019']),
+            '%m/%d/%Y',
+        )
+        self.assertEqual(infer_date_format(['nope', '12']), None)
+
     def test_year(self):
         """Test the 'year' special-case"""
         dataframe = pandas.DataFrame({
@@ -432,6 +714,24 @@ class TestTemporalResolutions(unittest.TestCase):
 
         self.do_checks(get_res)
 
+    def test_timezone(self):
+        """Test that bins use the local time of the values"""
+        values = [
+            '2020-01-14T23:00:00-05:00',
+            '2020-01-15T23:00:00-05:00',
+            '2020-01-16T23:00:00-05:00',
+        ]
+        self.assertEqual(
+            get_temporal_resolution([parse_date(v) for v in values]),
+            'day',
+        )
+        self.assertEqual(
+            get_temporal_resolution(pandas.DatetimeIndex(
+                pandas.to_datetime(values),
+            ).tz_convert('America/New_York')),
+            'day',
+        )
+
     def do_checks(self, get_res):
         self.assertEqual(
             get_res([
@@ -568,6 +868,47 @@ class TestTemporalResolutions(unittest.TestCase):
         )
 
 
+class TestRanges(unittest.TestCase):
+    def test_ckmeans(self):
+        """Test the optimal 1-D clustering against all possible clusterings"""
+        def cost(values, breaks):
+            return sum(
+                ((part - part.mean()) ** 2).sum()
+                for part in numpy.split(values, breaks)
+            )
+
+        rand = numpy.random.RandomState(1)
+        for _ in range(50):
+            values = numpy.sort(rand.randint(0, 20, 12) * 1.5)
+            breaks = numerical.ckmeans_clusters(values, 3)
+            self.assertEqual(
+                len(breaks),
+                min(3, len(numpy.unique(values))) - 1,
+            )
+            best = min(
+                cost(values, [i, j])
+                for i in range(1, len(values))
+                for j in range(i + 1, len(values))
+            )
+            self.assertAlmostEqual(cost(values, breaks), best)
+
+    def test_ranges(self):
+        """Test computing ranges from clusters"""
+        values = [10.0 + i for i in range(40)] + [900.0, 901.0]
+        values += [500.0 + i for i in range(20)]
+        for clustering in (
+            numerical.ckmeans_clusters,
+            numerical.kmeans_clusters,
+        ):
+            self.assertEqual(
+                numerical.get_numerical_ranges(values, clustering=clustering),
+                [
+                    {'range': {'gte': 12.0, 'lte': 48.0}},
+                    {'range': {'gte': 501.0, 'lte': 519.0}},
+                ],
+            )
+
+
 class TestTypes(unittest.TestCase):
     def do_test(self, match, positive, negative):
         for elem in textwrap.dedent(positive).splitlines():
@@ -693,6 +1034,99 @@ class TestTypes(unittest.TestCase):
             positive, negative,
         )
 
+    def test_count(self):
+        """Test counting the structures of a whole array"""
+        array = [
+            '12', '4.0', '.7', '', 'http://auctus.vida-nyu.org/',
+            '/var/mail/fchirigati', 'POINT (-73.997174 40.729753)',
+            'POINT (-73.997174, 40.729753)',
+            'BROOKLYN, NY (40.729753, -73.997174)',
+            '(40.729753, -73.997174)', 'POLYGON ((1 2 3 4))',
+            'some free text here', 'not enough text', 'yes', 'True', '',
+            'double  spaced  free  text', 'tab\tseparated\tfree\ttext',
+            '  padded  text  ', 'not  enough  text', ' ' * 20,
+        ]
+        self.assertEqual(
+            dict(profile_types.regular_exp_count(array)),
+            {
+                'int': 2, 'float': 1, 'empty': 2, 'url': 1, 'file': 1,
+                'point': 1, 'geo_combined': 2, 'latlong_point': 1,
+                'polygon': 1, 'text': 4, 'bool': 2,
+            },
+        )
+
+    def test_distinct(self):
+        """Test computing on distinct values then expanding to all values"""
+        values, counts, codes = profile_types.value_counts(
+            ['b', '', 'a', 'b', 'c', 'a', 'b'],
+        )
+        self.assertEqual(list(values), ['b', '', 'a', 'c'])
+        self.assertEqual(list(counts), [3, 1, 2, 1])
+        self.assertEqual(
+            profile_types.expand_values(
+                [v.upper() if v != 'a' else None for v in values],
+                codes,
+            ),
+            ['B', '', 'B', 'C', 'B'],
+        )
+
+    def test_parsed_dates(self):
+        """Test keeping the dates parsed by type identification"""
+        array = ['2020-01-02', '', '2020-01-02', '2020-03-04', '2020-01-02']
+        parsed = {}
+        profile_types.identify_types(array, 'dates', None, parsed=parsed)
+        self.assertEqual(
+            parsed['dates'],
+            [datetime(2020, 1, 2, tzinfo=UTC),
+             datetime(2020, 3, 4, tzinfo=UTC)],
+        )
+        self.assertEqual(
+            list(parsed['timestamps']),
+            [1577923200.0, 1577923200.0, 1583280000.0, 1577923200.0],
+        )
+
+    def test_adaptive(self):
+        """Test detecting types from a sample of the rows"""
+        # 1% of the values are not integers, 5% are missing
+        array = [str(i) for i in range(50000)]
+        for i in range(0, 50000, 100):
+            array[i] = 'unknown'
+        for i in range(1, 50000, 20):
+            array[i] = ''
+        structural_type, semantic_types_dict, column_meta = \
+            profile_types.identify_types(
+                array, 'number', None, confidence=0.999,
+            )
+        self.assertEqual(structural_type, 'http://schema.org/Integer')
+        self.assertEqual(semantic_types_dict, {})
+        self.assertLess(column_meta['type_sample_size'], 10000)
+        self.assertAlmostEqual(
+            column_meta['unclean_values_ratio'], 0.01, delta=0.01,
+        )
+        # Missing values are counted exactly
+        self.assertEqual(column_meta['missing_values_ratio'], 0.05)
+
+        # Exactly 2% are not integers, the whole column is needed to tell
+        for i in range(50, 45000, 100):
+            array[i] = 'unknown'
+        self.assertEqual(
+            profile_types.identify_types(
+                array, 'number', None, confidence=0.999,
+            ),
+            profile_types.identify_types(array, 'number', None),
+        )
+
+        # Empty column
+        self.assertEqual(
+            profile_types.identify_types(
+                pandas.Series([], dtype=object), 'number', None,
+                confidence=0.999,
+            ),
+            profile_types.identify_types(
+                pandas.Series([], dtype=object), 'number', None,
+            ),
+        )
+
 
 class TestTruncate(unittest.TestCase):
     def test_simple(self):
@@ -854,6 +1288,141 @@ class TestNominatim(DataTestCase):
         finally:
             spatial.nominatim_query = old_query
 
+    def test_cache(self):
+        """Test that the geocode cache is used and filled"""
+        queries = {
+            'a': [{'lat': 11.0, 'lon': 12.0}],
+            'b': [],
+            'c': [{'lat': 31.0, 'lon': 32.0}],
+            'd': [{'lat': 41.0, 'lon': 42.0}],
+        }
+        queried = []
+
+        def replacement(url, *, q):
+            queried.extend(q)
+            return [queries[qe] for qe in q]
+
+        old_query = spatial.nominatim_query
+        old_batch_size = spatial.NOMINATIM_BATCH_SIZE
+        spatial.nominatim_query = replacement
+        spatial.NOMINATIM_BATCH_SIZE = 1
+        tmp = tempfile.mkdtemp(prefix='datamart_geocode_')
+        try:
+            for cache in [
+                MemoryGeocodeCache(3),
+                SqliteGeocodeCache(os.path.join(tmp, 'cache.sqlite3'), 3),
+            ]:
+                queried[:] = []
+                res, empty = spatial.nominatim_resolve_all(
+                    'http://240.123.45.67:21',
+                    ['a', 'b', 'c', 'b', 'a'],
+                    cache=cache,
+                )
+                self.assertEqual(
+                    res,
+                    [(11.0, 12.0), (11.0, 12.0), (31.0, 32.0)],
+                )
+                self.assertEqual(empty, 5)
+                self.assertEqual(sorted(queried), ['a', 'b', 'c'])
+
+                # Only the new address is queried
+                queried[:] = []
+                res, empty = spatial.nominatim_resolve_all(
+                    'http://240.123.45.67:21',
+                    [' A', 'b', 'c', 'd '],
+                    cache=cache,
+                )
+                self.assertEqual(
+                    res,
+                    [(11.0, 12.0), (31.0, 32.0), (41.0, 42.0)],
+                )
+                self.assertEqual(queried, ['d'])
+
+                # The least recently used entry was evicted
+                self.assertEqual(
+                    cache.get_many(['a', 'b', 'c', 'd']),
+                    {'b': None, 'c': (31.0, 32.0), 'd': (41.0, 42.0)},
+                )
+        finally:
+            spatial.nominatim_query = old_query
+            spatial.NOMINATIM_BATCH_SIZE = old_batch_size
+            shutil.rmtree(tmp)
+
+
+class TestAdminCache(unittest.TestCase):
+    class FakeGeoData(object):
+        def __init__(self, areas):
+            self.areas = areas
+            self.queries = []
+
+        def resolve_name_all(self, name):
+            self.queries.append(name)
+            return iter(self.areas.get(name, []))
+
+    class FakeArea(object):
+        def __init__(self, parent):
+            self.parent = parent
+            self.calls = 0
+
+        def get_parent_area(self):
+            self.calls += 1
+            return self.parent
+
+    def test_resolve(self):
+        """Test memoizing the resolution of admin names"""
+        geo_data = self.FakeGeoData({'texas': ['TX'], 'ohio': ['OH']})
+        self.assertEqual(
+            spatial.resolve_admin_areas(
+                geo_data,
+                ['Texas', 'TEXAS', 'Ohio', 'Paris', 'Not a place name'],
+            ),
+            [('TX',), ('TX',), ('OH',), (), ()],
+        )
+        self.assertEqual(
+            geo_data.queries,
+            ['texas', 'ohio', 'paris', 'not a place name'],
+        )
+
+        self.assertEqual(
+            spatial.resolve_admin_areas(geo_data, ['ohio', 'paris']),
+            [('OH',), ()],
+        )
+        self.assertEqual(
+            geo_data.queries,
+            ['texas', 'ohio', 'paris', 'not a place name'],
+        )
+
+    def test_min_found(self):
+        """Test giving up when too few names can be resolved"""
+        geo_data = self.FakeGeoData({'texas': ['TX'], 'ohio': ['OH']})
+        names = ['texas', 'utah', 'ohio', 'iowa', 'maine']
+        self.assertIsNone(
+            spatial.resolve_admin_areas(geo_data, names, min_found=3),
+        )
+        self.assertEqual(geo_data.queries, ['texas', 'utah', 'ohio', 'iowa'])
+        self.assertEqual(
+            spatial.resolve_admin_areas(geo_data, names, min_found=1),
+            [('TX',), (), ('OH',), (), ()],
+        )
+
+    def test_ancestors(self):
+        """Test memoizing the parents of admin areas"""
+        country = self.FakeArea(None)
+        state = self.FakeArea(country)
+        county = self.FakeArea(state)
+        self.assertEqual(
+            spatial.get_admin_ancestors(county),
+            (state, country),
+        )
+        self.assertEqual(
+            spatial.get_admin_ancestors(state),
+            (country,),
+        )
+        self.assertEqual(
+            [country.calls, state.calls, county.calls],
+            [1, 1, 1],
+        )
+
 
 class TestGeo(DataTestCase):
     @classmethod
@@ -1077,6 +1646,23 @@ class TestGeo(DataTestCase):
             },
         )
 
+    def test_admin_parallel(self):
+        """Test profiling administrative areas in worker processes"""
+        with data('admins.csv', 'r') as data_fp:
+            expected = process_dataset(
+                data_fp,
+                geo_data=self.geo_data,
+                coverage=True,
+            )
+        with data('admins.csv', 'r') as data_fp:
+            metadata = process_dataset(
+                data_fp,
+                geo_data=self.geo_data,
+                coverage=True,
+                workers=2,
+            )
+        self.assertEqual(metadata, expected)
+
     def test_admin_ambiguous(self):
         """Test the resolution of ambiguous administrative areas"""
         def countries(areas):
@@ -1404,6 +1990,32 @@ class TestGeoHash(unittest.TestCase):
             [('', 4)],
         )
 
+    def test_location_codes(self):
+        """Test hashing many points into integers at once"""
+        points = [
+            (40.6962574, -73.9849621), (-90.0, 180.0), (0.0, 0.0),
+            (45.0, -90.0), (22.5, 45.0), (-89.9, -179.9),
+        ]
+        for base, precision in [(4, 16), (32, 12)]:
+            base_bits = base.bit_length() - 1
+            codes = spatial.location_codes(points, base, precision)
+            self.assertEqual(
+                [
+                    ''.join(
+                        spatial.GEOHASH_CHARS[
+                            (code >> (base_bits * (precision - 1 - i)))
+                            & (base - 1)
+                        ]
+                        for i in range(precision)
+                    )
+                    for code in codes.tolist()
+                ],
+                [
+                    spatial.hash_location(point, base, precision)
+                    for point in points
+                ],
+            )
+
     def test_sketch_aab(self):
         builder = spatial.Geohasher(
             base=4,
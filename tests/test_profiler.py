@@ -0,0 +1,149 @@
+import contextlib
+import elasticsearch
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import profiler
+
+
+class FakeElasticsearch(object):
+    def __init__(self, documents):
+        self.documents = documents
+
+    def get(self, index, id):
+        try:
+            return {'_source': self.documents[(index, id)]}
+        except KeyError:
+            raise elasticsearch.NotFoundError(404, 'not_found', {})
+
+
+PREVIOUS = {
+    'id': 'test.one',
+    'version': os.environ['DATAMART_VERSION'],
+    'content_hash': 'abc',
+    'manual_annotations': {'columns': [{'name': 'a'}]},
+    'nb_rows': 3,
+    'columns': [{'name': 'a', 'structural_type': 'integer'}],
+    'name': "Old name",
+}
+
+
+class TestReuseProfile(unittest.TestCase):
+    def setUp(self):
+        self.es = FakeElasticsearch({('datasets', 'test.one'): PREVIOUS})
+        self.metadata = {
+            'name': "New name",
+            'manual_annotations': {'columns': [{'name': 'a'}]},
+        }
+
+    def test_previous(self):
+        """Test getting a profile that can be reused"""
+        self.assertEqual(
+            profiler.get_previous_profile(
+                self.es, 'test.one', self.metadata, 'abc',
+            ),
+            PREVIOUS,
+        )
+
+    def test_previous_changed(self):
+        """Test not reusing a profile if anything changed"""
+        self.assertIsNone(profiler.get_previous_profile(
+            self.es, 'test.two', self.metadata, 'abc',
+        ))
+        self.assertIsNone(profiler.get_previous_profile(
+            self.es, 'test.one', self.metadata, 'def',
+        ))
+        self.assertIsNone(profiler.get_previous_profile(
+            self.es, 'test.one', dict(self.metadata, manual_annotations={}),
+            'abc',
+        ))
+        self.assertIsNone(profiler.get_previous_profile(
+            self.es, 'test.one',
+            dict(self.metadata, columns=[{'name': 'a'}]),
+            'abc',
+        ))
+        es = FakeElasticsearch({
+            ('datasets', 'test.one'): dict(PREVIOUS, version='v0.1'),
+        })
+        self.assertIsNone(profiler.get_previous_profile(
+            es, 'test.one', self.metadata, 'abc',
+        ))
+
+    def materialize(self, content_hash, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.csv')
+            with open(path, 'w') as fp:
+                fp.write('a\n1\n2\n3\n')
+
+            @contextlib.contextmanager
+            def get_dataset(metadata, dataset_id):
+                yield path
+
+            def process_dataset(data, metadata, **kw):
+                return dict(
+                    metadata,
+                    nb_rows=3,
+                    columns=[{'name': 'a', 'structural_type': 'float'}],
+                    profiling_stats={'stages': {}, 'columns': []},
+                )
+
+            lazo_client = mock.Mock()
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(mock.patch.object(
+                    profiler, 'get_dataset', get_dataset,
+                ))
+                stack.enter_context(mock.patch.object(
+                    profiler, 'detect_format_convert_to_csv',
+                    lambda path, convert, materialize: path,
+                ))
+                stack.enter_context(mock.patch.object(
+                    profiler, 'hash_file', lambda path: content_hash,
+                ))
+                process = stack.enter_context(mock.patch.object(
+                    profiler, 'process_dataset',
+                    side_effect=process_dataset,
+                ))
+                result = profiler.materialize_and_process_dataset(
+                    'test.one',
+                    dict(self.metadata, materialize={'identifier': 'x'}),
+                    lazo_client, None, None, threading.Semaphore(),
+                    **kwargs
+                )
+            return result, process, lazo_client
+
+    def test_reuse(self):
+        """Test reusing the previous profile when the data is the same"""
+        result, process, lazo_client = self.materialize('abc', es=self.es)
+        process.assert_not_called()
+        self.assertEqual(lazo_client.mock_calls, [])
+        self.assertEqual(
+            result,
+            {
+                'name': "New name",
+                'manual_annotations': {'columns': [{'name': 'a'}]},
+                'nb_rows': 3,
+                'columns': [{'name': 'a', 'structural_type': 'integer'}],
+                'content_hash': 'abc',
+                'materialize': {'identifier': 'x'},
+            },
+        )
+
+    def test_no_reuse(self):
+        """Test profiling again when the data changed"""
+        result, process, lazo_client = self.materialize('def', es=self.es)
+        process.assert_called_once()
+        self.assertIs(process.call_args[1]['lazo_client'], lazo_client)
+        self.assertEqual(result['columns'][0]['structural_type'], 'float')
+        self.assertEqual(result['content_hash'], 'def')
+
+    def test_reprofile(self):
+        """Test profiling again when asked, even if the data is the same"""
+        result, process, _ = self.materialize(
+            'abc', es=self.es, reprofile=True,
+        )
+        process.assert_called_once()
+        self.assertEqual(result['columns'][0]['structural_type'], 'float')
+        self.assertEqual(result['content_hash'], 'abc')